@@ -0,0 +1,175 @@
+import collections
+import queue
+import threading
+import time
+
+import numpy as np
+import requests
+
+from .frames import METRICS
+from .loadgen import SPREAD
+from .rules import OK, SEVERITIES
+
+# How far below a threshold a reading has to fall before the alert it raised clears, per
+# metric (a tenth of the metric's usual range, e.g. 1.5 °F for temperature)
+DEFAULT_MARGINS = {metric: float(SPREAD[i]) / 10 for i, metric in enumerate(METRICS)}
+
+
+# Turns the per-tick classification of common/rules.py into alert transitions. Every sensor has
+# an alert state (ok, warning or critical) that only changes when:
+#   - a sensor in alert stays in it until its readings fall below the thresholds minus
+#     `margins` (hysteresis), so a reading flapping around a threshold does not flap the alert
+#   - readings were at or above the new level for `raise_ticks` consecutive ticks when
+#     escalating, or below the current one for `clear_ticks` when de-escalating (minimum
+#     duration), so single-tick spikes never alert. Streaks count ticks at or above each
+#     level, so a sensor flapping between warning and critical still raises a warning.
+# Only changes of state are reported, so an alert is raised once however long it lasts. Each
+# tick is a few whole-array operations; the hysteresis check only classifies the sensors that
+# are in alert, and only transitions become Python objects.
+#
+# update() returns the transitions as JSON-ready dicts and hands them to `notifier` (e.g. a
+# WebhookNotifier), which never blocks. The state resizes itself (and starts over) when the
+# number of sensors changes.
+class AlertTracker:
+    def __init__(self, rules, margins=DEFAULT_MARGINS, raise_ticks=3, clear_ticks=5, notifier=None, metrics=METRICS, recent=100):
+        self.rules = rules
+        self.hold_rules = rules.relaxed(margins)
+        # Rows of metric-major values the rules look at, in rules.metrics order
+        self.rule_rows = [list(metrics).index(metric) for metric in rules.metrics]
+        self.raise_ticks = raise_ticks
+        self.clear_ticks = clear_ticks
+        self.notifier = notifier
+        self.state = None
+        # Last `recent` transitions, newest last, for dashboards
+        self.recent = collections.deque(maxlen=recent)
+        self.raised = self.cleared = 0
+
+    def _reset(self, n):
+        self.state = np.zeros(n, dtype=np.int8)
+        # Consecutive ticks at or above every level from WARNING up (one row per level), and
+        # below the sensor's current state
+        self.at_least = np.zeros((len(SEVERITIES) - 1, n), dtype=np.int32)
+        self.below = np.zeros(n, dtype=np.int32)
+
+    # values: (metrics x sensors) array, as in SensorState. `severity` and `offending` are the
+    # output of rules.classify() for the same values, when the caller has it already.
+    def update(self, values, severity=None, offending=None, timestamp=None):
+        now = time.time() if timestamp is None else timestamp
+        values = np.asarray(values)
+        if severity is None:
+            severity, offending = self.rules.classify(values[self.rule_rows])
+        if self.state is None or len(self.state) != len(severity):
+            self._reset(len(severity))
+        observed = severity.astype(np.int8)
+        # Hysteresis: a sensor in alert keeps its level while it is above the relaxed thresholds
+        alerting = np.flatnonzero(self.state > OK)
+        if len(alerting):
+            hold, _ = self.hold_rules.classify(values[self.rule_rows][:, alerting])
+            observed[alerting] = np.maximum(observed[alerting], np.minimum(hold, self.state[alerting]))
+        # Minimum duration. Being at or above a level implies being at or above every lower one,
+        # so the number of levels whose streak is long enough is the level to escalate to.
+        for level in range(len(self.at_least)):
+            self.at_least[level] = np.where(observed > level, self.at_least[level] + 1, 0)
+        self.below = np.where(observed < self.state, self.below + 1, 0)
+        raised = (self.at_least >= self.raise_ticks).sum(axis=0, dtype=np.int8)
+        target = np.where(raised > self.state, raised, np.where(self.below >= self.clear_ticks, observed, self.state))
+        changed = np.flatnonzero(target != self.state)
+        if len(changed) == 0:
+            return []
+        levels = target[changed]
+        self.below[changed] = 0
+        alerts = []
+        for sensor, previous, level, metric in zip(changed.tolist(), self.state[changed].tolist()
+                                                   , levels.tolist(), offending[changed].tolist()):
+            alert = {"sensor": sensor, "severity": SEVERITIES[level], "previous": SEVERITIES[previous], "time": now}
+            if level > OK and metric >= 0:
+                alert.update(metric=self.rules.metrics[metric], value=float(values[self.rule_rows[metric], sensor]))
+            alerts.append(alert)
+        self.state[changed] = levels
+        self.raised += int((levels > OK).sum())
+        self.cleared += int((levels == OK).sum())
+        self.recent.extend(alerts)
+        if self.notifier is not None:
+            self.notifier.submit(alerts)
+        return alerts
+
+
+# Collapses the transitions of one sensor within a batch into one, from its first previous
+# state to its last state, and drops sensors that ended where they started (e.g. an alert
+# raised and cleared again before the batch went out)
+def deduplicate(alerts):
+    first, last = {}, {}
+    for alert in alerts:
+        first.setdefault(alert["sensor"], alert)
+        last[alert["sensor"]] = alert
+    merged = []
+    for sensor, alert in last.items():
+        if first[sensor]["previous"] != alert["severity"]:
+            merged.append({**alert, "previous": first[sensor]["previous"]})
+    return merged
+
+
+# Delivers alerts to an HTTP webhook in the background. submit() only puts them on a bounded
+# queue (dropping, and counting, what does not fit), so the ingest loop never waits on the
+# network. The thread collects what arrives within `flush_interval` seconds (or `batch_size`
+# alerts), deduplicates it and POSTs one JSON body {"sent_at": ..., "alerts": [...]}.
+# Connection errors, timeouts, 429 and 5xx responses are retried with exponential backoff
+# (`backoff`, twice that, ...) up to `retries` times; other 4xx responses are not retried.
+class WebhookNotifier(threading.Thread):
+    def __init__(self, url, batch_size=500, flush_interval=2.0, retries=5, backoff=1.0, timeout=5.0, max_pending=10000):
+        super().__init__(daemon=True)
+        self.url = url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.queue = queue.Queue(max_pending)
+        self.session = requests.Session()
+        self.sent = self.failed = self.dropped = self.batches = 0
+        self.error = None
+
+    def submit(self, alerts):
+        for alert in alerts:
+            try:
+                self.queue.put_nowait(alert)
+            except queue.Full:
+                self.dropped += 1
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._deliver(deduplicate(batch))
+
+    def _deliver(self, alerts):
+        if not alerts:
+            return
+        body = {"sent_at": time.time(), "alerts": alerts}
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                response = self.session.post(self.url, json=body, timeout=self.timeout)
+                if response.status_code == 429 or response.status_code >= 500:
+                    self.error = f"{self.url} answered {response.status_code}"
+                    continue
+                response.raise_for_status()
+                self.sent += len(alerts)
+                self.batches += 1
+                self.error = None
+                return
+            except requests.exceptions.HTTPError as e:
+                self.error = e
+                break
+            except requests.exceptions.RequestException as e:
+                self.error = e
+        self.failed += len(alerts)
@@ -0,0 +1,174 @@
+import numpy as np
+import pandas as pd
+
+from .frames import METRICS
+from .loadgen import SPREAD
+
+
+# Streaming anomaly detection against a per-sensor baseline. Every sensor keeps exponentially
+# weighted statistics of every metric, stored as (metrics x sensors) arrays like SensorState,
+# and each tick is scored and folded into them with a few whole-array operations: no loop over
+# sensors and no look back at earlier ticks.
+#
+# A reading is anomalous when it is more than `z_limit` standard deviations from the sensor's
+# own mean, or when it moved more than `z_limit` times the sensor's usual tick-to-tick change
+# since the previous tick (a jump). The mean follows the readings within a few dozen ticks,
+# which would hide a slow drift, so every metric also has a long-term mean and variance (weight
+# `long_alpha`, or 1/(2 x readings) while that is larger) that a reading is scored against the
+# same way. While that long-term test flags a metric its variance is held, so a ramp or a
+# step stays flagged instead of widening the variance until it looks normal; the long-term
+# mean keeps following slowly, so a sensor that settles at a new level is accepted there
+# eventually. Scores are the ratio to the limit, so a score of 1 or more means flagged.
+# Sensors are not flagged until they have `warmup` readings (`long_warmup` for the long-term
+# test), and a standard deviation never counts as less than `min_std` (default 1% of the
+# metric's usual range), so a sensor that barely moves is not flagged for noise.
+class AnomalyDetector:
+    def __init__(self, n_sensors, metrics=METRICS, alpha=0.05, z_limit=4.0, min_std=None, warmup=40
+                 , long_alpha=0.0005, long_warmup=200, dtype=np.float32):
+        self.metrics = list(metrics)
+        self.alpha = alpha
+        self.long_alpha = long_alpha
+        self.warmup = warmup
+        self.long_warmup = long_warmup
+        # Per metric, as a column so it broadcasts over sensors
+        self.min_std = np.array([[(min_std or {}).get(metric, SPREAD[METRICS.index(metric)] / 100)] for metric in self.metrics]
+                                , dtype=dtype)
+        self.z_limit = z_limit
+        shape = (len(self.metrics), n_sensors)
+        # Mean and variance of the readings, variance of the change between ticks, last reading
+        self.mean = np.full(shape, np.nan, dtype=dtype)
+        self.var = np.zeros(shape, dtype=dtype)
+        self.change_var = np.zeros(shape, dtype=dtype)
+        self.last = np.full(shape, np.nan, dtype=dtype)
+        # Long-term mean and variance
+        self.long_mean = np.full(shape, np.nan, dtype=dtype)
+        self.long_var = np.zeros(shape, dtype=dtype)
+        self.count = np.zeros(n_sensors, dtype=np.int64)
+        # Work buffers reused every tick
+        self.deviation = np.empty(shape, dtype=dtype)
+        self.change = np.empty(shape, dtype=dtype)
+        self.long_deviation = np.empty(shape, dtype=dtype)
+        self.ratio = np.empty(shape, dtype=dtype)
+        self.change_ratio = np.empty(shape, dtype=dtype)
+        self.long_ratio = np.empty(shape, dtype=dtype)
+        self.work = np.empty(shape, dtype=dtype)
+
+    # Distance of `difference` in units of z_limit standard deviations `sqrt(var)`, into out
+    def _ratio(self, difference, var, out):
+        work = self.work
+        np.sqrt(var, out=work)
+        np.maximum(work, self.min_std, out=work)
+        work *= self.z_limit
+        np.abs(difference, out=out)
+        out /= work
+        return out
+
+    # Exponentially weighted update of `var` with the new `difference` where `update` is set:
+    #   var = (1 - alpha) * (var + alpha * difference^2)
+    # `alpha` is a scalar or a per-sensor row
+    def _fold(self, var, difference, update, alpha):
+        work = self.work
+        np.multiply(difference, difference, out=work)
+        work *= alpha
+        work += var
+        work *= 1 - alpha
+        np.copyto(var, work, where=update)
+
+    # Scores one tick of (metrics x sensors) values, then adds it to the baselines. Returns the
+    # flagged metric of every sensor (int8 index into self.metrics, -1 when normal) and its
+    # score (the largest over the metrics).
+    def update(self, values):
+        values = np.asarray(values, dtype=self.mean.dtype)
+        deviation, change, long_deviation, ratio = self.deviation, self.change, self.long_deviation, self.ratio
+        # NaN for missing readings and sensors without a baseline yet, which score nothing
+        np.subtract(values, self.mean, out=deviation)
+        np.subtract(values, self.last, out=change)
+        np.subtract(values, self.long_mean, out=long_deviation)
+        self._ratio(deviation, self.var, ratio)
+        np.fmax(ratio, self._ratio(change, self.change_var, self.change_ratio), out=ratio)
+        ratio[:, self.count < self.warmup] = np.nan
+        long_ratio = self._ratio(long_deviation, self.long_var, self.long_ratio)
+        long_ratio[:, self.count < self.long_warmup] = np.nan
+        np.fmax(ratio, long_ratio, out=ratio)
+        # Largest ratio per sensor, one metric row at a time (NaN is never greater)
+        score = np.zeros(ratio.shape[1], dtype=ratio.dtype)
+        metric = np.full(ratio.shape[1], -1, dtype=np.int8)
+        hit = np.empty(ratio.shape[1], dtype=bool)
+        for i, row in enumerate(ratio):
+            np.greater(row, score, out=hit)
+            np.copyto(score, row, where=hit)
+            metric[hit] = i
+        metric[score < 1] = -1
+
+        # Fold the readings into the baselines (mean += alpha * deviation)
+        known = ~np.isnan(deviation)
+        self._fold(self.var, deviation, known, self.alpha)
+        deviation *= self.alpha
+        np.add(self.mean, deviation, out=self.mean, where=known)
+        self._fold(self.change_var, change, ~np.isnan(change), self.alpha)
+        # Close to a running mean and variance until 1/(2 long_alpha) readings, so the long-term
+        # baseline is usable after long_warmup; the variance is held where it flags
+        long_alpha = np.maximum(self.long_alpha, 0.5 / np.maximum(self.count, 1)).astype(self.mean.dtype)
+        self._fold(self.long_var, long_deviation, known & ~(long_ratio >= 1), long_alpha)
+        long_deviation *= long_alpha
+        np.add(self.long_mean, long_deviation, out=self.long_mean, where=known)
+        # First reading of a sensor starts its baselines
+        seen = ~np.isnan(values)
+        np.copyto(self.mean, values, where=seen & ~known)
+        np.copyto(self.long_mean, values, where=seen & ~known)
+        np.copyto(self.last, values, where=seen)
+        self.count += seen.any(axis=0)
+        return metric, score
+
+
+# Readable anomaly per sensor ("normal", "anomalous (uv)", ...) as a categorical, from the
+# flagged metric returned by AnomalyDetector.update
+def describe_anomalies(metric, metrics=METRICS):
+    labels = ["normal"] + [f"anomalous ({name})" for name in metrics]
+    return pd.Categorical.from_codes(np.asarray(metric, dtype=int) + 1, labels)
+
+
+# Rows of a snapshot frame whose sensor is flagged, the `limit` highest scores first when there
+# are more, e.g. for a highlight layer over the map
+def flagged_rows(frame, limit=None):
+    rows = np.flatnonzero(frame["anomaly"].to_numpy() >= 0)
+    if limit is not None and len(rows) > limit:
+        scores = frame["anomaly_score"].to_numpy()[rows]
+        rows = rows[np.argpartition(scores, -limit)[-limit:]]
+    return frame.iloc[rows]
+
+
+# Drift check: sensors with 0.5 °F of noise around 70 °F (well inside the OK band) get a slow
+# ramp or a step once their baselines are established; every one of them has to be flagged
+# while steady sensors next to them are flagged on almost no ticks. Run with `python -m common.anomaly`.
+def check_drift(sensors=200, settle=400, ticks=400, seed=0):
+    rng = np.random.default_rng(seed)
+    cases = {"steady": 0.0, "ramp 0.02/tick": 0.02, "ramp 0.05/tick": 0.05, "ramp 0.1/tick": 0.1, "step +5": None}
+    detector = AnomalyDetector(sensors * len(cases))
+    values = np.full((len(METRICS), sensors * len(cases)), np.nan, dtype=np.float32)
+    offset = np.zeros((len(cases), sensors), dtype=np.float32)
+    flagged = np.zeros((len(cases), sensors), dtype=bool)
+    flagged_ticks = np.zeros((len(cases), sensors))
+    first = np.full((len(cases), sensors), -1)
+    for tick in range(settle + ticks):
+        if tick >= settle:
+            offset[:] = [[5.0 if slope is None else slope * (tick - settle)] for slope in cases.values()]
+        values[0] = 70 + offset.ravel() + 0.5 * rng.standard_normal(values.shape[1])
+        metric, _ = detector.update(values)
+        if tick >= settle:
+            hit = (metric >= 0).reshape(len(cases), sensors)
+            first[hit & ~flagged] = tick - settle
+            flagged |= hit
+            flagged_ticks += hit
+    steady = flagged_ticks[0].mean() / ticks
+    print(f"{'steady':<16} flagged on {steady:.2%} of ticks")
+    ok = steady < 0.005
+    for i, name in enumerate(list(cases)[1:], 1):
+        share = flagged[i].mean()
+        print(f"{name:<16} flagged {share:6.1%}" + (f", median after {np.median(first[i][flagged[i]]):.0f} ticks" if share else ""))
+        ok &= share == 1.0
+    return ok
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if check_drift() else 1)
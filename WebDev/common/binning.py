@@ -0,0 +1,157 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+from .frames import METRICS
+
+# Square root cell of the quadtree, (lon, lat) of its south-west corner and side in degrees.
+# It covers Tamil Nadu with some margin; sensors outside it are clamped to the edge cells.
+ORIGIN = (76.0, 7.8)
+SIDE = 6.4
+# Finest level: 2^12 x 2^12 cells of about 170 m
+MAX_LEVEL = 12
+# Target size of one cell on screen
+CELL_PIXELS = 16
+
+
+def _spread_bits(x):
+    # Interleave zeros between the low 16 bits, for Morton codes
+    x = x.astype(np.uint64)
+    x = (x | (x << np.uint64(8))) & np.uint64(0x00FF00FF)
+    x = (x | (x << np.uint64(4))) & np.uint64(0x0F0F0F0F)
+    x = (x | (x << np.uint64(2))) & np.uint64(0x33333333)
+    x = (x | (x << np.uint64(1))) & np.uint64(0x55555555)
+    return x
+
+
+# Quadtree level whose cells are about CELL_PIXELS wide at a web mercator zoom level
+def level_for_zoom(zoom, cell_pixels=CELL_PIXELS):
+    cell_degrees = 360.0 / 2 ** zoom * cell_pixels / 256
+    return int(min(MAX_LEVEL, max(0, round(math.log2(SIDE / cell_degrees)))))
+
+
+# Per-cell count, sum, min and max of every metric on a square quadtree over the state, at all
+# levels at once. Sensors never move, so they are sorted once by Morton code at the finest
+# level; every cell at every level is then a contiguous run of that order, and the children of
+# a cell are a contiguous run of the level below. A full frame is a few reduceat calls per
+# level. A delta frame only recomputes the finest cells holding the sensors it touched and
+# then their ancestors, each from at most four children.
+class SpatialBins:
+    def __init__(self, lat, lon, metrics=METRICS):
+        self.metrics = list(metrics)
+        size = 2 ** MAX_LEVEL
+        col = np.clip(((np.asarray(lon) - ORIGIN[0]) / SIDE * size).astype(np.int64), 0, size - 1)
+        row = np.clip(((np.asarray(lat) - ORIGIN[1]) / SIDE * size).astype(np.int64), 0, size - 1)
+        codes = _spread_bits(col) | (_spread_bits(row) << np.uint64(1))
+        self.order = np.argsort(codes, kind="stable")
+        self.rank = np.empty_like(self.order)
+        self.rank[self.order] = np.arange(len(self.order))
+        codes = codes[self.order]
+        # Per level: Morton codes of the occupied cells, where each cell's children start in the
+        # level below (the sorted sensors below the finest level), and the cell of every child
+        self.codes, self.starts, self.parent = ([None] * (MAX_LEVEL + 1) for _ in range(3))
+        child_codes = codes
+        for level in range(MAX_LEVEL, -1, -1):
+            cell_of_child = child_codes if level == MAX_LEVEL else child_codes >> np.uint64(2)
+            first = np.ones(len(cell_of_child), dtype=bool)
+            first[1:] = cell_of_child[1:] != cell_of_child[:-1]
+            starts = np.flatnonzero(first)
+            self.codes[level] = child_codes = cell_of_child[starts]
+            self.starts[level] = starts
+            self.parent[level] = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(cell_of_child))))
+        # Per-sensor leaves in Morton order, then per-level statistics (cells x metrics)
+        self.leaf = self._empty(len(self.order))
+        self.stats = [self._empty(len(codes)) for codes in self.codes]
+
+    def _empty(self, n):
+        k = len(self.metrics)
+        return {"count": np.zeros((n, k)), "sum": np.zeros((n, k))
+                , "min": np.full((n, k), np.nan), "max": np.full((n, k), np.nan)}
+
+    def _children(self, level):
+        return self.stats[level + 1] if level < MAX_LEVEL else self.leaf
+
+    def _reduce(self, level, cells=None):
+        children, stats, starts = self._children(level), self.stats[level], self.starts[level]
+        n_children = len(children["count"])
+        if cells is None:
+            cells, index, segments = slice(None), slice(None), starts
+        else:
+            ends = np.append(starts[1:], n_children)[cells]
+            lengths = ends - starts[cells]
+            segments = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            # Positions of the children of every touched cell, concatenated
+            index = np.arange(lengths.sum()) - np.repeat(segments - starts[cells], lengths)
+        if len(segments) == 0:
+            return
+        stats["count"][cells] = np.add.reduceat(children["count"][index], segments)
+        stats["sum"][cells] = np.add.reduceat(children["sum"][index], segments)
+        stats["min"][cells] = np.fmin.reduceat(children["min"][index], segments)
+        stats["max"][cells] = np.fmax.reduceat(children["max"][index], segments)
+
+    # values: (metrics x sensors) array in sensor id order, as in SensorState. ids: the sensors
+    # that changed since the last update, or None to rebuild everything.
+    def update(self, values, ids=None):
+        if ids is None:
+            positions, sensors = slice(None), self.order
+        else:
+            sensors = np.unique(np.asarray(ids, dtype=np.intp))
+            # A delta where nothing moved leaves every cell as it is
+            if len(sensors) == 0:
+                return
+            positions = self.rank[sensors]
+        readings = values[:, sensors].T
+        missing = np.isnan(readings)
+        self.leaf["count"][positions] = ~missing
+        self.leaf["sum"][positions] = np.where(missing, 0.0, readings)
+        self.leaf["min"][positions] = readings
+        self.leaf["max"][positions] = readings
+        cells = None if ids is None else np.unique(self.parent[MAX_LEVEL][positions])
+        for level in range(MAX_LEVEL, -1, -1):
+            self._reduce(level, cells)
+            if cells is not None and level > 0:
+                cells = np.unique(self.parent[level - 1][cells])
+
+    # Occupied cells of one level as a DataFrame: cell centre, sensor count, and per metric the
+    # mean (under the metric's own name), sum, min and max. `bounds` (lon_min, lat_min,
+    # lon_max, lat_max) keeps only the cells inside a viewport.
+    def cells(self, level, bounds=None):
+        size = 2 ** level
+        codes = self.codes[level]
+        col = np.zeros(len(codes), dtype=np.int64)
+        row = np.zeros(len(codes), dtype=np.int64)
+        for bit in range(level):
+            col |= ((codes >> np.uint64(2 * bit)) & np.uint64(1)).astype(np.int64) << bit
+            row |= ((codes >> np.uint64(2 * bit + 1)) & np.uint64(1)).astype(np.int64) << bit
+        lon = ORIGIN[0] + (col + 0.5) * SIDE / size
+        lat = ORIGIN[1] + (row + 0.5) * SIDE / size
+        stats = self.stats[level]
+        keep = stats["count"].max(axis=1) > 0
+        if bounds is not None:
+            lon_min, lat_min, lon_max, lat_max = bounds
+            half = SIDE / size / 2
+            keep &= (lon + half >= lon_min) & (lon - half <= lon_max) & (lat + half >= lat_min) & (lat - half <= lat_max)
+        frame = pd.DataFrame({"lat": lat[keep], "lon": lon[keep], "count": stats["count"][keep].max(axis=1).astype(int)})
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = stats["sum"][keep] / stats["count"][keep]
+        for i, metric in enumerate(self.metrics):
+            frame[metric] = mean[:, i]
+            frame[f"{metric}_sum"] = stats["sum"][keep, i]
+            frame[f"{metric}_min"] = stats["min"][keep, i]
+            frame[f"{metric}_max"] = stats["max"][keep, i]
+        return frame
+
+
+# Longitude/latitude box visible in a view of width x height pixels, for SpatialBins.cells
+def view_bounds(latitude, longitude, zoom, width=1200, height=800):
+    degrees_per_pixel = 360.0 / (256 * 2 ** zoom)
+    half_lon = width / 2 * degrees_per_pixel
+    # Mercator stretches latitude; scale by cos(lat) so the box is not too small
+    half_lat = height / 2 * degrees_per_pixel * math.cos(math.radians(latitude))
+    return longitude - half_lon, latitude - half_lat, longitude + half_lon, latitude + half_lat
+
+
+# Radius in metres of a circle filling one cell of `level`, for a ScatterplotLayer
+def cell_radius(level):
+    return SIDE / 2 ** level * 111_320 / 2
@@ -0,0 +1,320 @@
+import asyncio
+import itertools
+import queue
+import threading
+import time
+
+from .delta import DeltaEncoder
+from .frames import FULL, METRICS, encode_frame, sse_message
+
+
+# Turns one tick of readings (one row per sensor id, one column per metric) into the SSE
+# message for one combination of request options. Subscribers asking for the same options
+# share an encoder, so each tick is serialized once per format rather than once per client.
+class FrameEncoder:
+    def __init__(self, registry, fmt="json", coords=False, keyframe_interval=None):
+        self.registry = registry
+        self.fmt = fmt
+        self.coords = coords
+        self.delta = DeltaEncoder(keyframe_interval) if keyframe_interval else None
+        # Ticks encoded so far, the last one pushed to clients, and the last catch-up frame
+        # built with the tick it matches
+        self.version = 0
+        self.pushed = 0
+        self.cached = None
+
+    def _message(self, readings, rows, kind):
+        columns = {"id": self.registry.ids[rows]}
+        for i, metric in enumerate(METRICS):
+            columns[metric] = readings[rows, i]
+        if self.coords:
+            columns["lon"] = self.registry.lon[rows]
+            columns["lat"] = self.registry.lat[rows]
+        return sse_message(encode_frame(columns, self.fmt, kind)).encode("utf-8")
+
+    def encode(self, readings):
+        kind, rows = FULL, self.registry.ids
+        if self.delta is not None:
+            kind, rows = self.delta.update(readings)
+        self.version += 1
+        return self._message(readings, rows, kind)
+
+    # Full frame matching what delta subscribers have been sent so far, for clients that join
+    # mid-stream or lost frames. Plain full-frame streams never need one. Built at most once
+    # per tick and shared by every client that needs it; only the producer calls this, since
+    # encode() patches the state it reads.
+    def catch_up(self):
+        if self.delta is None or self.delta.last_sent is None:
+            return None
+        if self.cached is None or self.cached[0] != self.version:
+            self.cached = (self.version, self._message(self.delta.last_sent, self.registry.ids, FULL))
+        return self.cached[1]
+
+
+class Subscription:
+    _ids = itertools.count()
+
+    def __init__(self, key, queue):
+        self.id = next(self._ids)
+        self.key = key
+        self.queue = queue
+        self.sent = 0
+        self.dropped = 0
+        self.connected_at = time.time()
+        # When the client last had frames waiting that it had not picked up yet
+        self.behind_since = None
+        # Set by AsyncBroadcaster so an evicted client's coroutine can be cancelled
+        self.task = None
+        # Delta client whose backlog was dropped without a catch-up frame at hand; it gets
+        # one with the next tick instead of that tick's delta
+        self.needs_catch_up = False
+
+    def _clear(self):
+        while True:
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except (queue.Empty, asyncio.QueueEmpty):
+                return
+
+    # Never blocks the producer. Once `limit` frames are waiting the oldest one is dropped to
+    # make room for the new frame. Delta streams cannot skip a frame without leaving the
+    # client with the wrong state, so their backlog is replaced with one catch-up frame
+    # instead: `catch_up`, the tick's shared catch-up frame when the producer built one, or
+    # else the one of the next tick. A limit of 1 means the client only ever sees the latest
+    # frame.
+    def push(self, message, limit, delta=False, catch_up=None):
+        if self.queue.qsize() and self.behind_since is None:
+            self.behind_since = time.monotonic()
+        if self.needs_catch_up:
+            if catch_up is not None:
+                self.needs_catch_up = False
+                self.queue.put_nowait(catch_up)
+            return
+        if self.queue.qsize() < limit:
+            self.queue.put_nowait(message)
+            return
+        if delta:
+            self._clear()
+            if catch_up is not None:
+                self.queue.put_nowait(catch_up)
+            else:
+                self.needs_catch_up = True
+            return
+        try:
+            self.queue.get_nowait()
+            self.dropped += 1
+        except (queue.Empty, asyncio.QueueEmpty):
+            pass
+        self.queue.put_nowait(message)
+
+    # The consumer picked up a frame; it has caught up once nothing else is waiting
+    def taken(self):
+        self.sent += 1
+        if self.queue.qsize() == 0:
+            self.behind_since = None
+
+    # Drop the backlog and wake the consumer with None so its stream ends
+    def close(self):
+        self._clear()
+        self.queue.put_nowait(None)
+
+
+# Slow-consumer policies: "drop-oldest" lets up to queue_size frames wait per client and drops
+# the oldest one for each new frame (delta streams start over from a catch-up frame), "latest"
+# keeps only the newest frame so a stalled client skips straight to the present
+POLICIES = ("drop-oldest", "latest")
+
+
+# Command line options shared by the data servers
+def add_backpressure_arguments(parser):
+    parser.add_argument("--queue-size", type=int, default=16, help="frames buffered per client")
+    parser.add_argument("--policy", choices=POLICIES, default="drop-oldest", help="what to drop for slow clients")
+    parser.add_argument("--max-lag", type=float, default=None
+                        , help="disconnect clients that stay behind for longer than this many seconds")
+
+
+# One producer thread builds every tick once and fans the encoded bytes out to bounded
+# per-client queues. `produce()` returns the readings for a tick and `make_encoder(key)`
+# builds the encoder for one set of request options. Clients that have stayed behind for
+# longer than `max_lag` seconds are disconnected.
+class Broadcaster:
+    def __init__(self, produce, make_encoder, interval=1.0, queue_size=16, policy="drop-oldest", max_lag=None):
+        self.produce = produce
+        self.make_encoder = make_encoder
+        self.interval = interval
+        self.encoders = {}
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.tick = 0
+        self.evicted = 0
+        self.producer = None
+        self.configure(queue_size, policy, max_lag)
+
+    def configure(self, queue_size=16, policy="drop-oldest", max_lag=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        self.queue_size = queue_size
+        self.policy = policy
+        self.max_lag = max_lag
+
+    def _start(self):
+        # Started on the first subscriber, so Flask's reloader parent never runs a producer
+        if self.producer is None:
+            self.producer = threading.Thread(target=self._run, daemon=True)
+            self.producer.start()
+
+    def _new_queue(self):
+        # One extra slot so close() always has room for its sentinel
+        return queue.Queue(self.queue_size + 1)
+
+    # Never encodes: a delta client joining mid-stream starts from the encoder's cached
+    # catch-up frame when it is at least as new as the last pushed tick, or else waits for the
+    # catch-up the producer builds with the next tick
+    def subscribe(self, key):
+        subscription = Subscription(key, self._new_queue())
+        with self.lock:
+            encoder = self.encoders.get(key)
+            if encoder is None:
+                encoder = self.encoders[key] = self.make_encoder(key)
+            if encoder.delta is not None and encoder.pushed:
+                cached = encoder.cached
+                if cached is not None and cached[0] >= encoder.pushed:
+                    subscription.queue.put_nowait(cached[1])
+                else:
+                    subscription.needs_catch_up = True
+            self.subscribers.add(subscription)
+            self._start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+            if not any(other.key == subscription.key for other in self.subscribers):
+                self.encoders.pop(subscription.key, None)
+
+    # Encode once per distinct set of options. Only the set of encoders is taken under
+    # self.lock: produce() may sleep until its next tick is due (replays) and a large encode
+    # takes a while, and neither should hold up clients connecting or /stats.
+    #
+    # Clients whose queue is full (or that wait for one) get a catch-up frame instead of a
+    # delta; it is built here too, once per encoder and only when some client needs it.
+    def _encode_tick(self, readings):
+        limit = self._limit()
+        with self.lock:
+            encoders = dict(self.encoders)
+            lagging = {s.key for s in self.subscribers if s.needs_catch_up or s.queue.qsize() >= limit}
+        messages = {key: encoder.encode(readings) for key, encoder in encoders.items()}
+        catch_ups = {key: encoders[key].catch_up() for key in lagging if key in encoders}
+        self.tick += 1
+        return encoders, messages, catch_ups
+
+    def _limit(self):
+        return 1 if self.policy == "latest" else self.queue_size
+
+    # Hand every client the same bytes. Clients that subscribed after the tick was encoded
+    # with options nobody else uses simply wait for the next tick, and so do clients whose
+    # encoder was dropped and recreated meanwhile: the tick's delta came from the old one.
+    def _push(self, encoders, messages, catch_ups):
+        limit = self._limit()
+        now = time.monotonic()
+        for key, encoder in encoders.items():
+            if self.encoders.get(key) is encoder:
+                encoder.pushed = encoder.version
+        for subscription in list(self.subscribers):
+            encoder = encoders.get(subscription.key)
+            if self.max_lag is not None and subscription.behind_since is not None \
+                    and now - subscription.behind_since > self.max_lag:
+                self._evict(subscription)
+            elif encoder is not None and self.encoders.get(subscription.key) is encoder:
+                subscription.push(messages[subscription.key], limit, encoder.delta is not None, catch_ups.get(subscription.key))
+
+    def _evict(self, subscription):
+        self.evicted += 1
+        self.subscribers.discard(subscription)
+        subscription.close()
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while True:
+            tick = self._encode_tick(self.produce())
+            with self.lock:
+                self._push(*tick)
+            next_tick += self.interval
+            time.sleep(max(0.0, next_tick - time.monotonic()))
+
+    # Generator for a streaming response; unsubscribes when the client goes away
+    def stream(self, key):
+        subscription = self.subscribe(key)
+        try:
+            while True:
+                message = subscription.queue.get()
+                if message is None:
+                    return
+                subscription.taken()
+                yield message
+        finally:
+            self.unsubscribe(subscription)
+
+    def stats(self):
+        with self.lock:
+            subscribers = sorted(self.subscribers, key=lambda s: s.id)
+        return {
+            "tick": self.tick,
+            "policy": self.policy,
+            "queue_size": self.queue_size,
+            "max_lag": self.max_lag,
+            "evicted": self.evicted,
+            "subscribers": len(subscribers),
+            "clients": [
+                {"id": s.id, "options": list(s.key), "connected_at": s.connected_at
+                 , "sent": s.sent, "dropped": s.dropped, "queued": s.queue.qsize()
+                 , "behind_for": time.monotonic() - s.behind_since if s.behind_since is not None else 0.0}
+                for s in subscribers
+            ],
+        }
+
+
+# Same fan-out on an asyncio event loop: subscribers are coroutines waiting on asyncio queues
+# instead of one OS thread each. Encoding runs in the default executor, without self.lock, so a
+# large tick never stalls the loop; pushing to the queues happens back on the loop thread.
+class AsyncBroadcaster(Broadcaster):
+    def _new_queue(self):
+        return asyncio.Queue(self.queue_size + 1)
+
+    def _start(self):
+        if self.producer is None:
+            self.producer = asyncio.get_running_loop().create_task(self._run_async())
+
+    # A client stuck in a blocked write never reads its sentinel, so cancel its task as well
+    def _evict(self, subscription):
+        super()._evict(subscription)
+        if subscription.task is not None:
+            subscription.task.cancel()
+
+    def _produce_and_encode(self):
+        return self._encode_tick(self.produce())
+
+    async def _run_async(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            tick = await loop.run_in_executor(None, self._produce_and_encode)
+            # Only held for the pushes, which never encode
+            with self.lock:
+                self._push(*tick)
+            next_tick += self.interval
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+
+    async def stream(self, key):
+        subscription = self.subscribe(key)
+        subscription.task = asyncio.current_task()
+        try:
+            while True:
+                message = await subscription.queue.get()
+                if message is None:
+                    return
+                subscription.taken()
+                yield message
+        finally:
+            self.unsubscribe(subscription)
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+# Fill colours at the low and high end of the scale, and for districts without readings
+LOW_COLOR = np.array([173, 216, 230])
+HIGH_COLOR = np.array([220, 50, 50])
+EMPTY_COLOR = [200, 200, 200, 60]
+
+
+# Per-district sensor count, mean and max of `metric`, and number of critical sensors, for a
+# frame with the categorical "district" column of SensorState.to_frame(). The district of every
+# sensor comes from the registry, so a tick is a few bincounts over the integer codes instead
+# of a point-in-polygon test. Sensors outside every district or without a reading yet are
+# left out.
+def district_summary(frame, metric, critical):
+    district = frame["district"].array
+    codes = np.asarray(district.codes)
+    values = frame[metric].to_numpy(dtype=float)
+    valid = (codes >= 0) & ~np.isnan(values)
+    codes, values = codes[valid], values[valid]
+    n = len(district.categories)
+    sensors = np.bincount(codes, minlength=n)
+    total = np.bincount(codes, weights=values, minlength=n)
+    peak = np.full(n, np.nan)
+    np.fmax.at(peak, codes, values)
+    critical_count = np.bincount(codes, weights=np.asarray(critical, dtype=float)[valid], minlength=n)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / sensors
+    return pd.DataFrame({"sensors": sensors, "mean": mean, "max": peak, "critical": critical_count.astype(int)}
+                        , index=district.categories)
+
+
+# Copy of the district geojson with each district's summary and fill colour in its properties,
+# ready for a GeoJsonLayer with get_fill_color="properties.fill". Colours run from LOW_COLOR at
+# `low` to HIGH_COLOR at `high` (default: the range of the district means). Geometries are
+# shared with the input, not copied.
+def choropleth_geojson(geojson, summary, low=None, high=None):
+    summary = summary[summary["sensors"] > 0]
+    low = summary["mean"].min() if low is None else low
+    high = summary["mean"].max() if high is None else high
+    scale = np.clip((summary["mean"] - low) / ((high - low) or 1.0), 0.0, 1.0).to_numpy()
+    fills = np.rint(LOW_COLOR + scale[:, None] * (HIGH_COLOR - LOW_COLOR)).astype(int)
+    rows = {name: (row, fill) for (name, row), fill in zip(summary.iterrows(), fills)}
+    features = []
+    for feature in geojson["features"]:
+        properties = dict(feature["properties"])
+        name = properties["NAME_2"]
+        if name in rows:
+            row, fill = rows[name]
+            properties.update(sensors=int(row["sensors"]), mean=round(float(row["mean"]), 2), max=round(float(row["max"]), 2)
+                              , critical=int(row["critical"]), fill=[*fill.tolist(), 180])
+        else:
+            properties.update(sensors=0, mean=None, max=None, critical=0, fill=EMPTY_COLOR)
+        features.append({**feature, "properties": properties})
+    return {**geojson, "features": features}
@@ -0,0 +1,93 @@
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from .frames import METRICS
+from .loadgen import BASELINE, SPREAD
+
+# Colour for sensors without a reading
+MISSING_COLOR = (128, 128, 128, 80)
+# Diverging ramp (blue - light grey - red), as RGB stops from low to high
+RAMP = np.array([[59, 76, 192], [221, 221, 221], [180, 4, 38]], dtype=float)
+
+
+# (size x 4) uint8 table interpolated linearly between RGB stops
+def ramp_table(stops=RAMP, alpha=255, size=256):
+    stops = np.asarray(stops, dtype=float)
+    position = np.linspace(0, len(stops) - 1, size)
+    lower = np.minimum(position.astype(int), len(stops) - 2)
+    weight = (position - lower)[:, None]
+    rgb = stops[lower] * (1 - weight) + stops[lower + 1] * weight
+    return np.column_stack((np.rint(rgb), np.full(size, alpha))).astype(np.uint8)
+
+
+# Maps a column of values to RGBA through a small colour table: each palette only turns the
+# values into row indices of its table (the last row is the missing colour), and one np.take
+# per channel writes the colours into a (4 x n) uint8 array. Channel-major output keeps every
+# channel contiguous, so it becomes r/g/b/a frame columns without a copy per row.
+class Palette(ABC):
+    def __init__(self, table, missing=MISSING_COLOR):
+        self.table = np.ascontiguousarray(np.vstack((table, missing)).T, dtype=np.uint8)
+
+    # Row of the table for every value (a new intp array; NaN rows are overwritten afterwards)
+    @abstractmethod
+    def index(self, values):
+        pass
+
+    # (4 x n) uint8 colours of `values`; pass `out` to reuse a preallocated buffer
+    def rgba(self, values, out=None):
+        values = np.asarray(values, dtype=float)
+        index = self.index(values)
+        index[np.isnan(values)] = self.table.shape[1] - 1
+        if out is None:
+            out = np.empty((4, len(values)), dtype=np.uint8)
+        for channel in range(4):
+            np.take(self.table[channel], index, out=out[channel], mode="clip")
+        return out
+
+
+# Discrete colours between increasing bin edges: values below edges[0] take colors[0], values
+# in [edges[i - 1], edges[i]) take colors[i], values at or above edges[-1] take colors[-1].
+class BinnedPalette(Palette):
+    def __init__(self, edges, colors, alpha=255, missing=MISSING_COLOR):
+        if len(colors) != len(edges) + 1:
+            raise ValueError("A binned palette needs one more colour than bin edges.")
+        self.edges = np.asarray(edges, dtype=float)
+        table = [list(color) + [alpha] if len(color) == 3 else list(color) for color in colors]
+        super().__init__(table, missing)
+
+    def index(self, values):
+        return np.searchsorted(self.edges, values, side="right")
+
+
+# Continuous colours from `low` to `high` through a ramp sampled into `size` entries; values
+# outside the range take the end colours.
+class ContinuousPalette(Palette):
+    def __init__(self, low, high, stops=RAMP, alpha=255, size=256, missing=MISSING_COLOR):
+        self.low = float(low)
+        self.scale = (size - 1) / ((float(high) - self.low) or 1.0)
+        self.size = size
+        super().__init__(ramp_table(stops, alpha, size), missing)
+
+    def index(self, values):
+        scaled = (values - self.low) * self.scale
+        np.clip(scaled, 0, self.size - 1, out=scaled)
+        return np.nan_to_num(scaled, nan=0.0).astype(np.intp)
+
+
+# Default palette per metric: the original temperature bins (cool / moderate / hot), and a
+# continuous ramp over the usual range of every other metric
+PALETTES = {
+    metric: ContinuousPalette(BASELINE[i] - SPREAD[i], BASELINE[i] + SPREAD[i])
+    for i, metric in enumerate(METRICS)
+}
+PALETTES["temperature"] = BinnedPalette([50, 60], [[173, 216, 230], [144, 238, 144], [255, 182, 193]])
+
+
+# Adds uint8 "r", "g", "b" and "a" columns with the colour of `metric` to a frame (in place), for
+# layers with get_fill_color="[r, g, b, a]"
+def add_color_columns(frame, metric, palettes=PALETTES):
+    rgba = palettes[metric].rgba(frame[metric].to_numpy(dtype=float))
+    for channel, name in enumerate("rgba"):
+        frame[name] = rgba[channel]
+    return frame
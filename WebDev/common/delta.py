@@ -0,0 +1,66 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from .frames import DELTA, FULL, METRICS
+
+# Smallest change per metric that is worth sending to the dashboards
+DEFAULT_TOLERANCES = {"temperature": 0.5, "uv": 0.1, "humidity": 0.5, "pressure": 1.0, "airQuality": 2.0}
+
+
+# Server side: decides per tick which sensors to send. Every `keyframe_interval` seconds all
+# sensors are sent; in between only the ones that moved more than the tolerance on any metric
+# since the value the client last received, or whose reading appeared or went missing.
+class DeltaEncoder:
+    def __init__(self, keyframe_interval=10, tolerances=DEFAULT_TOLERANCES, metrics=METRICS):
+        self.metrics = list(metrics)
+        self.tolerance = np.array([tolerances[metric] for metric in self.metrics])
+        self.keyframe_interval = keyframe_interval
+        self.last_sent = None
+        self.last_keyframe = 0.0
+
+    # `values` has one row per sensor id and one column per metric, in self.metrics order.
+    # Returns the frame kind and the indices of the rows to send.
+    def update(self, values, now=None):
+        now = time.monotonic() if now is None else now
+        if self.last_sent is None or self.last_sent.shape != values.shape \
+                or now - self.last_keyframe >= self.keyframe_interval:
+            self.last_sent = np.array(values, dtype=float)
+            self.last_keyframe = now
+            return FULL, np.arange(len(values))
+        # A reading appearing or going missing (NaN, e.g. a stale intake sensor) is a change too
+        moved = (np.abs(values - self.last_sent) > self.tolerance) | (np.isnan(values) != np.isnan(self.last_sent))
+        changed = np.flatnonzero(moved.any(axis=1))
+        self.last_sent[changed] = values[changed]
+        return DELTA, changed
+
+
+# Client side: latest reading of every sensor, patched in place as frames arrive. Values are
+# stored metric-major so to_frame() can wrap them in a DataFrame without copying, and the
+# static positions come from the registry once instead of with every frame.
+class SensorState:
+    def __init__(self, registry, metrics=METRICS):
+        self.metrics = list(metrics)
+        self.ids = registry.index.to_numpy()
+        self.lat = registry["lat"].to_numpy()
+        self.lon = registry["lon"].to_numpy()
+        # Categorical, so grouping by district works on the integer codes
+        self.district = pd.Categorical(registry["district"] if "district" in registry else [None] * len(registry))
+        self.values = np.full((len(self.metrics), len(registry)), np.nan)
+
+    # Full and delta frames are merged the same way; a full frame simply touches every row
+    def apply(self, frame):
+        if len(frame) == 0:
+            return
+        ids = frame["id"].to_numpy().astype(np.intp)
+        for i, metric in enumerate(self.metrics):
+            self.values[i, ids] = frame[metric].to_numpy()
+
+    def to_frame(self):
+        frame = pd.DataFrame(self.values.T, columns=self.metrics, copy=False)
+        frame.insert(0, "id", self.ids)
+        frame.insert(1, "lat", self.lat)
+        frame.insert(2, "lon", self.lon)
+        frame.insert(3, "district", self.district)
+        return frame
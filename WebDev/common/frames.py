@@ -0,0 +1,140 @@
+import base64
+import json
+import struct
+
+import numpy as np
+import pandas as pd
+
+# Measurements carried by every frame, in the order the server produces them
+METRICS = ["temperature", "uv", "humidity", "pressure", "airQuality"]
+
+# Frame kinds: a full frame holds every sensor, a delta frame only the sensors that changed
+FULL, DELTA = 0, 1
+
+# Binary frame layout (little endian):
+#   "SNSR" | kind (u8) | pad (u8) | fields (u16) | rows (u32) | length of names (u16)
+#   comma separated field names, zero padded up to a multiple of 8 bytes
+#   one packed float32 array of `rows` values per field, in the order of the names
+MAGIC = b"SNSR"
+HEADER = struct.Struct("<4sBxHIH")
+DTYPE = np.dtype("<f4")
+
+
+def _padded(size):
+    return (size + 7) & ~7
+
+
+# Column as a list of Python values, with null (None) for missing and non-finite readings, which
+# JSON has no token for
+def json_values(column):
+    column = np.asarray(column)
+    values = column.tolist()
+    if column.dtype.kind == "f":
+        for i in np.flatnonzero(~np.isfinite(column)).tolist():
+            values[i] = None
+    return values
+
+
+# Encode a dict of equally sized columns as the original JSON list of per-sensor dicts.
+# Delta frames are wrapped in an object so old consumers never mistake them for full frames.
+def encode_json(columns, kind=FULL):
+    names = list(columns)
+    rows = zip(*(json_values(columns[name]) for name in names))
+    readings = [dict(zip(names, row)) for row in rows]
+    if kind == DELTA:
+        return json.dumps({"kind": "delta", "readings": readings}, allow_nan=False)
+    return json.dumps(readings, allow_nan=False)
+
+
+# Encode a dict of equally sized columns as one packed float32 array per field
+def encode_binary(columns, kind=FULL):
+    names = list(columns)
+    block = np.empty((len(names), len(columns[names[0]]) if names else 0), dtype=DTYPE)
+    for i, name in enumerate(names):
+        block[i] = columns[name]
+    name_bytes = ",".join(names).encode("ascii")
+    header = HEADER.pack(MAGIC, kind, len(names), block.shape[1], len(name_bytes)) + name_bytes
+    return header.ljust(_padded(len(header)), b"\0") + block.tobytes()
+
+
+def encode_frame(columns, fmt="json", kind=FULL):
+    if fmt == "binary":
+        return base64.b64encode(encode_binary(columns, kind)).decode("ascii")
+    return encode_json(columns, kind)
+
+
+# Wrap an encoded payload as a single SSE message
+def sse_message(payload):
+    return f"data: {payload}\n\n"
+
+
+# Yield the payload of every "data:" line from an iterable of raw byte chunks. Unlike
+# requests' iter_lines this never re-scans or re-concatenates a partial line, so multi-megabyte
+# frames cost linear time.
+def iter_sse_data(chunks):
+    buffer = bytearray()
+    for chunk in chunks:
+        search_from = len(buffer)
+        buffer += chunk
+        while True:
+            end = buffer.find(b"\n", search_from)
+            if end < 0:
+                break
+            line = bytes(buffer[:end]).rstrip(b"\r")
+            del buffer[:end + 1]
+            search_from = 0
+            if line.startswith(b"data:"):
+                yield line[5:]
+
+
+# (kind, field names, fields x rows float32 block) of a binary frame, without copying the block
+def decode_block(raw):
+    magic, kind, fields, rows, names_len = HEADER.unpack_from(raw, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a binary sensor frame.")
+    names_start = HEADER.size
+    names = raw[names_start:names_start + names_len].decode("ascii").split(",") if fields else []
+    offset = _padded(names_start + names_len)
+    block = np.frombuffer(raw, dtype=DTYPE, count=rows * fields, offset=offset).reshape(fields, rows)
+    return kind, names, block
+
+
+# Build a DataFrame straight on top of the received buffer. The float32 block is laid out
+# field-major, which is exactly how pandas stores a single-dtype block, so no column is copied.
+# The resulting frame is read-only; add new columns rather than writing into existing ones.
+# The frame kind is kept in frame.attrs["kind"].
+def decode_binary(raw):
+    kind, names, block = decode_block(raw)
+    frame = pd.DataFrame(block.T, columns=names, copy=False)
+    frame.attrs["kind"] = kind
+    return frame
+
+
+# Kind of an encoded payload without decoding it: JSON full frames are lists and delta frames
+# objects; binary frames carry it in the header, i.e. in the first 8 base64 characters.
+def payload_kind(payload):
+    payload = payload.lstrip()
+    if payload.startswith("["):
+        return FULL
+    if payload.startswith("{"):
+        return DELTA
+    return base64.b64decode(payload[:8])[4]
+
+
+# Decode the text after "data:" in either format. JSON frames always start with "[" or "{",
+# neither of which can be the first character of a base64 payload.
+def decode_payload(payload):
+    payload = payload.strip()
+    if payload.startswith(("[", "{")):
+        data = json.loads(payload)
+        kind = FULL
+        if isinstance(data, dict):
+            kind = DELTA if data.get("kind") == "delta" else FULL
+            data = data.get("readings")
+        if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+            raise ValueError("Data format is incorrect.")
+        # A delta where nothing moved still has the columns consumers index by
+        frame = pd.DataFrame(data) if data else pd.DataFrame(columns=["id"] + METRICS, dtype=float)
+        frame.attrs["kind"] = kind
+        return frame
+    return decode_binary(base64.b64decode(payload))
@@ -0,0 +1,89 @@
+import functools
+import json
+import os
+
+import numpy as np
+
+# District boundaries shipped with the repo
+GEOJSON_PATH = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "JSON", "TamilNadu.geojson"))
+
+
+def load_geojson(path=GEOJSON_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+# Bounding box of every feature as (lon_min, lat_min, lon_max, lat_max)
+def geojson_bounds(geojson):
+    lons, lats = [], []
+    for feature in geojson["features"]:
+        for polygon in _polygons(feature):
+            for ring in polygon:
+                ring = np.asarray(ring, dtype=float)
+                lons.append(ring[:, 0])
+                lats.append(ring[:, 1])
+    lons, lats = np.concatenate(lons), np.concatenate(lats)
+    return float(lons.min()), float(lats.min()), float(lons.max()), float(lats.max())
+
+
+def _polygons(feature):
+    geometry = feature["geometry"]
+    return geometry["coordinates"] if geometry["type"] == "MultiPolygon" else [geometry["coordinates"]]
+
+
+# Point-in-district lookup for many points at once. Every district is reduced to one flat
+# array of edges (outer rings and holes alike, so even-odd ray casting handles holes and
+# multi-part districts) plus its bounding box. A lookup only ray-casts the points inside a
+# district's box, against all of its edges at once, in chunks of points so the
+# (points x edges) temporaries stay bounded.
+class DistrictIndex:
+    def __init__(self, geojson):
+        self.names = []
+        self.bounds = []
+        self.edges = []
+        for feature in geojson["features"]:
+            starts, ends = [], []
+            for polygon in _polygons(feature):
+                for ring in polygon:
+                    ring = np.asarray(ring, dtype=float)
+                    starts.append(ring)
+                    ends.append(np.roll(ring, -1, axis=0))
+            start, end = np.concatenate(starts), np.concatenate(ends)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                # Horizontal edges get inf/nan slopes but are never crossed
+                slope = (end[:, 0] - start[:, 0]) / (end[:, 1] - start[:, 1])
+            self.names.append(feature["properties"]["NAME_2"])
+            self.bounds.append((*start.min(axis=0), *start.max(axis=0)))
+            self.edges.append((start[:, 0], start[:, 1], end[:, 1], slope))
+
+    def __len__(self):
+        return len(self.names)
+
+    # Index into `names` of the district containing each point, -1 outside Tamil Nadu
+    def locate(self, lat, lon, chunk_size=1_000_000):
+        lat = np.atleast_1d(np.asarray(lat, dtype=float))
+        lon = np.atleast_1d(np.asarray(lon, dtype=float))
+        district = np.full(len(lat), -1, dtype=np.int32)
+        for i, (x1, y1, y2, slope) in enumerate(self.edges):
+            lon_min, lat_min, lon_max, lat_max = self.bounds[i]
+            candidates = np.flatnonzero((district < 0) & (lon >= lon_min) & (lon <= lon_max)
+                                        & (lat >= lat_min) & (lat <= lat_max))
+            step = max(1, chunk_size // len(x1))
+            for first in range(0, len(candidates), step):
+                points = candidates[first:first + step]
+                y, x = lat[points, None], lon[points, None]
+                with np.errstate(invalid="ignore"):
+                    crossings = ((y1 > y) != (y2 > y)) & (x < x1 + (y - y1) * slope)
+                inside = np.count_nonzero(crossings, axis=1) % 2 == 1
+                district[points[inside]] = i
+        return district
+
+    # District names for the codes returned by locate(), None outside Tamil Nadu
+    def names_of(self, codes):
+        return [self.names[code] if code >= 0 else None for code in codes]
+
+
+# Parsing the boundaries and building the index is shared by everything in the process
+@functools.lru_cache(maxsize=None)
+def load_district_index(path=GEOJSON_PATH):
+    return DistrictIndex(load_geojson(path))
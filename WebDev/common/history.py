@@ -0,0 +1,119 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from .frames import METRICS
+
+
+# Fixed-memory history of every sensor: the last `capacity` ticks in a preallocated ring of
+# shape (ticks x metrics x sensors). Each tick is stored as one contiguous copy of the
+# metric-major values of SensorState, so appending never allocates, and a window of ticks is
+# at most two contiguous slices of the ring, reduced along the first axis without gathering.
+# `max_bytes` caps the ring for large deployments by shortening it.
+#
+# `buffers` (values, fleet, times) lets the ring live in memory owned by someone else, such as
+# a shared memory segment (common/shm.py); they must have the shapes of ring_shapes() and are
+# left as they are, since only the `size` slots written so far are ever read.
+class SensorHistory:
+    def __init__(self, n_sensors, capacity=300, metrics=METRICS, max_bytes=256 * 2 ** 20, dtype=np.float32, buffers=None):
+        self.metrics = list(metrics)
+        k = len(self.metrics)
+        self.capacity = self.ring_capacity(n_sensors, capacity, k, max_bytes, dtype)
+        if buffers is None:
+            values_shape, fleet_shape, times_shape = self.ring_shapes(n_sensors, self.capacity, k)
+            # Per tick: mean of every metric over the sensors with a reading, and the time
+            buffers = np.full(values_shape, np.nan, dtype=dtype), np.full(fleet_shape, np.nan), np.full(times_shape, np.nan)
+        self.values, self.fleet, self.times = buffers
+        self.head = 0
+        self.size = 0
+
+    @staticmethod
+    def ring_capacity(n_sensors, capacity, k, max_bytes, dtype=np.float32):
+        per_tick = np.dtype(dtype).itemsize * k * max(n_sensors, 1)
+        return max(2, min(capacity, max_bytes // per_tick))
+
+    # Shapes of the values, fleet and times arrays
+    @staticmethod
+    def ring_shapes(n_sensors, capacity, k):
+        return (capacity, k, n_sensors), (capacity, k), (capacity,)
+
+    def __len__(self):
+        return self.size
+
+    # values: (metrics x sensors) array, as in SensorState
+    def append(self, values, timestamp=None):
+        self.values[self.head] = values
+        slot = self.values[self.head]
+        count = (~np.isnan(slot)).sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.fleet[self.head] = np.nansum(slot, axis=1, dtype=float) / count
+        self.times[self.head] = time.time() if timestamp is None else timestamp
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    # Slices of the ring holding the last `window` ticks (all stored ticks if None), oldest first
+    def _pieces(self, window):
+        window = self.size if window is None else max(0, min(window, self.size))
+        start = (self.head - window) % self.capacity
+        if start + window <= self.capacity:
+            return [slice(start, start + window)]
+        return [slice(start, self.capacity), slice(0, self.head)]
+
+    def _slots(self, window):
+        return np.concatenate([np.arange(piece.start, piece.stop) for piece in self._pieces(window)])
+
+    def _blocks(self, window, ids):
+        for piece in self._pieces(window):
+            yield self.values[piece] if ids is None else self.values[piece][:, :, ids]
+
+    # Rolling aggregates over the last `window` ticks, as (metrics x sensors) arrays; `ids`
+    # restricts them to some sensors. Missing readings are ignored.
+    def mean(self, window=None, ids=None):
+        blocks = list(self._blocks(window, ids))
+        mean = sum(block.sum(axis=0, dtype=float) for block in blocks) / sum(len(block) for block in blocks)
+        # A plain sum is several times faster than nansum; only the few sensors with a gap in
+        # the window (usually none) are recomputed without their missing readings
+        gaps = np.isnan(mean)
+        if gaps.any():
+            readings = np.concatenate([block[:, gaps] for block in blocks])
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean[gaps] = np.nansum(readings, axis=0) / (~np.isnan(readings)).sum(axis=0)
+        return mean
+
+    def min(self, window=None, ids=None):
+        return np.fmin.reduce([np.fmin.reduce(block, axis=0) for block in self._blocks(window, ids)])
+
+    def max(self, window=None, ids=None):
+        return np.fmax.reduce([np.fmax.reduce(block, axis=0) for block in self._blocks(window, ids)])
+
+    # Change per second between the oldest and newest tick of the window
+    def rate(self, window=None, ids=None):
+        slots = self._slots(window)
+        ids = slice(None) if ids is None else ids
+        elapsed = self.times[slots[-1]] - self.times[slots[0]]
+        if elapsed <= 0:
+            return np.zeros_like(self.values[slots[-1]][:, ids], dtype=float)
+        return (self.values[slots[-1]][:, ids].astype(float) - self.values[slots[0]][:, ids]) / elapsed
+
+    # Mean, min, max and rate of every metric over the window, one row per sensor in `ids`
+    # (or every sensor), with "<metric>_<stat>" columns
+    def window_stats(self, window=None, ids=None):
+        stats = {"mean": self.mean(window, ids), "min": self.min(window, ids)
+                 , "max": self.max(window, ids), "rate": self.rate(window, ids)}
+        index = np.arange(self.values.shape[2]) if ids is None else np.asarray(ids)
+        return pd.DataFrame({f"{metric}_{name}": values[i] for i, metric in enumerate(self.metrics)
+                             for name, values in stats.items()}, index=index)
+
+    def _index(self, slots):
+        return pd.to_datetime(self.times[slots], unit="s")
+
+    # Fleet-wide mean of every metric per tick over the window, indexed by time, oldest first
+    def fleet_means(self, window=None):
+        slots = self._slots(window)
+        return pd.DataFrame(self.fleet[slots], columns=self.metrics, index=self._index(slots))
+
+    # Readings of one sensor per tick over the window, indexed by time, oldest first
+    def sensor(self, sensor, window=None):
+        slots = self._slots(window)
+        return pd.DataFrame(self.values[slots, :, sensor], columns=self.metrics, index=self._index(slots))
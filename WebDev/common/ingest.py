@@ -0,0 +1,193 @@
+import collections
+import threading
+import time
+
+import numpy as np
+import requests
+
+from .anomaly import AnomalyDetector
+from .binning import SpatialBins, cell_radius, level_for_zoom, view_bounds
+from .delta import SensorState
+from .frames import FULL, decode_payload, iter_sse_data, payload_kind
+from .history import SensorHistory
+from .registry import fetch_registry
+from .store import StoreWriter
+
+# Latest decoded state of every sensor. `tick` increases by one per published state and `data`
+# is a read-only DataFrame shared by every session: take data.copy(deep=False) before adding
+# columns to it. Besides the readings it has the "anomaly" (flagged metric index, -1 when
+# normal) and "anomaly_score" columns of common/anomaly.py.
+Snapshot = collections.namedtuple("Snapshot", ["tick", "received_at", "data"])
+
+
+# One upstream subscription per process. The thread keeps a single connection to the SSE
+# server and hands raw payloads to a decoder thread, which decodes them once and publishes an
+# immutable Snapshot that any number of Streamlit sessions can read. It reconnects (and
+# refetches the registry) whenever the stream drops, so sessions never open connections of
+# their own.
+#
+# Reading and decoding are separate so a slow decode never backs up the socket: whatever
+# arrived while the previous batch was decoding is coalesced, and frames older than the newest
+# full frame are skipped. Delta frames after it are still merged in order.
+#
+# The worker also keeps the readings aggregated per quadtree cell (common/binning.py), updated
+# from the sensors each frame touched, for maps with more sensors than screen cells, and the
+# last `history_size` published states in a fixed-size ring (common/history.py) for trends.
+# Every published state is scored against per-sensor baselines (common/anomaly.py), and, with
+# an `alerts` tracker (common/alerts.py), checked for alert transitions.
+# With a `store_path`, every frame it applies is also persisted to a history store
+# (common/store.py) for playback.
+class IngestWorker(threading.Thread):
+    def __init__(self, url, sensors_url, reconnect_delay=1.0, history_size=300, store_path=None, alerts=None):
+        super().__init__(daemon=True)
+        self.url = url
+        self.sensors_url = sensors_url
+        self.reconnect_delay = reconnect_delay
+        self.history_size = history_size
+        self.store_path = store_path
+        self.alerts = alerts
+        self.store = None
+        # Why the history store could not be opened; stays reported while the worker runs on
+        self.store_error = None
+        self.session = requests.Session()
+        self.condition = threading.Condition()
+        self.pending = []
+        self.pending_ready = threading.Condition()
+        self.snapshot = None
+        self.bins = None
+        self.history = None
+        self.anomalies = None
+        self.error = None
+        self.coalesced = 0
+        self.decoder = threading.Thread(target=self._decode, daemon=True)
+
+    def start(self):
+        self.decoder.start()
+        super().start()
+
+    def _enqueue(self, item):
+        with self.pending_ready:
+            self.pending.append(item)
+            self.pending_ready.notify()
+
+    def run(self):
+        while True:
+            try:
+                # A new registry starts a new state; frames queued before it are dropped
+                registry = fetch_registry(self.sensors_url)
+                with self.pending_ready:
+                    self.pending = []
+                self._enqueue(registry)
+                with self.session.get(self.url, stream=True) as response:
+                    response.raise_for_status()
+                    for payload in iter_sse_data(response.iter_content(chunk_size=64 * 1024)):
+                        self._enqueue(payload.decode("utf-8"))
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                self.error = e
+            time.sleep(self.reconnect_delay)
+
+    def _decode(self):
+        state = None
+        while True:
+            with self.pending_ready:
+                self.pending_ready.wait_for(lambda: self.pending)
+                batch, self.pending = self.pending, []
+            try:
+                payloads = []
+                for item in batch:
+                    if isinstance(item, str):
+                        payloads.append(item)
+                    else:
+                        state, payloads = SensorState(item), []
+                        self._reset(state)
+                if state is None or not payloads:
+                    continue
+                start = max((i for i, payload in enumerate(payloads) if payload_kind(payload) == FULL), default=0)
+                self.coalesced += start
+                full, changed = False, []
+                for payload in payloads[start:]:
+                    frame = decode_payload(payload)
+                    state.apply(frame)
+                    if self.store is not None:
+                        self.store.append_frame(frame)
+                    full = full or frame.attrs["kind"] == FULL
+                    changed.append(frame["id"].to_numpy())
+                self._publish(state, None if full else np.concatenate(changed))
+            except (ValueError, KeyError, IndexError) as e:
+                self.error = e
+
+    # Called with every new state, i.e. on every (re)connect with the registry it came with.
+    # The per-registry state is built before the store is opened, so a store that cannot be
+    # opened only turns persistence off.
+    def _reset(self, state):
+        with self.condition:
+            self.bins = SpatialBins(state.lat, state.lon)
+            self.history = SensorHistory(len(state.ids), self.history_size)
+            self.anomalies = AnomalyDetector(len(state.ids))
+        self._open_store(state)
+
+    def _open_store(self, state):
+        if self.store_path is None:
+            return
+        if self.store is not None:
+            self.store.close()
+        # Stays None (and the error stays reported) when the store holds other sensors, e.g.
+        # after a data server restart with new random locations
+        self.store = None
+        self.store_error = None
+        try:
+            self.store = StoreWriter(self.store_path, np.column_stack((state.lat, state.lon)))
+        except (OSError, ValueError) as e:
+            self.store_error = self.error = f"History store disabled: {e}"
+
+    def _publish(self, state, changed=None):
+        # Copy out of the state that the next frame will patch in place
+        data = state.to_frame().copy()
+        now = time.time()
+        # Only this thread uses the detector and alert tracker, so they do not hold up readers
+        data["anomaly"], data["anomaly_score"] = self.anomalies.update(state.values)
+        if self.alerts is not None:
+            self.alerts.update(state.values, timestamp=now)
+        with self.condition:
+            # Only the cells holding changed sensors are re-aggregated
+            self.bins.update(state.values, changed)
+            self.history.append(state.values, now)
+            tick = self.snapshot.tick + 1 if self.snapshot else 0
+            self.snapshot = Snapshot(tick, now, data)
+            self.error = self.store_error
+            self.condition.notify_all()
+
+    def latest(self):
+        return self.snapshot
+
+    # Readings aggregated into quadtree cells about CELL_PIXELS wide at `zoom`, limited to the
+    # cells visible around (latitude, longitude), so the frame size depends on the screen and
+    # not on the number of sensors. Also returns the scatter radius in metres that fills a cell.
+    def binned(self, zoom, latitude, longitude, width=1200, height=800):
+        level = level_for_zoom(zoom)
+        with self.condition:
+            if self.bins is None:
+                return None, cell_radius(level)
+            return self.bins.cells(level, view_bounds(latitude, longitude, zoom, width, height)), cell_radius(level)
+
+    # Fleet-wide mean of every metric per tick over the last `window` ticks, oldest first
+    def trend(self, window=None):
+        with self.condition:
+            if self.history is None:
+                return None
+            return self.history.fleet_means(window)
+
+    # Readings of one sensor over the last `window` ticks, plus its rolling mean/min/max/rate
+    def sensor_history(self, sensor, window=None):
+        with self.condition:
+            if self.history is None or not 0 <= sensor < self.history.values.shape[2]:
+                return None, None
+            return self.history.sensor(sensor, window), self.history.window_stats(window, [sensor]).iloc[0]
+
+    # Block until a snapshot newer than `after_tick` exists; returns None on timeout
+    def wait_for_update(self, after_tick=-1, timeout=None):
+        with self.condition:
+            self.condition.wait_for(lambda: self.snapshot is not None and self.snapshot.tick > after_tick, timeout)
+            if self.snapshot is None or self.snapshot.tick <= after_tick:
+                return None
+            return self.snapshot
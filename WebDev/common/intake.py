@@ -0,0 +1,174 @@
+import json
+import struct
+import threading
+import time
+
+import numpy as np
+
+from .frames import DTYPE, METRICS, json_values, decode_block, encode_binary
+
+# Binary batch layout (little endian):
+#   "SNIN" | length of node id (u16) | pad (u16) | sequence (u64)
+#   node id (utf-8), zero padded up to a multiple of 8 bytes
+#   one binary sensor frame (common/frames.py) with an "id" field and any of the metric fields
+# JSON batches carry the same: {"node": "gate-1", "seq": 42, "readings": [{"id": 0, "temperature": 71.5, ...}]}
+BATCH_MAGIC = b"SNIN"
+BATCH_HEADER = struct.Struct("<4sHxxQ")
+
+
+def _padded(size):
+    return (size + 7) & ~7
+
+
+# Binary batch of readings from one node; `columns` is a dict of equally sized columns with
+# "id" and any metrics
+def encode_batch(node, sequence, columns):
+    name = node.encode("utf-8")
+    header = BATCH_HEADER.pack(BATCH_MAGIC, len(name), sequence) + name
+    return header.ljust(_padded(len(header)), b"\0") + encode_binary(columns)
+
+
+def encode_json_batch(node, sequence, columns):
+    names = list(columns)
+    rows = zip(*(json_values(columns[name]) for name in names))
+    return json.dumps({"node": node, "seq": sequence, "readings": [dict(zip(names, row)) for row in rows]}, allow_nan=False)
+
+
+# (node, sequence, ids, values) of a POSTed batch in either format, values as a
+# (metrics x readings) float32 array with NaN for metrics the node did not send
+def decode_batch(body, metrics=METRICS):
+    if body[:4] == BATCH_MAGIC:
+        try:
+            magic, name_len, sequence = BATCH_HEADER.unpack_from(body, 0)
+            node = bytes(body[BATCH_HEADER.size:BATCH_HEADER.size + name_len]).decode("utf-8")
+            kind, names, block = decode_block(bytes(body[_padded(BATCH_HEADER.size + name_len):]))
+        except (struct.error, UnicodeDecodeError) as e:
+            raise ValueError(f"Malformed batch: {e!r}")
+        if "id" not in names:
+            raise ValueError("Batch has no id field.")
+        # Straight from the block, no DataFrame: a batch is only a handful of readings
+        values = np.full((len(metrics), block.shape[1]), np.nan, dtype=DTYPE)
+        for i, metric in enumerate(metrics):
+            if metric in names:
+                values[i] = block[names.index(metric)]
+        return node, int(sequence), block[names.index("id")], values
+    try:
+        batch = json.loads(body)
+        node, sequence, readings = str(batch["node"]), int(batch["seq"]), batch["readings"]
+        ids = np.array([reading["id"] for reading in readings], dtype=float)
+        values = np.array([[reading.get(metric, np.nan) for reading in readings] for metric in metrics], dtype=DTYPE)
+    except (TypeError, KeyError, AttributeError) as e:
+        raise ValueError(f"Malformed batch: {e!r}")
+    return node, sequence, ids, values.reshape(len(metrics), len(ids))
+
+
+# Index of the last occurrence of every distinct id
+def _last_occurrences(ids):
+    return len(ids) - 1 - np.unique(ids[::-1], return_index=True)[1]
+
+
+# Command line options shared by the data servers
+def add_intake_arguments(parser):
+    parser.add_argument("--intake", action="store_true", help="stream readings POSTed to /ingest instead of generating them")
+    parser.add_argument("--stale-after", type=float, default=60.0
+                        , help="seconds after which a sensor's last posted reading is dropped")
+
+
+# Readings pushed by field nodes, coalesced into one frame per tick for the Broadcaster. POST
+# handlers only decode and validate their batch and append it to a list under a short lock,
+# so any number of them run concurrently and none waits for another to be applied. The
+# producer swaps the list out once per tick and applies everything that arrived in a few
+# array operations: the latest reading per sensor wins, metrics a node did not send keep
+# their previous value, and sensors silent for `stale_after` seconds go back to NaN.
+#
+# Every node numbers its batches. A batch at or below the node's last sequence number is a
+# retry of one already applied and is acknowledged without applying it again; skipped
+# numbers are counted as lost. Sequence 0 starts a node over, e.g. after a reboot.
+#
+# The producer only runs while someone is subscribed to /data, so once `max_pending` batches
+# are waiting the POST handler that queued the last one applies them itself.
+class IntakeBuffer:
+    def __init__(self, n_sensors, metrics=METRICS, stale_after=60.0, max_pending=1000):
+        self.metrics = list(metrics)
+        self.stale_after = stale_after
+        # One row per sensor and one column per metric, as Broadcaster.produce() returns
+        self.readings = np.full((n_sensors, len(self.metrics)), np.nan, dtype=DTYPE)
+        # What next() returns: a copy of the readings, so POST handlers applying a backlog never
+        # change a tick while the producer encodes or records it
+        self.frame = np.empty_like(self.readings)
+        self.updated = np.full(n_sensors, -np.inf)
+        self.pending = []
+        self.sequences = {}
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        # Held while self.readings is written or copied out
+        self.apply_lock = threading.Lock()
+        self.batches = self.accepted = self.rejected = self.duplicates = self.lost = 0
+
+    def __len__(self):
+        return len(self.readings)
+
+    # Validates and queues one POSTed body; returns the acknowledgement for the node. Raises
+    # ValueError for bodies that cannot be decoded.
+    def submit(self, body):
+        node, sequence, ids, values = decode_batch(body, self.metrics)
+        # Unknown sensors and non-finite readings are dropped; NaN means "not measured"
+        valid = (ids >= 0) & (ids < len(self.readings)) & (ids == np.floor(ids))
+        valid &= ~np.isinf(values).any(axis=0)
+        rejected = len(ids) - int(valid.sum())
+        ids, values = ids[valid].astype(np.intp), values[:, valid]
+        now = time.time()
+        with self.lock:
+            last = self.sequences.get(node)
+            if last is not None and 0 < sequence <= last:
+                self.duplicates += 1
+                return {"node": node, "seq": sequence, "duplicate": True, "accepted": 0, "rejected": 0}
+            if last is not None and sequence > last + 1:
+                self.lost += sequence - last - 1
+            self.sequences[node] = sequence
+            self.pending.append((ids, values, now))
+            self.batches += 1
+            self.accepted += len(ids)
+            self.rejected += rejected
+            backlog = len(self.pending) >= self.max_pending
+        if backlog:
+            self._apply()
+        return {"node": node, "seq": sequence, "duplicate": False, "accepted": len(ids), "rejected": rejected}
+
+    # Readings for the next tick, for use as Broadcaster.produce. The returned array is
+    # overwritten by the following call, and by nothing else.
+    def next(self):
+        self._apply()
+        with self.apply_lock:
+            if self.stale_after is not None:
+                self.readings[self.updated < time.time() - self.stale_after] = np.nan
+            np.copyto(self.frame, self.readings)
+        return self.frame
+
+    # Applies every queued batch to self.readings
+    def _apply(self):
+        with self.apply_lock:
+            with self.lock:
+                batches, self.pending = self.pending, []
+            if not batches:
+                return
+            ids = np.concatenate([batch[0] for batch in batches])
+            values = np.concatenate([batch[1] for batch in batches], axis=1)
+            times = np.concatenate([np.full(len(batch[0]), batch[2]) for batch in batches])
+            # Per metric, keep only the last reading of every sensor, so repeated ids never race
+            for i in range(len(self.metrics)):
+                measured = ~np.isnan(values[i])
+                sensors, readings = ids[measured], values[i, measured]
+                last = _last_occurrences(sensors)
+                self.readings[sensors[last], i] = readings[last]
+            last = _last_occurrences(ids)
+            self.updated[ids[last]] = times[last]
+
+    def stats(self):
+        # Count what is still queued as reporting too
+        self._apply()
+        since = -np.inf if self.stale_after is None else time.time() - self.stale_after
+        with self.lock:
+            return {"nodes": len(self.sequences), "batches": self.batches, "accepted": self.accepted
+                    , "rejected": self.rejected, "duplicates": self.duplicates, "lost": self.lost
+                    , "pending": len(self.pending), "reporting": int((self.updated > since).sum())}
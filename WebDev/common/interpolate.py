@@ -0,0 +1,188 @@
+import collections
+
+import numpy as np
+from scipy import sparse
+from scipy.interpolate import CloughTocher2DInterpolator
+from scipy.spatial import Delaunay, QhullError, cKDTree
+
+
+# Regular grid spanning the sensors, like np.mgrid[min(lons):max(lons):100j, ...] in the
+# contour maps
+def make_grid(lons, lats, resolution=100):
+    return np.mgrid[min(lons):max(lons):resolution * 1j, min(lats):max(lats):resolution * 1j]
+
+
+# griddata() rebuilds the Delaunay triangulation and locates every grid point in it on each
+# call, although the sensors never move. This does that work once per sensor layout and keeps
+# the result as sparse (grid points x sensors) weight matrices, so interpolating a new tick is a
+# few sparse matrix-vector products. Grid points outside the convex hull are NaN, as with
+# griddata.
+#
+# "linear" stores the barycentric weights of the enclosing triangle.
+# "cubic" is Clough-Tocher, whose value at a grid point is linear in the values and gradients
+# at the three corners of its triangle. Those 9 coefficients per grid point are precomputed, so
+# a tick only needs the gradient estimate (a sparse iterative solve over the sensors, no point
+# location) and three sparse products.
+#
+# Sensors without a finite reading (stale or not reported yet) are left out rather than
+# blanking every triangle they touch: the field is interpolated over the sensors that have one,
+# with a triangulation of those sensors that is rebuilt only when that set changes.
+class TriangulationInterpolator:
+    def __init__(self, points, grid_x, grid_y, method="linear"):
+        points = np.asarray(points, dtype=float)
+        self.points = points
+        self.grid = (grid_x, grid_y)
+        self.shape = grid_x.shape
+        self.method = method
+        # Interpolator over the sensors with a reading, and which sensors those were
+        self.subset = (None, None)
+        targets = np.column_stack((grid_x.ravel(), grid_y.ravel()))
+        self.triangulation = Delaunay(points)
+        simplex = self.triangulation.find_simplex(targets)
+        self.outside = simplex < 0
+        self.inside = np.flatnonzero(~self.outside)
+        self.corners = self.triangulation.simplices[simplex[self.inside]]
+        if method == "linear":
+            self.weights = self._matrix(self._barycentric(targets[self.inside], simplex[self.inside]))
+        elif method == "cubic":
+            value, grad_x, grad_y = self._clough_tocher(targets[self.inside])
+            self.weights = self._matrix(value)
+            self.grad_x_weights = self._matrix(grad_x)
+            self.grad_y_weights = self._matrix(grad_y)
+        else:
+            raise ValueError(f"Unknown interpolation method: {method}")
+
+    # (grid points x sensors) matrix from one coefficient per corner of each inside point
+    def _matrix(self, coefficients):
+        rows = np.repeat(self.inside, 3)
+        return sparse.csr_matrix((coefficients.ravel(), (rows, self.corners.ravel()))
+                                 , shape=(np.prod(self.shape), self.triangulation.npoints))
+
+    def _barycentric(self, targets, simplex):
+        transform = self.triangulation.transform[simplex]
+        partial = np.einsum("ijk,ik->ij", transform[:, :2], targets - transform[:, 2])
+        return np.column_stack((partial, 1.0 - partial.sum(axis=1)))
+
+    # Colour the sensors so the corners of every triangle differ, then probe Clough-Tocher with
+    # one unit value / unit x-gradient / unit y-gradient per colour. Evaluating those few
+    # columns gives each grid point the coefficient of every corner.
+    def _clough_tocher(self, targets):
+        n_points = self.triangulation.npoints
+        indptr, neighbours = self.triangulation.vertex_neighbor_vertices
+        colour = np.full(n_points, -1)
+        for vertex in range(n_points):
+            taken = set(colour[neighbours[indptr[vertex]:indptr[vertex + 1]]])
+            colour[vertex] = next(c for c in range(n_points) if c not in taken)
+        n_colours = colour.max() + 1
+        values = np.zeros((n_points, 3 * n_colours))
+        gradients = np.zeros((n_points, 3 * n_colours, 2))
+        values[np.arange(n_points), 3 * colour] = 1.0
+        gradients[np.arange(n_points), 3 * colour + 1, 0] = 1.0
+        gradients[np.arange(n_points), 3 * colour + 2, 1] = 1.0
+        probe = CloughTocher2DInterpolator(self.triangulation, values)
+        probe.grad = gradients
+        # Evaluate in chunks to bound the intermediate (targets x probe columns) array
+        coefficients = np.empty((len(targets), 3, 3))
+        corner_colours = 3 * colour[self.corners]
+        for start in range(0, len(targets), 65536):
+            stop = start + 65536
+            result = probe(targets[start:stop])
+            rows = np.arange(len(result))[:, None]
+            for term in range(3):
+                coefficients[start:stop, :, term] = result[rows, corner_colours[start:stop] + term]
+        return coefficients[:, :, 0], coefficients[:, :, 1], coefficients[:, :, 2]
+
+    # Interpolate one tick (one value per sensor) onto the grid
+    def __call__(self, values):
+        values = np.asarray(values, dtype=float)
+        valid = np.isfinite(values)
+        if not valid.all():
+            return self._interpolate_valid(values, valid)
+        grid = self.weights @ values
+        if self.method == "cubic":
+            gradient = CloughTocher2DInterpolator(self.triangulation, values).grad[:, 0]
+            grid += self.grad_x_weights @ gradient[:, 0]
+            grid += self.grad_y_weights @ gradient[:, 1]
+        grid[self.outside] = np.nan
+        return grid.reshape(self.shape)
+
+    def _interpolate_valid(self, values, valid):
+        mask, interpolator = self.subset
+        if mask is None or not np.array_equal(mask, valid):
+            try:
+                interpolator = TriangulationInterpolator(self.points[valid], *self.grid, self.method)
+            except (ValueError, QhullError):
+                # Fewer than three sensors, or all on one line: nothing to triangulate
+                interpolator = None
+            self.subset = (valid, interpolator)
+        if interpolator is None:
+            return np.full(self.shape, np.nan)
+        return interpolator(values[valid])
+
+
+# Inverse-distance weighting over the k nearest sensors. Unlike the triangulation it is defined
+# everywhere, so it can fill the whole state rather than only the convex hull of the sensors,
+# and its cost grows with k rather than with the number of sensors. The neighbours and
+# normalised weights of every grid point are found once with a KD-tree; a tick is then a
+# gather and a weighted sum. Both steps run over `chunk_size` grid points at a time, so the
+# temporaries stay bounded on very fine grids (the stored tables are k int32 + k float32 per
+# grid point). Neighbours without a finite reading are left out of the sum and the weights of
+# the others renormalised, so a grid point is only empty when none of its k sensors reports.
+class IDWInterpolator:
+    def __init__(self, points, grid_x, grid_y, k=8, power=2.0, chunk_size=262144):
+        points = np.asarray(points, dtype=float)
+        self.shape = grid_x.shape
+        self.chunk_size = chunk_size
+        k = min(k, len(points))
+        targets = np.column_stack((grid_x.ravel(), grid_y.ravel()))
+        tree = cKDTree(points)
+        self.neighbours = np.empty((len(targets), k), dtype=np.int32)
+        self.weights = np.empty((len(targets), k), dtype=np.float32)
+        for start in range(0, len(targets), chunk_size):
+            stop = start + chunk_size
+            distance, index = tree.query(targets[start:stop], k=k)
+            distance, index = distance.reshape(-1, k), index.reshape(-1, k)
+            # A grid point on top of a sensor takes that sensor's value
+            weight = 1.0 / np.maximum(distance, 1e-12) ** power
+            self.neighbours[start:stop] = index
+            self.weights[start:stop] = weight / weight.sum(axis=1, keepdims=True)
+
+    # Interpolate one tick (one value per sensor) onto the grid
+    def __call__(self, values):
+        values = np.asarray(values, dtype=np.float32)
+        valid = np.isfinite(values)
+        complete = valid.all()
+        if not complete:
+            values = np.where(valid, values, np.float32(0.0))
+        grid = np.empty(len(self.weights))
+        for start in range(0, len(grid), self.chunk_size):
+            stop = start + self.chunk_size
+            neighbours, weights = self.neighbours[start:stop], self.weights[start:stop]
+            if complete:
+                grid[start:stop] = np.einsum("ij,ij->i", weights, values[neighbours])
+                continue
+            weights = weights * valid[neighbours]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                grid[start:stop] = np.einsum("ij,ij->i", weights, values[neighbours]) / weights.sum(axis=1)
+        return grid.reshape(self.shape)
+
+
+_cache = collections.OrderedDict()
+
+
+# Interpolator for this sensor layout and grid, built on first use and then reused for as long
+# as the layout stays the same
+def get_interpolator(points, grid_x, grid_y, method="linear", max_entries=8):
+    points = np.ascontiguousarray(points, dtype=float)
+    key = (points.tobytes(), grid_x.shape, grid_x[0, 0], grid_x[-1, -1], grid_y[0, 0], grid_y[-1, -1], method)
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+    if method == "idw":
+        interpolator = IDWInterpolator(points, grid_x, grid_y)
+    else:
+        interpolator = TriangulationInterpolator(points, grid_x, grid_y, method)
+    _cache[key] = interpolator
+    if len(_cache) > max_entries:
+        _cache.popitem(last=False)
+    return interpolator
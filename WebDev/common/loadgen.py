@@ -0,0 +1,61 @@
+import numpy as np
+
+from .frames import METRICS
+
+# Tamil Nadu bounding box
+LAT_RANGE = (8.1, 13.8)
+LON_RANGE = (76.9, 80.3)
+
+# Centre and half-width of the usual range of every metric, in METRICS order
+# (the same ranges the random generator in dummy_data/app.py draws from)
+BASELINE = np.array([55.0, 6.5, 67.5, 985.0, 100.0], dtype=np.float32)
+SPREAD = np.array([15.0, 2.5, 17.5, 35.0, 50.0], dtype=np.float32)
+
+
+# Synthetic readings for any number of virtual sensors, produced with a handful of array
+# operations per tick. Each metric is a smooth random field over the state (random Fourier
+# features approximating a Gaussian process with the given correlation length in degrees), so
+# neighbouring sensors read similar values, plus a little independent noise per sensor. The
+# field drifts over time as an AR(1) process on its coefficients. The same seed always gives
+# the same sensors and the same sequence of ticks.
+class SyntheticField:
+    def __init__(self, n_sensors, seed=None, modes=16, length_scale=0.75, noise=0.1, persistence=0.98):
+        self.rng = np.random.default_rng(seed)
+        self.locations = np.column_stack((
+            self.rng.uniform(*LAT_RANGE, n_sensors), self.rng.uniform(*LON_RANGE, n_sensors)))
+        frequencies = self.rng.normal(0.0, 1.0 / length_scale, (2, modes))
+        phases = self.rng.uniform(0.0, 2 * np.pi, modes)
+        # (sensors x modes) basis evaluated once; every tick is then one small matrix product
+        self.basis = (np.sqrt(2.0 / modes) * np.cos(self.locations[:, ::-1] @ frequencies + phases)).astype(np.float32)
+        self.coefficients = self.rng.standard_normal((modes, len(METRICS))).astype(np.float32)
+        self.noise = np.float32(noise)
+        self.persistence = np.float32(persistence)
+        self.innovation = np.float32(np.sqrt(1.0 - persistence ** 2))
+        # Preallocated output and noise buffers, reused every tick
+        self.readings = np.empty((n_sensors, len(METRICS)), dtype=np.float32)
+        self.jitter = np.empty_like(self.readings)
+
+    def __len__(self):
+        return len(self.locations)
+
+    # Readings for the next tick: one row per sensor, one column per metric. The returned
+    # array is overwritten by the following call.
+    def next(self):
+        self.coefficients *= self.persistence
+        self.coefficients += self.innovation * self.rng.standard_normal(self.coefficients.shape, dtype=np.float32)
+        np.matmul(self.basis, self.coefficients, out=self.readings)
+        self.rng.standard_normal(out=self.jitter, dtype=np.float32)
+        self.jitter *= self.noise
+        self.readings += self.jitter
+        # Unit-variance field -> roughly two thirds of the readings inside the usual range
+        self.readings *= SPREAD
+        self.readings += BASELINE
+        return self.readings
+
+
+# Command line options shared by the data servers
+def add_generator_arguments(parser):
+    parser.add_argument("--sensors", type=int, default=None
+                        , help="simulate this many sensors with the vectorized field generator")
+    parser.add_argument("--rate", type=float, default=1.0, help="ticks per second")
+    parser.add_argument("--seed", type=int, default=None, help="seed for reproducible sensors and readings")
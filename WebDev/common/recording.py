@@ -0,0 +1,113 @@
+import os
+import struct
+import time
+
+import numpy as np
+
+from .frames import METRICS
+
+# Recording layout (little endian), append-only:
+#   "SNRC" | version (u32) | sensors (u32) | metrics (u32)
+#   sensor locations: sensors x 2 float64 (lat, lon), in id order
+#   then one fixed-size record per tick: timestamp (float64) | sensors x metrics float32
+# Every record has the same size, so a capture can be memory-mapped as one structured array
+# and replayed without reading it into RAM.
+MAGIC = b"SNRC"
+VERSION = 1
+HEADER = struct.Struct("<4sIII")
+
+
+def _record_dtype(sensors, metrics):
+    return np.dtype([("time", "<f8"), ("readings", "<f4", (sensors, metrics))])
+
+
+def _read_header(f):
+    magic, version, sensors, metrics = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a sensor recording.")
+    locations = np.frombuffer(f.read(sensors * 2 * 8), dtype="<f8").reshape(sensors, 2)
+    return sensors, metrics, locations
+
+
+# Appends every tick the server emits. Reopening an existing capture continues it, as long as
+# it was recorded with the same sensors.
+class Recorder:
+    def __init__(self, path, locations):
+        locations = np.asarray(locations, dtype="<f8").reshape(-1, 2)
+        self.path = path
+        self.dtype = _record_dtype(len(locations), len(METRICS))
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as f:
+                sensors, metrics, recorded = _read_header(f)
+                offset = f.tell()
+            if metrics != len(METRICS) or not np.array_equal(recorded, locations):
+                raise ValueError(f"{path} was recorded with different sensors.")
+            # Drop a partial record left by an interrupted run so new records stay aligned
+            count = (os.path.getsize(path) - offset) // self.dtype.itemsize
+            os.truncate(path, offset + count * self.dtype.itemsize)
+            self.file = open(path, "ab")
+        else:
+            self.file = open(path, "ab")
+            self.file.write(HEADER.pack(MAGIC, VERSION, len(locations), len(METRICS)))
+            self.file.write(locations.tobytes())
+
+    def write(self, readings, timestamp=None):
+        record = np.empty((), dtype=self.dtype)
+        record["time"] = time.time() if timestamp is None else timestamp
+        record["readings"] = readings
+        self.file.write(record.tobytes())
+        self.file.flush()
+
+    # Wrap a producer so every tick it returns is recorded on the way out
+    def wrap(self, produce):
+        def recorded():
+            readings = produce()
+            self.write(readings)
+            return readings
+        return recorded
+
+    def close(self):
+        self.file.close()
+
+
+# Streams a capture back tick by tick at `speed` times the recorded pace (0 = as fast as
+# possible), starting over at the end. Records are read through a memory map, so only the
+# pages of the tick being sent are ever resident.
+class Replay:
+    def __init__(self, path, speed=1.0):
+        with open(path, "rb") as f:
+            sensors, metrics, self.locations = _read_header(f)
+            offset = f.tell()
+        dtype = _record_dtype(sensors, metrics)
+        # Ignore a trailing partial record left by a recorder that was killed mid-write
+        count = (os.path.getsize(path) - offset) // dtype.itemsize
+        if count == 0:
+            raise ValueError(f"{path} holds no ticks.")
+        self.records = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+        self.speed = speed
+        self.position = 0
+        self.started = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def next(self):
+        if self.position == len(self.records):
+            self.position = 0
+        record = self.records[self.position]
+        if self.position == 0:
+            self.started = (time.monotonic(), float(record["time"]))
+        elif self.speed > 0:
+            wall_start, recorded_start = self.started
+            due = wall_start + (float(record["time"]) - recorded_start) / self.speed
+            time.sleep(max(0.0, due - time.monotonic()))
+        self.position += 1
+        return record["readings"]
+
+
+# Command line options shared by the data servers
+def add_recording_arguments(parser):
+    parser.add_argument("--record", metavar="PATH", help="append every emitted tick to this capture file")
+    parser.add_argument("--replay", metavar="PATH", help="stream a capture file instead of generating data")
+    parser.add_argument("--speed", type=float, default=1.0
+                        , help="replay speed relative to the recording, 0 for as fast as possible")
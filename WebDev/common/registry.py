@@ -0,0 +1,46 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import requests
+
+from .geo import load_district_index
+
+
+# Static metadata for every node. A node's id is its position in the registry, so it stays
+# stable for the lifetime of the server and can index plain arrays on the client.
+class SensorRegistry:
+    def __init__(self, locations, installed=None, source="simulated"):
+        locations = np.asarray(locations, dtype=float).reshape(-1, 2)
+        self.ids = np.arange(len(locations))
+        self.lat = locations[:, 0]
+        self.lon = locations[:, 1]
+        districts = load_district_index()
+        self.district = districts.names_of(districts.locate(self.lat, self.lon))
+        self.installed = installed or datetime.date.today().isoformat()
+        self.source = source
+
+    def __len__(self):
+        return len(self.ids)
+
+    def to_records(self):
+        return [
+            {"id": int(i), "lat": float(lat), "lon": float(lon), "district": district
+             , "installed": self.installed, "source": self.source}
+            for i, lat, lon, district in zip(self.ids, self.lat, self.lon, self.district)
+        ]
+
+
+# Fetch the registry once; the returned frame is indexed by sensor id in id order
+def fetch_registry(url):
+    response = requests.get(url)
+    response.raise_for_status()
+    return pd.DataFrame(response.json()).set_index("id").sort_index()
+
+
+# Add lat/lon to a frame that only carries sensor ids, by indexing the registry columns
+def join_positions(frame, registry):
+    ids = frame["id"].to_numpy().astype(np.intp)
+    frame["lat"] = registry["lat"].to_numpy()[ids]
+    frame["lon"] = registry["lon"].to_numpy()[ids]
+    return frame
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import re
+
+import numpy as np
+import pandas as pd
+import pydeck as pdk
+
+IDENTIFIER = re.compile(r"[A-Za-z_]\w*")
+
+
+# Frame columns that a layer's accessors (get_position='[lon, lat]', get_fill_color='[r, g, b, a]',
+# get_weight='temperature', ...) and the tooltip text refer to
+def used_columns(layer, tooltip, columns):
+    texts = []
+    for value in vars(layer).values():
+        if isinstance(value, str):
+            texts.append(value)
+        elif isinstance(value, list):
+            texts.extend(item for item in value if isinstance(item, str))
+    if isinstance(tooltip, dict):
+        texts.extend(value for value in tooltip.values() if isinstance(value, str))
+    names = {name for text in texts for name in IDENTIFIER.findall(text)}
+    return [column for column in columns if column in names]
+
+
+# Digest of the data a layer would send: raw column bytes for frames (codes for categoricals),
+# JSON for anything else (geojson, records)
+def data_digest(data, digest=None):
+    digest = digest or hashlib.blake2b(digest_size=16)
+    if isinstance(data, pd.DataFrame):
+        for name in data.columns:
+            column = data[name]
+            digest.update(str(name).encode())
+            if isinstance(column.dtype, pd.CategoricalDtype):
+                digest.update(np.ascontiguousarray(column.array.codes).data)
+                digest.update(json.dumps(column.array.categories.tolist(), default=str).encode())
+            elif column.dtype == object:
+                digest.update(pd.util.hash_pandas_object(column, index=False).to_numpy().data)
+            else:
+                digest.update(np.ascontiguousarray(column.to_numpy()).data)
+    else:
+        digest.update(json.dumps(data, default=str).encode())
+    return digest
+
+
+# Deck that keeps its JSON until the renderer changes it, so drawing an unchanged map again
+# does not serialize it again
+class _Deck(pdk.Deck):
+    _spec = None
+
+    def to_json(self):
+        if self._spec is None:
+            self._spec = super().to_json()
+        return self._spec
+
+
+# Re-renders a pydeck chart only when what it shows changed. Every combination of layers, map
+# style and tooltip gets one Deck, built once and reused. Frames are cut down to the columns
+# the layers and tooltip use, and a digest of those columns plus the layer settings decides
+# whether the chart is sent again: an unchanged frame costs one hash and no serialization.
+# The layers keep their ids, so deck.gl updates them in place instead of recreating them.
+#
+# Inside an st.fragment, whose own elements are cleared on every run, draw into a placeholder
+# created outside the fragment (st.empty() before it is called) and pass it as `chart` to
+# render(). Fragment reruns leave that placeholder alone, so an unchanged map is not sent at
+# all; a full app rerun makes a new, empty placeholder, which gets the cached JSON once.
+#
+# pydeck's binary transport only works in Jupyter widgets, so Streamlit still receives JSON;
+# trimming the columns is what keeps the payload down.
+class DeckRenderer:
+    def __init__(self, chart, initial_view_state, map_style=None):
+        self.chart = chart
+        self.initial_view_state = initial_view_state
+        self.map_style = map_style
+        self.decks = {}
+        self.deck = None
+        self.digest = None
+        # Container the current deck was last drawn into
+        self.target = None
+        self.rendered = self.skipped = 0
+
+    # `layers`: list of (layer, data) pairs; data None keeps the layer's own data. Returns
+    # whether the map changed.
+    def render(self, layers, tooltip=None, map_style=None, chart=None):
+        chart = chart or self.chart
+        map_style = map_style or self.map_style
+        key = (tuple(layer.id for layer, _ in layers), map_style, json.dumps(tooltip, sort_keys=True))
+        digest = hashlib.blake2b(repr(key).encode(), digest_size=16)
+        slim = []
+        for layer, data in layers:
+            if isinstance(data, pd.DataFrame):
+                data = data[used_columns(layer, tooltip, data.columns)]
+            settings = {name: value for name, value in vars(layer).items() if name not in ("_data", "_binary_data")}
+            digest.update(repr(sorted(settings.items())).encode())
+            if data is not None:
+                data_digest(data, digest)
+            slim.append((layer, data))
+        digest = digest.digest()
+        if digest == self.digest:
+            self.skipped += 1
+            if chart is not self.target:
+                chart.pydeck_chart(self.deck)
+                self.target = chart
+            return False
+        self.digest = digest
+        for layer, data in slim:
+            if data is not None:
+                layer.data = data.to_dict(orient="records") if isinstance(data, pd.DataFrame) else data
+        deck = self.decks.get(key)
+        if deck is None:
+            deck = self.decks[key] = _Deck(initial_view_state=self.initial_view_state, map_style=map_style, tooltip=tooltip)
+        deck.layers = [layer for layer, _ in layers]
+        deck._spec = None
+        self.deck = deck
+        chart.pydeck_chart(deck)
+        self.target = chart
+        self.rendered += 1
+        return True
@@ -0,0 +1,80 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from .frames import METRICS
+
+# Severity levels, ordered so the worst one is the largest
+OK, WARNING, CRITICAL = 0, 1, 2
+SEVERITIES = ("ok", "warning", "critical")
+
+
+# Per-metric warning/critical thresholds compiled into one (2 x metrics) matrix. A sensor is
+# critical if any metric is at or above its critical threshold, otherwise warning if any is at
+# or above its warning threshold, otherwise ok (missing readings never trigger). The offending
+# metric is the first one at the sensor's severity.
+#
+# Classification compares each metric row of a metric-major array (as kept by SensorState)
+# against both thresholds, packing the hits into a 16-bit code per sensor (warning bits low,
+# critical bits high). A lookup table precomputed from the matrix then turns every code into
+# severity and offending metric, so 1M sensors take a few milliseconds.
+#
+# Config file (JSON): {"temperature": {"warning": 60, "critical": 80}, ...}. Metrics left out
+# of the file are not checked.
+class ThresholdRules:
+    def __init__(self, thresholds, metrics=METRICS):
+        self.metrics = [metric for metric in metrics if metric in thresholds]
+        if len(self.metrics) > 8:
+            raise ValueError("At most 8 metrics can have thresholds.")
+        self.matrix = np.array([[thresholds[metric]["warning"] for metric in self.metrics]
+                                , [thresholds[metric]["critical"] for metric in self.metrics]])
+        self.bits = np.left_shift(np.uint16(1), np.arange(len(self.metrics), dtype=np.uint16))
+        # Lookup tables over every code: severity, and index of the lowest set bit at that severity
+        codes = np.arange(1 << 16)
+        warning, critical = codes & 0xFF, codes >> 8
+        worst = np.where(critical > 0, critical, warning)
+        self.severity_of = np.where(critical > 0, CRITICAL, np.where(warning > 0, WARNING, OK)).astype(np.int8)
+        self.offending_of = np.where(worst > 0, np.log2(worst & -worst, where=worst > 0, out=np.zeros(len(codes))), -1).astype(np.int8)
+        # Labels for describe(): "ok", then every (severity, metric) pair
+        self.labels = ["ok"] + [f"{SEVERITIES[severity]} ({metric})"
+                                for severity in (WARNING, CRITICAL) for metric in self.metrics]
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    # Same rules with every threshold lowered by the metric's margin (0 for metrics left out),
+    # e.g. the level a sensor has to fall below before an alert on it clears
+    def relaxed(self, margins):
+        return ThresholdRules({metric: {"warning": self.matrix[0, i] - margins.get(metric, 0)
+                                        , "critical": self.matrix[1, i] - margins.get(metric, 0)}
+                               for i, metric in enumerate(self.metrics)}, self.metrics)
+
+    # Severity (int8) and offending metric index into self.metrics (int8, -1 when ok) of every
+    # sensor. `data` is a DataFrame with the metric columns or a (metrics x sensors) array in
+    # self.metrics order.
+    def classify(self, data):
+        # For frames built from SensorState this transpose is a view, not a copy
+        values = data[self.metrics].to_numpy().T if isinstance(data, pd.DataFrame) else np.asarray(data)
+        code = np.zeros(values.shape[1], dtype=np.uint16)
+        hit = np.empty(values.shape[1], dtype=bool)
+        for i, bit in enumerate(self.bits):
+            np.greater_equal(values[i], self.matrix[0, i], out=hit)
+            code |= hit * bit
+            np.greater_equal(values[i], self.matrix[1, i], out=hit)
+            code |= hit * (bit << np.uint16(8))
+        return np.take(self.severity_of, code), np.take(self.offending_of, code)
+
+    # (critical, warning, ok) counts, in the order the status cards show them
+    @staticmethod
+    def counts(severity):
+        ok, warning, critical = np.bincount(severity, minlength=3)
+        return int(critical), int(warning), int(ok)
+
+    # Readable status per sensor ("ok", "warning (uv)", "critical (temperature)", ...) as a
+    # categorical, so it costs one small integer per sensor
+    def describe(self, severity, offending):
+        codes = np.where(severity == OK, 0, 1 + (severity.astype(int) - 1) * len(self.metrics) + offending)
+        return pd.Categorical.from_codes(codes, self.labels)
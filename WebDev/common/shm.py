@@ -0,0 +1,427 @@
+import argparse
+import collections
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import pandas as pd
+
+from .alerts import AlertTracker, WebhookNotifier
+from .anomaly import AnomalyDetector
+from .binning import SpatialBins, cell_radius, level_for_zoom, view_bounds
+from .history import SensorHistory
+from .ingest import IngestWorker
+from .rules import ThresholdRules
+
+# Segment the ingest process publishes to by default (a file in /dev/shm on Linux)
+DEFAULT_NAME = "sensor_state"
+MAGIC = b"SNSM"
+ALIGN = 64
+ERROR_BYTES = 256
+
+# Fixed header at the start of the segment. `sequence` is the seqlock: odd while the writer is
+# publishing. `active` is the buffer holding the latest state, and tick, received_at and the
+# (critical, warning, ok) counts are kept per buffer. `closed` is set before the writer
+# removes the segment (new registry or shutdown), so readers know to attach again. `pid` is
+# the writing process, so a second writer can tell a live segment from one left behind.
+HEADER = np.dtype([
+    ("magic", "S4"), ("closed", "<u4"), ("pid", "<u4"), ("sensors", "<u8"), ("metrics", "<u4"), ("capacity", "<u4")
+    , ("names", "<u4"), ("active", "<u4"), ("sequence", "<u8"), ("tick", "<i8", 2), ("received_at", "<f8", 2)
+    , ("counts", "<i8", (2, 3)), ("head", "<u4"), ("size", "<u4"), ("error", f"S{ERROR_BYTES}")
+], align=True)
+
+# Latest state read from the segment. Like Snapshot (common/ingest.py) with the classification
+# the ingest process already did, and the sequence number the state was read at.
+SharedSnapshot = collections.namedtuple("SharedSnapshot", ["tick", "received_at", "data", "severity", "offending", "counts", "sequence"])
+
+
+def _aligned(size):
+    return (size + ALIGN - 1) // ALIGN * ALIGN
+
+
+# Offset, dtype and shape of every array in the segment, after the header:
+#   lat, lon, district           static, written once: positions and district code per sensor
+#   names                        JSON {"metrics": [...], "districts": [...]}
+#   values0/1                    (metrics x sensors) float64 readings, double buffered
+#   severity0/1, offending0/1    int8 classification of the same buffer (common/rules.py)
+#   anomaly0/1, score0/1         flagged metric (int8) and anomaly score (common/anomaly.py)
+#   history, fleet, times        SensorHistory ring of the last `capacity` ticks
+def _layout(sensors, k, capacity, names):
+    history, fleet, times = SensorHistory.ring_shapes(sensors, capacity, k)
+    arrays = [("lat", "<f8", (sensors,)), ("lon", "<f8", (sensors,)), ("district", "<i4", (sensors,))
+              , ("names", "u1", (names,))]
+    for buffer in range(2):
+        arrays += [(f"values{buffer}", "<f8", (k, sensors)), (f"severity{buffer}", "i1", (sensors,))
+                   , (f"offending{buffer}", "i1", (sensors,)), (f"anomaly{buffer}", "i1", (sensors,))
+                   , (f"score{buffer}", "<f4", (sensors,))]
+    arrays += [("history", "<f4", history), ("fleet", "<f8", fleet), ("times", "<f8", times)]
+    layout, offset = {}, _aligned(HEADER.itemsize)
+    for name, dtype, shape in arrays:
+        layout[name] = (offset, np.dtype(dtype), shape)
+        offset = _aligned(offset + np.dtype(dtype).itemsize * int(np.prod(shape)))
+    return layout, offset
+
+
+def _views(buffer, layout):
+    return {name: np.ndarray(shape, dtype, buffer, offset) for name, (offset, dtype, shape) in layout.items()}
+
+
+# Attach to an existing segment without handing it to this process's resource tracker, which
+# would otherwise remove it when a dashboard exits (Python < 3.13 registers readers too)
+def _attach(name):
+    segment = shared_memory.SharedMemory(name)
+    try:
+        resource_tracker.unregister(segment._name, "shared_memory")
+    except Exception:
+        pass
+    return segment
+
+
+# Process id of the writer still publishing into segment `name`, or None when there is no such
+# segment or its writer closed it or is gone (killed without removing it)
+def writer_pid(name):
+    try:
+        segment = _attach(name)
+    except FileNotFoundError:
+        return None
+    try:
+        if segment.size < HEADER.itemsize:
+            return None
+        header = np.ndarray((), HEADER, segment.buf)
+        pid, closed = int(header["pid"]), int(header["closed"])
+        del header
+    finally:
+        segment.close()
+    if closed or not pid:
+        return None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return None
+    except PermissionError:
+        pass
+    return pid
+
+
+# Write side: one segment per sensor registry. Each publish copies the state into the buffer
+# readers are not looking at, classifies and scores it there, appends it to the history ring,
+# and only then flips `active`, so a reader holding the previous state keeps a consistent view
+# while the next one is written. The sequence number is bumped before and after, and a buffer is only
+# rewritten two publishes after it stopped being active.
+class SharedStateWriter:
+    def __init__(self, name, state, rules, history_size=300, max_history_bytes=256 * 2 ** 20):
+        self.metrics = list(state.metrics)
+        self.rules = rules
+        # Rows of the state the rules look at, in rules.metrics order
+        self.rule_rows = [self.metrics.index(metric) for metric in rules.metrics]
+        sensors, k = len(state.ids), len(self.metrics)
+        capacity = SensorHistory.ring_capacity(sensors, history_size, k, max_history_bytes)
+        names = json.dumps({"metrics": self.metrics, "districts": [str(name) for name in state.district.categories]}).encode()
+        layout, size = _layout(sensors, k, capacity, len(names))
+        pid = writer_pid(name)
+        if pid is not None:
+            raise FileExistsError(f"Shared memory segment {name!r} is in use by the ingest process {pid}")
+        try:
+            # Left behind by a worker that was killed; readers attached to it see it closed.
+            # _attach unregistered it, and unlink() unregisters again, so hand it back first.
+            stale = _attach(name)
+            if stale.size >= HEADER.itemsize:
+                np.ndarray((), HEADER, stale.buf)["closed"] = 1
+            stale.close()
+            resource_tracker.register(stale._name, "shared_memory")
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        self.segment = shared_memory.SharedMemory(name, create=True, size=size)
+        self.header = np.ndarray((), HEADER, self.segment.buf)
+        self.arrays = _views(self.segment.buf, layout)
+        self.arrays["lat"][:] = state.lat
+        self.arrays["lon"][:] = state.lon
+        self.arrays["district"][:] = state.district.codes
+        self.arrays["names"][:] = np.frombuffer(names, dtype=np.uint8)
+        self.history = SensorHistory(sensors, capacity, self.metrics, max_history_bytes
+                                     , buffers=(self.arrays["history"], self.arrays["fleet"], self.arrays["times"]))
+        self.anomalies = AnomalyDetector(sensors, self.metrics)
+        self.header["tick"] = -1
+        self.header["sensors"], self.header["metrics"], self.header["capacity"] = sensors, k, capacity
+        self.header["names"] = len(names)
+        self.header["pid"] = os.getpid()
+        self.header["magic"] = MAGIC
+
+    def publish(self, values, tick, received_at):
+        header = self.header
+        buffer = 1 - int(header["active"])
+        header["sequence"] += 1
+        target = self.arrays[f"values{buffer}"]
+        np.copyto(target, values)
+        severity, offending = self.rules.classify(target[self.rule_rows])
+        self.arrays[f"severity{buffer}"][:] = severity
+        self.arrays[f"offending{buffer}"][:] = offending
+        self.arrays[f"anomaly{buffer}"][:], self.arrays[f"score{buffer}"][:] = self.anomalies.update(target)
+        header["counts"][buffer] = self.rules.counts(severity)
+        header["tick"][buffer] = tick
+        header["received_at"][buffer] = received_at
+        self.history.append(target, received_at)
+        header["head"], header["size"] = self.history.head, self.history.size
+        header["active"] = buffer
+        header["sequence"] += 1
+        return severity, offending
+
+    def set_error(self, error):
+        self.header["error"] = str(error or "").encode("utf-8", "replace")[:ERROR_BYTES]
+
+    def close(self):
+        self.header["closed"] = 1
+        del self.header, self.arrays, self.history
+        self.segment.close()
+        self.segment.unlink()
+
+
+# IngestWorker that publishes every state into a shared memory segment instead of keeping
+# snapshots, bins and history for sessions of its own process. Run it in its own process
+# (see __main__ below) so decoding, classification and the history ring use a core of their
+# own, and dashboards only map the result.
+class SharedIngestWorker(IngestWorker):
+    def __init__(self, url, sensors_url, rules, name=DEFAULT_NAME, history_size=300, **kwargs):
+        self.segment_name = name
+        self.rules = rules
+        self.writer = None
+        self.tick = -1
+        super().__init__(url, sensors_url, history_size=history_size, **kwargs)
+
+    @property
+    def error(self):
+        return self._error
+
+    # Errors go into the segment as well, so dashboards can show them
+    @error.setter
+    def error(self, error):
+        self._error = error
+        if getattr(self, "writer", None) is not None:
+            with self.condition:
+                if self.writer is not None:
+                    self.writer.set_error(error)
+
+    # Publishing stops (and the error says why) while another process owns the segment
+    def _reset(self, state):
+        with self.condition:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+            try:
+                self.writer = SharedStateWriter(self.segment_name, state, self.rules, self.history_size)
+            except FileExistsError as e:
+                self.error = e
+                return
+        self._open_store(state)
+
+    def _publish(self, state, changed=None):
+        if self.writer is None:
+            return
+        now = time.time()
+        with self.condition:
+            self.tick += 1
+            severity, offending = self.writer.publish(state.values, self.tick, now)
+        if self.alerts is not None:
+            self.alerts.update(state.values, severity, offending, now)
+        self.error = self.store_error
+
+    def close(self):
+        with self.condition:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+
+
+# Read side, with the read methods of IngestWorker (latest, trend, sensor_history, binned,
+# wait_for_update, error), so a dashboard can use either. The state is never copied: the
+# frame of a SharedSnapshot wraps the segment's buffer directly and stays consistent until
+# the writer has published twice more (valid() tells), which at one tick per second is far
+# longer than a dashboard takes to draw it. Header fields and the history ring are read under
+# the seqlock and retried if a publish overlapped. One reader can be shared by every session
+# of a dashboard process.
+class SharedStateReader:
+    def __init__(self, name=DEFAULT_NAME):
+        self.name = name
+        self.lock = threading.RLock()
+        self.segment = None
+        self.snapshot = None
+        self.bins = None
+        self.bins_tick = -1
+        self.attach_error = None
+
+    def _attach(self):
+        if self.segment is not None and not self.header["closed"]:
+            return True
+        with self.lock:
+            return self._reattach()
+
+    def _reattach(self):
+        if self.segment is not None and not self.header["closed"]:
+            return True
+        self._detach()
+        try:
+            segment = _attach(self.name)
+        except FileNotFoundError:
+            self.attach_error = f"no shared memory segment '{self.name}', is the ingest worker running?"
+            return False
+        header = np.ndarray((), HEADER, segment.buf)
+        if header["magic"] != MAGIC or header["closed"]:
+            # Still being set up, or about to be removed
+            del header
+            segment.close()
+            self.attach_error = f"shared memory segment '{self.name}' is not ready"
+            return False
+        sensors, k, capacity = int(header["sensors"]), int(header["metrics"]), int(header["capacity"])
+        layout, _ = _layout(sensors, k, capacity, int(header["names"]))
+        arrays = _views(segment.buf, layout)
+        for array in arrays.values():
+            array.flags.writeable = False
+        names = json.loads(arrays["names"].tobytes())
+        self.segment, self.header, self.arrays = segment, header, arrays
+        self.metrics = names["metrics"]
+        self.district = pd.Categorical.from_codes(arrays["district"], names["districts"])
+        self.history = SensorHistory(sensors, capacity, self.metrics
+                                     , buffers=(arrays["history"], arrays["fleet"], arrays["times"]))
+        self.attach_error = None
+        return True
+
+    def _detach(self):
+        if self.segment is None:
+            return
+        # Views into the segment must be gone before it can be unmapped
+        segment = self.segment
+        self.segment = self.header = self.arrays = self.history = self.district = None
+        self.snapshot = self.bins = None
+        self.bins_tick = -1
+        try:
+            segment.close()
+        except BufferError:
+            # Frames handed out earlier still point into it; it is unmapped once they are gone
+            pass
+
+    # Runs `read` between two equal, even sequence numbers; returns (result, sequence)
+    def _consistent(self, read):
+        while True:
+            sequence = int(self.header["sequence"])
+            if sequence % 2 == 0:
+                result = read()
+                if int(self.header["sequence"]) == sequence:
+                    return result, sequence
+            time.sleep(0.0005)
+
+    @property
+    def error(self):
+        if not self._attach():
+            return self.attach_error
+        error = self.header["error"].item().decode("utf-8", "replace")
+        return error or None
+
+    def latest(self):
+        if not self._attach() or self.header["tick"].max() < 0:
+            return None
+        (buffer, tick, received_at, counts), sequence = self._consistent(lambda: (
+            int(self.header["active"]), int(self.header["tick"][self.header["active"]])
+            , float(self.header["received_at"][self.header["active"]]), tuple(int(count) for count in self.header["counts"][self.header["active"]])))
+        if self.snapshot is not None and self.snapshot.tick == tick:
+            return self.snapshot
+        data = pd.DataFrame(self.arrays[f"values{buffer}"].T, columns=self.metrics, copy=False)
+        data.insert(0, "id", np.arange(data.shape[0]))
+        data.insert(1, "lat", self.arrays["lat"])
+        data.insert(2, "lon", self.arrays["lon"])
+        data.insert(3, "district", self.district)
+        data["anomaly"] = self.arrays[f"anomaly{buffer}"]
+        data["anomaly_score"] = self.arrays[f"score{buffer}"]
+        self.snapshot = SharedSnapshot(tick, received_at, data, self.arrays[f"severity{buffer}"]
+                                       , self.arrays[f"offending{buffer}"], counts, sequence)
+        return self.snapshot
+
+    # Whether the writer has not started reusing the buffer of `snapshot` yet
+    def valid(self, snapshot):
+        return self.segment is not None and int(self.header["sequence"]) <= snapshot.sequence + 2
+
+    def _history(self, read):
+        def locked():
+            self.history.head, self.history.size = int(self.header["head"]), int(self.header["size"])
+            return read() if self.history.size else None
+        return self._consistent(locked)[0]
+
+    def trend(self, window=None):
+        if not self._attach():
+            return None
+        return self._history(lambda: self.history.fleet_means(window))
+
+    def sensor_history(self, sensor, window=None):
+        if not self._attach() or not 0 <= sensor < self.history.values.shape[2]:
+            return None, None
+        result = self._history(lambda: (self.history.sensor(sensor, window), self.history.window_stats(window, [sensor]).iloc[0]))
+        return result or (None, None)
+
+    # Same as IngestWorker.binned. The bins are kept in this process and only rebuilt when a
+    # map asks for them on a new tick, so dashboards that never bin pay nothing.
+    def binned(self, zoom, latitude, longitude, width=1200, height=800):
+        level = level_for_zoom(zoom)
+        snapshot = self.latest()
+        if snapshot is None:
+            return None, cell_radius(level)
+        with self.lock:
+            if self.bins is None:
+                self.bins = SpatialBins(self.arrays["lat"], self.arrays["lon"], self.metrics)
+            if self.bins_tick != snapshot.tick:
+                self.bins.update(snapshot.data[self.metrics].to_numpy().T)
+                self.bins_tick = snapshot.tick
+            return self.bins.cells(level, view_bounds(latitude, longitude, zoom, width, height)), cell_radius(level)
+
+    def wait_for_update(self, after_tick=-1, timeout=None, poll=0.01):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self.latest()
+            if snapshot is not None and snapshot.tick > after_tick:
+                return snapshot
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(poll)
+
+
+# Runs the ingest side in its own process and publishes into shared memory:
+#   python -m common.shm --thresholds Frontend/thresholds.json      (from WebDev)
+# then start the dashboard with SENSOR_SHM=sensor_state to read from it.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode and classify the sensor stream into shared memory")
+    parser.add_argument("--upstream", default="http://127.0.0.1:5000", help="data server to subscribe to")
+    parser.add_argument("--name", default=DEFAULT_NAME, help="shared memory segment to publish to")
+    parser.add_argument("--thresholds", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Frontend", "thresholds.json")
+                        , help="threshold rules to classify with (the dashboard's thresholds.json)")
+    parser.add_argument("--history", type=int, default=300, help="ticks of history to keep")
+    parser.add_argument("--webhook", default=None, help="post alert transitions to this URL")
+    options = parser.parse_args()
+    pid = writer_pid(options.name)
+    if pid is not None:
+        parser.error(f"{options.name} is already published by process {pid}; stop it or pass another --name")
+    rules = ThresholdRules.load(options.thresholds)
+    alerts = None
+    if options.webhook:
+        notifier = WebhookNotifier(options.webhook)
+        notifier.start()
+        alerts = AlertTracker(rules, notifier=notifier)
+    worker = SharedIngestWorker(f"{options.upstream}/data?format=binary&mode=delta", f"{options.upstream}/sensors"
+                                , rules, options.name, options.history, alerts=alerts)
+    # Remove the segment on `kill` as well as on Ctrl-C
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    worker.start()
+    try:
+        while True:
+            time.sleep(10)
+            if worker.writer is None:
+                print(f"Waiting for {options.upstream}: {worker.error}")
+            else:
+                print(f"Published {worker.tick + 1} ticks")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker.close()
@@ -0,0 +1,172 @@
+import collections
+import functools
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from .geo import GEOJSON_PATH, _polygons, load_geojson
+
+# Zoom levels that get their own simplified geometry. Above the finest one the original
+# boundaries are used.
+ZOOM_LEVELS = (4, 5, 6, 7, 8, 9, 10)
+# Decimal places kept in the cached coordinates (5 is about a metre)
+PRECISION = 5
+
+
+def cache_path(path=GEOJSON_PATH):
+    return os.path.splitext(path)[0] + ".simplified.json"
+
+
+# Half a screen pixel in degrees at `zoom`, for 256 px web mercator tiles
+def tolerance_for_zoom(zoom):
+    return 360.0 / (256 * 2 ** zoom) / 2
+
+
+# Douglas-Peucker on one open polyline; both endpoints are always kept
+def _douglas_peucker(points, tolerance):
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        segment = points[last] - points[first]
+        offsets = points[first + 1:last] - points[first]
+        length = np.hypot(*segment)
+        if length == 0:
+            distance = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distance = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        farthest = int(np.argmax(distance))
+        if distance[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.extend([(first, split), (split, last)])
+    return points[keep]
+
+
+# Split every ring into arcs at junctions, the vertices where more than two boundary segments
+# meet. A border shared by two districts is then the same arc in both rings (walked in
+# opposite directions), so it is simplified once and both districts get the identical
+# simplified border. Rings touching nothing else become a single closed arc.
+# Returns the unique arcs (as tuples of vertices) and, per ring, the (arc, reversed) sequence.
+def _topology(rings):
+    neighbours = collections.defaultdict(set)
+    for ring in rings:
+        for i, vertex in enumerate(ring):
+            neighbours[vertex].update((ring[i - 1], ring[(i + 1) % len(ring)]))
+    arcs, arc_ids, ring_arcs = [], {}, []
+    for ring in rings:
+        junctions = [i for i, vertex in enumerate(ring) if len(neighbours[vertex]) > 2] or [0]
+        # Start the ring at a junction, then cut at every junction
+        ring = ring[junctions[0]:] + ring[:junctions[0]]
+        cuts = [i - junctions[0] for i in junctions] + [len(ring)]
+        closed = ring + [ring[0]]
+        sequence = []
+        for start, stop in zip(cuts, cuts[1:]):
+            arc = tuple(closed[start:stop + 1])
+            backward = arc[::-1]
+            reversed_ = backward < arc
+            key = backward if reversed_ else arc
+            if key not in arc_ids:
+                arc_ids[key] = len(arcs)
+                arcs.append(key)
+            sequence.append((arc_ids[key], reversed_))
+        ring_arcs.append(sequence)
+    return arcs, ring_arcs
+
+
+def _rings(geojson):
+    for feature in geojson["features"]:
+        for polygon in _polygons(feature):
+            for ring in polygon:
+                # Drop the closing vertex; rings are closed again when rebuilt
+                yield [tuple(vertex) for vertex in ring[:-1]]
+
+
+# Simplified copies of the geojson, one per zoom level
+def build_levels(geojson, zooms=ZOOM_LEVELS):
+    rings = list(_rings(geojson))
+    arcs, ring_arcs = _topology(rings)
+    arcs = [np.array(arc) for arc in arcs]
+    levels = {}
+    for zoom in zooms:
+        tolerance = tolerance_for_zoom(zoom)
+        simplified = [np.round(_douglas_peucker(arc, tolerance), PRECISION).tolist() for arc in arcs]
+        rebuilt = []
+        for ring, sequence in zip(rings, ring_arcs):
+            points = []
+            for arc_id, reversed_ in sequence:
+                arc = simplified[arc_id][::-1] if reversed_ else simplified[arc_id]
+                points.extend(arc if not points else arc[1:])
+            # A ring that collapsed below a triangle keeps its original vertices
+            if len(points) < 4:
+                points = np.round(ring + [ring[0]], PRECISION).tolist()
+            rebuilt.append(points)
+        # Put the rings back into the original feature / polygon structure
+        rebuilt = iter(rebuilt)
+        features = []
+        for feature in geojson["features"]:
+            polygons = [[next(rebuilt) for _ in polygon] for polygon in _polygons(feature)]
+            geometry = {"type": "MultiPolygon", "coordinates": polygons}
+            features.append({"type": "Feature", "properties": feature["properties"], "geometry": geometry})
+        levels[zoom] = {"type": "FeatureCollection", "features": features}
+    return levels
+
+
+# All levels for a geojson file, read from the cache next to it and rebuilt whenever the
+# source changes. Loaded once per process.
+def load_levels(path=GEOJSON_PATH):
+    return _load_levels(os.path.abspath(path))
+
+
+@functools.lru_cache(maxsize=None)
+def _load_levels(path):
+    with open(path, "rb") as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    try:
+        with open(cache_path(path)) as f:
+            cached = json.load(f)
+        if cached["source"] == digest:
+            return {int(zoom): level for zoom, level in cached["levels"].items()}
+    except (OSError, ValueError, KeyError):
+        pass
+    levels = build_levels(load_geojson(path))
+    try:
+        with open(cache_path(path), "w") as f:
+            json.dump({"source": digest, "levels": levels}, f, separators=(",", ":"))
+    except OSError:
+        # Read-only checkout: keep the levels in memory only
+        pass
+    return levels
+
+
+@functools.lru_cache(maxsize=None)
+def _full_geometry(path):
+    return load_geojson(path)
+
+
+# Geometry to draw at `zoom`: the finest precomputed level not above it, or the original
+# boundaries when zoomed in past every level
+def geometry_for_zoom(zoom, path=GEOJSON_PATH):
+    levels = load_levels(path)
+    if zoom > max(levels):
+        return _full_geometry(os.path.abspath(path))
+    return levels[max([level for level in levels if level <= zoom], default=min(levels))]
+
+
+# Precompute the cache ahead of time: python -m common.simplify
+if __name__ == "__main__":
+    if os.path.exists(cache_path()):
+        os.remove(cache_path())
+    levels = load_levels()
+    print(f"original: {os.path.getsize(GEOJSON_PATH)} bytes")
+    for zoom, level in levels.items():
+        size = len(json.dumps(level, separators=(",", ":")))
+        vertices = sum(len(ring) for feature in level["features"]
+                       for polygon in feature["geometry"]["coordinates"] for ring in polygon)
+        print(f"zoom {zoom}: {vertices} vertices, {size} bytes")
+    print(f"cache: {cache_path()} ({os.path.getsize(cache_path())} bytes)")
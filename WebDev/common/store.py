@@ -0,0 +1,258 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from .frames import METRICS
+
+# Store layout, append-only:
+#   <root>/locations.npy            sensor positions (sensors x 2 float64, lat/lon) in id order
+#   <root>/<start>/time.f8          one partition per `partition_seconds`, named by its start
+#   <root>/<start>/sensor.u4        (unix seconds); one row per reading, columns stored as raw
+#   <root>/<start>/<metric>.f4      little endian arrays of the same length
+# Rows are in time order within a partition. Every partition starts with a checkpoint of the
+# full state (one row per sensor), so the state at any time can be rebuilt from one partition.
+COLUMNS = (("time", "<f8"), ("sensor", "<u4"))
+VALUE_DTYPE = "<f4"
+
+
+def _column_files(metrics):
+    return list(COLUMNS) + [(metric, VALUE_DTYPE) for metric in metrics]
+
+
+def _partitions(root):
+    if not os.path.isdir(root):
+        return []
+    return sorted(int(name) for name in os.listdir(root) if name.isdigit())
+
+
+# Rows fully written in every column of a partition; a writer killed mid-flush can leave some
+# columns longer than others
+def _rows(directory, metrics):
+    sizes = [os.path.getsize(os.path.join(directory, f"{name}.{dtype[1:]}")) // np.dtype(dtype).itemsize
+             if os.path.exists(os.path.join(directory, f"{name}.{dtype[1:]}")) else 0
+             for name, dtype in _column_files(metrics)]
+    return min(sizes)
+
+
+# Persists every reading the ingest side receives. Rows are buffered in preallocated arrays and
+# written one array per column when `batch_rows` are pending or `flush_interval` seconds have
+# passed, so the per-frame cost is a few array copies. Reopening an existing store continues it,
+# as long as it holds the same sensors.
+class StoreWriter:
+    def __init__(self, root, locations, metrics=METRICS, partition_seconds=3600, batch_rows=65536, flush_interval=5.0):
+        locations = np.asarray(locations, dtype="<f8").reshape(-1, 2)
+        self.root = root
+        self.metrics = list(metrics)
+        self.partition_seconds = partition_seconds
+        self.flush_interval = flush_interval
+        os.makedirs(root, exist_ok=True)
+        locations_path = os.path.join(root, "locations.npy")
+        if os.path.exists(locations_path):
+            if not np.array_equal(np.load(locations_path), locations):
+                raise ValueError(f"{root} holds a different set of sensors.")
+            # Carry the last stored state into the next checkpoint
+            self.latest = SensorStore(root, self.metrics).state_values_at(np.inf)
+        else:
+            np.save(locations_path, locations)
+            self.latest = np.full((len(self.metrics), len(locations)), np.nan, dtype=VALUE_DTYPE)
+        self.times = np.empty(batch_rows, dtype="<f8")
+        self.sensors = np.empty(batch_rows, dtype="<u4")
+        self.values = np.empty((len(self.metrics), batch_rows), dtype=VALUE_DTYPE)
+        self.pending = 0
+        self.files = None
+        self.partition_end = -np.inf
+        self.last_time = -np.inf
+        self.last_flush = time.monotonic()
+
+    def _open_partition(self, timestamp):
+        self._flush()
+        self.close()
+        start = int(timestamp // self.partition_seconds * self.partition_seconds)
+        directory = os.path.join(self.root, str(start))
+        os.makedirs(directory, exist_ok=True)
+        # Drop rows that not every column received, so the columns stay aligned
+        rows = _rows(directory, self.metrics)
+        self.files = []
+        for name, dtype in _column_files(self.metrics):
+            path = os.path.join(directory, f"{name}.{dtype[1:]}")
+            with open(path, "ab") as f:
+                f.truncate(rows * np.dtype(dtype).itemsize)
+            self.files.append(open(path, "ab"))
+        self.partition_end = start + self.partition_seconds
+        self._buffer(timestamp, np.arange(self.latest.shape[1]), self.latest)
+
+    def _buffer(self, timestamp, ids, values):
+        done = 0
+        while done < len(ids):
+            count = min(len(ids) - done, len(self.times) - self.pending)
+            rows = slice(self.pending, self.pending + count)
+            self.times[rows] = timestamp
+            self.sensors[rows] = ids[done:done + count]
+            self.values[:, rows] = values[:, done:done + count]
+            self.pending += count
+            done += count
+            if self.pending == len(self.times):
+                self._flush()
+
+    def _flush(self):
+        if self.files is None or self.pending == 0:
+            return
+        columns = [self.times, self.sensors] + list(self.values)
+        for f, column in zip(self.files, columns):
+            f.write(column[:self.pending].tobytes())
+            f.flush()
+        self.pending = 0
+        self.last_flush = time.monotonic()
+
+    # Readings of the sensors `ids`, values as a (metrics x len(ids)) array, as in SensorState
+    def append(self, ids, values, timestamp=None):
+        ids = np.asarray(ids, dtype=np.intp)
+        values = np.asarray(values, dtype=VALUE_DTYPE)
+        # Time never goes backwards inside the store, so range scans can binary search it
+        timestamp = max(time.time() if timestamp is None else timestamp, self.last_time)
+        self.last_time = timestamp
+        self.latest[:, ids] = values
+        if timestamp >= self.partition_end:
+            # The checkpoint at the start of the new partition already holds these readings
+            self._open_partition(timestamp)
+        else:
+            self._buffer(timestamp, ids, values)
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self._flush()
+
+    def append_frame(self, frame, timestamp=None):
+        self.append(frame["id"].to_numpy(), frame[self.metrics].to_numpy().T, timestamp)
+
+    def flush(self):
+        self._flush()
+
+    def close(self):
+        self._flush()
+        for f in self.files or []:
+            f.close()
+        self.files = None
+
+
+# Read side of the store. Columns are memory-mapped per query, so a range scan only touches the
+# pages of the rows it returns (found by binary search on the time column), and data written
+# by a running StoreWriter shows up on the next query.
+class SensorStore:
+    def __init__(self, root, metrics=METRICS):
+        self.root = root
+        self.metrics = list(metrics)
+        self.locations = np.load(os.path.join(root, "locations.npy"))
+
+    def _columns(self, start):
+        directory = os.path.join(self.root, str(start))
+        rows = _rows(directory, self.metrics)
+        if rows == 0:
+            return None
+        return {name: np.memmap(os.path.join(directory, f"{name}.{dtype[1:]}"), dtype=dtype, mode="r", shape=(rows,))
+                for name, dtype in _column_files(self.metrics)}
+
+    # Partitions that may hold rows in [start, end]
+    def _covering(self, start, end):
+        partitions = _partitions(self.root)
+        following = partitions[1:] + [np.inf]
+        return [partition for partition, next_start in zip(partitions, following)
+                if partition <= end and next_start > start]
+
+    # (first, last) timestamp in the store, or None when it is empty
+    def time_range(self):
+        partitions = _partitions(self.root)
+        first = next((columns for columns in map(self._columns, partitions) if columns is not None), None)
+        last = next((columns for columns in map(self._columns, reversed(partitions)) if columns is not None), None)
+        if first is None:
+            return None
+        return float(first["time"][0]), float(last["time"][-1])
+
+    # Every row with start <= time < end (checkpoint rows included), optionally only some
+    # metrics and sensors, as a DataFrame with time, sensor and one column per metric
+    def scan(self, start, end, metrics=None, sensors=None):
+        metrics = self.metrics if metrics is None else list(metrics)
+        parts = []
+        for partition in self._covering(start, end):
+            columns = self._columns(partition)
+            if columns is None:
+                continue
+            rows = slice(*np.searchsorted(columns["time"], [start, end], side="left"))
+            keep = slice(None) if sensors is None else np.isin(columns["sensor"][rows], sensors)
+            parts.append({name: np.asarray(columns[name][rows][keep]) for name in ["time", "sensor"] + metrics})
+        if not parts:
+            return pd.DataFrame(columns=["time", "sensor"] + metrics)
+        frame = pd.DataFrame({name: np.concatenate([part[name] for part in parts]) for name in parts[0]})
+        frame["time"] = pd.to_datetime(frame["time"], unit="s")
+        return frame
+
+    # Latest reading of every sensor at `timestamp` as a (metrics x sensors) array. Only the
+    # partition holding `timestamp` is read: its checkpoint plus the rows after it, applied in
+    # order (with repeated sensors, the last assignment wins).
+    def state_values_at(self, timestamp):
+        values = np.full((len(self.metrics), len(self.locations)), np.nan, dtype=VALUE_DTYPE)
+        for partition in reversed(self._covering(-np.inf, timestamp)):
+            columns = self._columns(partition)
+            if columns is None:
+                continue
+            end = np.searchsorted(columns["time"], timestamp, side="right")
+            if end == 0:
+                continue
+            self._apply(values, columns, slice(0, end))
+            break
+        return values
+
+    def _apply(self, values, columns, rows):
+        sensors = columns["sensor"][rows]
+        for i, metric in enumerate(self.metrics):
+            values[i, sensors] = columns[metric][rows]
+
+    def _frame(self, values):
+        frame = pd.DataFrame(values.T.astype(float), columns=self.metrics)
+        frame.insert(0, "id", np.arange(len(self.locations)))
+        frame.insert(1, "lat", self.locations[:, 0])
+        frame.insert(2, "lon", self.locations[:, 1])
+        return frame
+
+    # Map frame (id, lat, lon and every metric) of the state at `timestamp`
+    def state_at(self, timestamp):
+        return self._frame(self.state_values_at(timestamp))
+
+    # Historical playback: yields (timestamp, frame) every `step` seconds from start to end.
+    # The state is rebuilt once at `start`, then each step only applies the rows recorded since
+    # the previous one.
+    def playback(self, start, end, step=1.0):
+        values = self.state_values_at(start)
+        yield start, self._frame(values)
+        previous = start
+        for timestamp in np.arange(start + step, end + step / 2, step):
+            for partition in self._covering(previous, timestamp):
+                columns = self._columns(partition)
+                if columns is not None:
+                    self._apply(values, columns, slice(*np.searchsorted(columns["time"], [previous, timestamp], side="right")))
+            previous = timestamp
+            yield float(timestamp), self._frame(values)
+
+
+# Records the data server's stream into a store without running a dashboard:
+#   python -m common.store --path history      (from WebDev)
+if __name__ == "__main__":
+    from .ingest import IngestWorker
+
+    parser = argparse.ArgumentParser(description="Persist the sensor stream into a history store")
+    parser.add_argument("--upstream", default="http://127.0.0.1:5000", help="data server to subscribe to")
+    parser.add_argument("--path", default="history", help="store directory")
+    options = parser.parse_args()
+    worker = IngestWorker(f"{options.upstream}/data?format=binary&mode=delta", f"{options.upstream}/sensors"
+                          , store_path=options.path)
+    worker.start()
+    tick = -1
+    while True:
+        snapshot = worker.wait_for_update(tick, timeout=10)
+        if snapshot is None:
+            print(f"Waiting for {options.upstream}: {worker.error}")
+            continue
+        tick = snapshot.tick
+        if tick % 60 == 0:
+            print(f"Stored {tick + 1} ticks")
@@ -0,0 +1,149 @@
+import collections
+import io
+import math
+import threading
+
+import numpy as np
+from PIL import Image
+
+from .colors import RAMP, ramp_table
+from .interpolate import get_interpolator, make_grid
+
+TILE_SIZE = 256
+
+# Opacity of the heatmap tiles, which use the diverging ramp of common/colors.py
+ALPHA = 170
+
+
+# Longitude/latitude box (west, south, east, north) of a web mercator tile
+def tile_bounds(z, x, y):
+    n = 2 ** z
+    west, east = x / n * 360.0 - 180.0, (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return west, south, east, north
+
+
+# x and y ranges of the tiles at zoom z that cover a (lon_min, lat_min, lon_max, lat_max) box
+def tile_range(z, bounds):
+    lon_min, lat_min, lon_max, lat_max = bounds
+    n = 2 ** z
+
+    def tile_y(lat):
+        return int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    x_range = range(max(0, int((lon_min + 180) / 360 * n)), min(n - 1, int((lon_max + 180) / 360 * n)) + 1)
+    y_range = range(max(0, tile_y(lat_max)), min(n - 1, tile_y(lat_min)) + 1)
+    return x_range, y_range
+
+
+# Server-rendered heatmap tiles of one metric. Every new snapshot is interpolated once onto a
+# fixed field grid over `bounds` with the cached interpolators of common/interpolate.py. The
+# field is split into blocks of `block` x `block` cells, and a block only takes the new values
+# (and the snapshot's tick as its version) when some cell moved by more than `tolerance`.
+# A tile's version is the newest version among the blocks under it, so the tile cache, keyed
+# by (version, z, x, y), keeps serving unchanged tiles and only re-renders the ones whose part
+# of the field actually changed.
+class HeatmapTiles:
+    def __init__(self, bounds, metric="temperature", value_range=(40.0, 70.0), method="cubic"
+                 , resolution=512, block=16, tolerance=0.5, cache_size=2048):
+        self.bounds = bounds
+        self.metric = metric
+        self.low, self.high = value_range
+        self.method = method
+        self.block = block
+        self.tolerance = tolerance
+        self.cache_size = cache_size
+        lon_min, lat_min, lon_max, lat_max = bounds
+        # Field indexed [lon, lat] like np.mgrid; the resolution is rounded up to whole blocks
+        resolution = -(-resolution // block) * block
+        self.grid_x, self.grid_y = make_grid([lon_min, lon_max], [lat_min, lat_max], resolution)
+        self.field = np.full(self.grid_x.shape, np.nan)
+        self.version = np.full((resolution // block, resolution // block), -1)
+        self.tick = -1
+        self.lut = ramp_table(RAMP, ALPHA)
+        self.cache = collections.OrderedDict()
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+
+    # Bring the field up to date with a snapshot from the ingest worker
+    def refresh(self, snapshot):
+        with self.lock:
+            if snapshot is None or snapshot.tick == self.tick:
+                return
+            data = snapshot.data
+            points = np.column_stack((data["lon"].to_numpy(), data["lat"].to_numpy()))
+            values = get_interpolator(points, self.grid_x, self.grid_y, self.method)(data[self.metric].to_numpy())
+            n = self.field.shape[0] // self.block
+            with np.errstate(invalid="ignore"):
+                moved = (np.abs(values - self.field) > self.tolerance) | (np.isnan(values) != np.isnan(self.field))
+            changed = moved.reshape(n, self.block, n, self.block).any(axis=(1, 3))
+            mask = np.repeat(np.repeat(changed, self.block, axis=0), self.block, axis=1)
+            self.field[mask] = values[mask]
+            self.version[changed] = snapshot.tick
+            self.tick = snapshot.tick
+
+    # Field cells (lon index, lat index) of the pixel centres of a tile; -1 outside the field
+    def _pixels(self, z, x, y):
+        n = 2 ** z
+        offsets = (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+        lon = (x + offsets) / n * 360.0 - 180.0
+        lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + offsets) / n))))
+        lon_min, lat_min, lon_max, lat_max = self.bounds
+        size = self.field.shape[0] - 1
+        return (lon - lon_min) / (lon_max - lon_min) * size, (lat - lat_min) / (lat_max - lat_min) * size
+
+    def tile_version(self, z, x, y):
+        i, j = self._pixels(z, x, y)
+        size = self.field.shape[0]
+        i = np.clip(i[(i >= 0) & (i <= size - 1)], 0, size - 1)
+        j = np.clip(j[(j >= 0) & (j <= size - 1)], 0, size - 1)
+        if len(i) == 0 or len(j) == 0:
+            return -1
+        blocks = self.version[int(i.min()) // self.block:int(i.max()) // self.block + 1
+                              , int(j.min()) // self.block:int(j.max()) // self.block + 1]
+        return int(blocks.max())
+
+    def _render(self, z, x, y):
+        i, j = self._pixels(z, x, y)
+        size = self.field.shape[0]
+        # Bilinear sampling of the field; pixels outside it stay transparent
+        inside_i, inside_j = (i >= 0) & (i <= size - 1), (j >= 0) & (j <= size - 1)
+        i0 = np.clip(np.floor(i).astype(int), 0, size - 2)
+        j0 = np.clip(np.floor(j).astype(int), 0, size - 2)
+        fi, fj = (i - i0)[None, :], (j - j0)[:, None]
+        rows, cols = j0[:, None], i0[None, :]
+        value = (self.field[cols, rows] * (1 - fi) * (1 - fj) + self.field[cols + 1, rows] * fi * (1 - fj)
+                 + self.field[cols, rows + 1] * (1 - fi) * fj + self.field[cols + 1, rows + 1] * fi * fj)
+        value[~(inside_j[:, None] & inside_i[None, :])] = np.nan
+        scaled = np.clip((value - self.low) / (self.high - self.low), 0.0, 1.0)
+        rgba = self.lut[np.nan_to_num(scaled * (len(self.lut) - 1)).astype(int)]
+        rgba[np.isnan(value)] = 0
+        buffer = io.BytesIO()
+        Image.fromarray(rgba, "RGBA").save(buffer, "PNG")
+        return buffer.getvalue()
+
+    # PNG bytes and version of a tile, rendered only on a cache miss
+    def tile(self, z, x, y):
+        with self.lock:
+            version = self.tile_version(z, x, y)
+            key = (version, z, x, y)
+            if key in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(key)
+                return self.cache[key], version
+            self.misses += 1
+            png = self.cache[key] = self._render(z, x, y)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return png, version
+
+    # Tiles covering the field at zoom z with their bounds and current version, so clients can
+    # put the version in the tile URL and only refetch the tiles that changed
+    def tile_index(self, z):
+        with self.lock:
+            x_range, y_range = tile_range(z, self.bounds)
+            return [{"x": x, "y": y, "bounds": tile_bounds(z, x, y), "version": self.tile_version(z, x, y)}
+                    for x in x_range for y in y_range]
+
+    def stats(self):
+        return {"tick": self.tick, "cached_tiles": len(self.cache), "hits": self.hits, "misses": self.misses}
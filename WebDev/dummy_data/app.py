@@ -1,35 +1,123 @@
-from flask import Flask, Response
-import random
-import time
-import json
+from flask import Flask, Response, jsonify, request
+import argparse
+import numpy as np
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.broadcast import Broadcaster, FrameEncoder, add_backpressure_arguments
+from common.intake import IntakeBuffer, add_intake_arguments
+from common.loadgen import SyntheticField, add_generator_arguments
+from common.recording import Recorder, Replay, add_recording_arguments
+from common.registry import SensorRegistry
 
 app = Flask(__name__)
 
 # Define 50 fixed locations in Tamil Nadu, India
 # Tamil Nadu coordinates are approximately between (8.1°N, 76.9°E) and (13.8°N, 80.3°E)
-fixed_locations = [(random.uniform(8.1, 13.8), random.uniform(76.9, 80.3)) for _ in range(50)]
-
-def generate_random_data():
-    while True:
-        # Create a list of temperature data for all locations
-        temperature_data = [
-            {"lon": lon, "lat": lat
-            , "temperature": random.uniform(40, 70)
-            ,"uv":random.uniform(4,9)
-            ,"humidity":random.uniform(50,85)
-            ,"pressure":random.uniform(950,1020)
-            ,"airQuality":random.uniform(50,150)}
-            for lat, lon in fixed_locations
-        ]
-        # Convert the list to a JSON string
-        data = json.dumps(temperature_data)
-        # Yield the data as an SSE message
-        yield f"data: {data}\n\n"
-        time.sleep(1)  # Simulate a delay between updates
+fixed_locations = np.column_stack((np.random.uniform(8.1, 13.8, 50), np.random.uniform(76.9, 80.3, 50)))
+# Stable ids and static metadata for every location, served once from /sensors
+registry = SensorRegistry(fixed_locations)
+
+def random_readings(n):
+    # One column of readings per metric for all locations, in METRICS order
+    return np.column_stack((
+        np.random.uniform(40, 70, n)      # temperature
+        , np.random.uniform(4, 9, n)      # uv
+        , np.random.uniform(50, 85, n)    # humidity
+        , np.random.uniform(950, 1020, n) # pressure
+        , np.random.uniform(50, 150, n))) # airQuality
+
+def frame_encoder(key):
+    fmt, coords, keyframe_interval = key
+    return FrameEncoder(registry, fmt, coords, keyframe_interval)
+
+# One producer builds and serializes each tick once for all connected clients
+broadcaster = Broadcaster(lambda: random_readings(len(registry)), frame_encoder)
+
+def use_synthetic_field(sensors, rate=1.0, seed=None, target=broadcaster):
+    # Replace the 50 random locations with the vectorized, spatially correlated load generator
+    global registry
+    field = SyntheticField(sensors, seed)
+    registry = SensorRegistry(field.locations, source="synthetic")
+    target.produce = field.next
+    target.interval = 1.0 / rate
+
+def use_replay(path, speed=1.0, target=broadcaster):
+    # Stream a recorded capture through the same /data endpoint; the replay paces itself
+    global registry
+    replay = Replay(path, speed)
+    registry = SensorRegistry(replay.locations, source="replay")
+    target.produce = replay.next
+    target.interval = 0.0
+
+# Readings pushed by field nodes to /ingest, when the server runs with --intake
+intake = None
+
+def use_intake(rate=1.0, stale_after=60.0, target=broadcaster):
+    # Stream what nodes POST for the current registry's sensors instead of generated readings
+    global intake
+    intake = IntakeBuffer(len(registry), stale_after=stale_after)
+    target.produce = intake.next
+    target.interval = 1.0 / rate
+
+def record_to(path, target=broadcaster):
+    # Append every tick the producer emits to a capture file
+    locations = np.column_stack((registry.lat, registry.lon))
+    target.produce = Recorder(path, locations).wrap(target.produce)
+
+@app.route('/sensors')
+def sensors():
+    return jsonify(registry.to_records())
 
 @app.route('/data')
 def stream():
-    return Response(generate_random_data(), mimetype='text/event-stream')
+    # JSON stays the default so existing consumers keep working
+    fmt = "binary" if request.args.get("format") == "binary" else "json"
+    # Frames carry sensor ids only; ?coords=1 repeats lat/lon for consumers without a registry
+    coords = request.args.get("coords") == "1"
+    # ?mode=delta sends a keyframe every `keyframe` seconds and only changed sensors in between
+    keyframe_interval = None
+    if request.args.get("mode") == "delta":
+        keyframe_interval = request.args.get("keyframe", 10, type=float)
+    return Response(broadcaster.stream((fmt, coords, keyframe_interval)), mimetype='text/event-stream')
+
+@app.route('/ingest', methods=['POST'])
+def ingest():
+    # A batch of readings from one node, JSON or binary (see common/intake.py)
+    if intake is None:
+        return jsonify({"error": "This server generates its readings; start it with --intake."}), 409
+    try:
+        return jsonify(intake.submit(request.get_data()))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/ingest')
+def ingest_stats():
+    # Nodes seen, batches and readings accepted, and sensors currently reporting
+    if intake is None:
+        return jsonify({"error": "This server generates its readings; start it with --intake."}), 409
+    return jsonify(intake.stats())
+
+@app.route('/stats')
+def stats():
+    # Connected subscribers and how many frames each one has dropped
+    return jsonify(broadcaster.stats())
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Dummy SSE data server")
+    add_backpressure_arguments(parser)
+    add_generator_arguments(parser)
+    add_recording_arguments(parser)
+    add_intake_arguments(parser)
+    options = parser.parse_args()
+    broadcaster.configure(options.queue_size, options.policy, options.max_lag)
+    if options.replay:
+        use_replay(options.replay, options.speed)
+    elif options.sensors:
+        use_synthetic_field(options.sensors, options.rate, options.seed)
+    if options.intake:
+        use_intake(options.rate, options.stale_after)
+    if options.record:
+        record_to(options.record)
     app.run(debug=True, threaded=True)
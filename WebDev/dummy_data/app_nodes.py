@@ -1,36 +1,91 @@
 
-from flask import Flask, Response
-import random
-import time
-import json
+from flask import Flask, Response, jsonify, request
+import argparse
+import numpy as np
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.broadcast import Broadcaster, FrameEncoder, add_backpressure_arguments
+from common.intake import IntakeBuffer, add_intake_arguments
+from common.registry import SensorRegistry
 
 app = Flask(__name__)
 
 # Define 50 fixed locations in Tamil Nadu, India
 # Tamil Nadu coordinates are approximately between (8.1°N, 76.9°E) and (13.8°N, 80.3°E)
 fixed_locations = [((12.8416),(80.1565)),((12.8438),(80.1549))]
+# Stable ids and static metadata for the field nodes, served once from /sensors
+registry = SensorRegistry(fixed_locations, source="field")
+
+def random_readings(n):
+    # One column of readings per metric for all locations, in METRICS order
+    return np.column_stack((
+        np.random.uniform(80, 85, n)      # temperature
+        , np.random.uniform(1, 3, n)      # uv
+        , np.random.uniform(65, 75, n)    # humidity
+        , np.random.uniform(990, 1050, n) # pressure
+        , np.random.uniform(0, 10, n)))   # airQuality
+
+def frame_encoder(key):
+    fmt, coords, keyframe_interval = key
+    return FrameEncoder(registry, fmt, coords, keyframe_interval)
+
+# One producer builds and serializes each tick once for all connected clients
+broadcaster = Broadcaster(lambda: random_readings(len(registry)), frame_encoder)
+
+# Readings the two nodes push to /ingest, when the server runs with --intake
+intake = None
 
-def generate_random_data():
-    while True:
-        # Create a list of temperature data for all locations
-        temperature_data = [
-            {"lon": lon, "lat": lat
-            , "temperature": random.uniform(80, 85)
-            ,"uv":random.uniform(1,3)
-            ,"humidity":random.uniform(65,75)
-            ,"pressure":random.uniform(990,1050)
-            ,"airQuality":random.uniform(0,10)}
-            for lat, lon in fixed_locations
-        ]
-        # Convert the list to a JSON string
-        data = json.dumps(temperature_data)
-        # Yield the data as an SSE message
-        yield f"data: {data}\n\n"
-        time.sleep(1)  # Simulate a delay between updates
+def use_intake(stale_after=60.0):
+    global intake
+    intake = IntakeBuffer(len(registry), stale_after=stale_after)
+    broadcaster.produce = intake.next
+
+@app.route('/sensors')
+def sensors():
+    return jsonify(registry.to_records())
 
 @app.route('/data')
 def stream():
-    return Response(generate_random_data(), mimetype='text/event-stream')
+    # JSON stays the default so existing consumers keep working
+    fmt = "binary" if request.args.get("format") == "binary" else "json"
+    # Frames carry sensor ids only; ?coords=1 repeats lat/lon for consumers without a registry
+    coords = request.args.get("coords") == "1"
+    # ?mode=delta sends a keyframe every `keyframe` seconds and only changed sensors in between
+    keyframe_interval = None
+    if request.args.get("mode") == "delta":
+        keyframe_interval = request.args.get("keyframe", 10, type=float)
+    return Response(broadcaster.stream((fmt, coords, keyframe_interval)), mimetype='text/event-stream')
+
+@app.route('/ingest', methods=['POST'])
+def ingest():
+    # A batch of readings from one node, JSON or binary (see common/intake.py)
+    if intake is None:
+        return jsonify({"error": "This server generates its readings; start it with --intake."}), 409
+    try:
+        return jsonify(intake.submit(request.get_data()))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/ingest')
+def ingest_stats():
+    # Nodes seen, batches and readings accepted, and sensors currently reporting
+    if intake is None:
+        return jsonify({"error": "This server generates its readings; start it with --intake."}), 409
+    return jsonify(intake.stats())
+
+@app.route('/stats')
+def stats():
+    # Connected subscribers and how many frames each one has dropped
+    return jsonify(broadcaster.stats())
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Dummy SSE data server")
+    add_backpressure_arguments(parser)
+    add_intake_arguments(parser)
+    options = parser.parse_args()
+    broadcaster.configure(options.queue_size, options.policy, options.max_lag)
+    if options.intake:
+        use_intake(options.stale_after)
     app.run(debug=True, threaded=True)
@@ -0,0 +1,130 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+from urllib.parse import parse_qs
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.broadcast import AsyncBroadcaster, add_backpressure_arguments
+
+# Same sensors, readings and frame encoders as the Flask server in app.py
+import app as data_app
+from common.intake import add_intake_arguments
+from common.loadgen import add_generator_arguments
+from common.recording import add_recording_arguments
+
+# ASGI version of the data server. /data, /sensors, /ingest and /stats behave exactly like
+# app.py, but every SSE subscriber is a coroutine on one event loop instead of an OS thread, so
+# thousands of mostly idle dashboards, or nodes posting readings, cost a task each. Run it with:
+#   python async_app.py --port 5000
+# or under any ASGI server, e.g. `uvicorn async_app:app`.
+
+broadcaster = AsyncBroadcaster(lambda: data_app.random_readings(len(data_app.registry)), data_app.frame_encoder)
+
+
+async def send_json(send, body, status=200):
+    await send({"type": "http.response.start", "status": status
+                , "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": json.dumps(body).encode("utf-8")})
+
+
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return bytes(body)
+
+
+# Batches from field nodes. Submitting only decodes the batch and queues it for the next tick,
+# so it runs on the loop without holding up the streams.
+async def ingest(scope, receive, send):
+    if data_app.intake is None:
+        await send_json(send, {"error": "This server generates its readings; start it with --intake."}, status=409)
+    elif scope["method"] == "POST":
+        try:
+            await send_json(send, data_app.intake.submit(await read_body(receive)))
+        except ValueError as e:
+            await send_json(send, {"error": str(e)}, status=400)
+    else:
+        await send_json(send, data_app.intake.stats())
+
+
+async def wait_for_disconnect(receive, task):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+    task.cancel()
+
+
+async def stream(args, receive, send):
+    # JSON stays the default so existing consumers keep working
+    fmt = "binary" if args.get("format") == "binary" else "json"
+    # Frames carry sensor ids only; ?coords=1 repeats lat/lon for consumers without a registry
+    coords = args.get("coords") == "1"
+    # ?mode=delta sends a keyframe every `keyframe` seconds and only changed sensors in between
+    keyframe_interval = None
+    if args.get("mode") == "delta":
+        keyframe_interval = float(args.get("keyframe", 10))
+
+    await send({"type": "http.response.start", "status": 200, "headers": [
+        (b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")]})
+    # Stop streaming as soon as the client goes away rather than at the next tick
+    watcher = asyncio.create_task(wait_for_disconnect(receive, asyncio.current_task()))
+    try:
+        async for message in broadcaster.stream((fmt, coords, keyframe_interval)):
+            # The server applies flow control per connection, so a slow client only ever
+            # waits here on its own coroutine while its queue drops frames
+            await send({"type": "http.response.body", "body": message, "more_body": True})
+    except asyncio.CancelledError:
+        pass
+    finally:
+        watcher.cancel()
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+    args = {key: values[-1] for key, values in parse_qs(scope["query_string"].decode("latin-1")).items()}
+    if scope["path"] == "/data":
+        await stream(args, receive, send)
+    elif scope["path"] == "/ingest":
+        await ingest(scope, receive, send)
+    elif scope["path"] == "/sensors":
+        await send_json(send, data_app.registry.to_records())
+    elif scope["path"] == "/stats":
+        await send_json(send, broadcaster.stats())
+    else:
+        await send_json(send, {"error": "not found"}, status=404)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Asyncio SSE data server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    add_backpressure_arguments(parser)
+    add_generator_arguments(parser)
+    add_recording_arguments(parser)
+    add_intake_arguments(parser)
+    options = parser.parse_args()
+    broadcaster.configure(options.queue_size, options.policy, options.max_lag)
+    if options.replay:
+        data_app.use_replay(options.replay, options.speed, target=broadcaster)
+    elif options.sensors:
+        data_app.use_synthetic_field(options.sensors, options.rate, options.seed, target=broadcaster)
+    if options.intake:
+        data_app.use_intake(options.rate, options.stale_after, target=broadcaster)
+    if options.record:
+        data_app.record_to(options.record, target=broadcaster)
+    uvicorn.run(app, host=options.host, port=options.port, log_level="warning")
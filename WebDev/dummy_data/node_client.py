@@ -0,0 +1,87 @@
+import argparse
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import requests
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.frames import METRICS
+from common.intake import encode_batch, encode_json_batch
+from common.loadgen import BASELINE, SPREAD
+
+# Simulated field nodes for a server started with --intake. The registry's sensors are split
+# between `--nodes` threads; each one POSTs a batch with all of its sensors' readings
+# `--rate` times per second over a pooled keep-alive session, numbering its batches so the
+# server can drop retries. A failed post is retried with the same sequence number. Prints
+# the posts and readings per second achieved, and the server's /ingest counters at the end.
+class Node(threading.Thread):
+    def __init__(self, url, name, ids, rate, fmt, deadline, seed):
+        super().__init__(daemon=True)
+        self.url = url
+        self.node = name
+        self.ids = np.asarray(ids, dtype=np.float32)
+        self.rate = rate
+        self.encode = encode_batch if fmt == "binary" else encode_json_batch
+        self.deadline = deadline
+        self.rng = np.random.default_rng(seed)
+        self.session = requests.Session()
+        self.posts = self.readings = self.errors = 0
+
+    def run(self):
+        # Sequence 0 tells the server this node starts over
+        sequence = 0
+        next_post = time.monotonic()
+        while time.monotonic() < self.deadline:
+            noise = self.rng.standard_normal((len(METRICS), len(self.ids)), dtype=np.float32)
+            columns = {"id": self.ids}
+            for i, metric in enumerate(METRICS):
+                columns[metric] = BASELINE[i] + SPREAD[i] * 0.3 * noise[i]
+            body = self.encode(self.node, sequence, columns)
+            while time.monotonic() < self.deadline:
+                try:
+                    response = self.session.post(self.url, data=body, timeout=5)
+                    response.raise_for_status()
+                    break
+                except requests.exceptions.RequestException:
+                    self.errors += 1
+                    time.sleep(0.5)
+            else:
+                break
+            self.posts += 1
+            self.readings += len(self.ids)
+            sequence += 1
+            next_post += 1.0 / self.rate
+            time.sleep(max(0.0, next_post - time.monotonic()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Push simulated sensor readings to a server's /ingest")
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--nodes", type=int, default=8, help="concurrent nodes, each with its own session")
+    parser.add_argument("--rate", type=float, default=10.0, help="posts per second per node")
+    parser.add_argument("--format", choices=["json", "binary"], default="binary")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to run")
+    args = parser.parse_args()
+
+    ids = [sensor["id"] for sensor in requests.get(f"{args.url}/sensors", timeout=10).json()]
+    deadline = time.monotonic() + args.duration
+    nodes = [Node(f"{args.url}/ingest", f"node-{i}", chunk, args.rate, args.format, deadline, i)
+             for i, chunk in enumerate(np.array_split(ids, args.nodes)) if len(chunk)]
+    start = time.monotonic()
+    for node in nodes:
+        node.start()
+    for node in nodes:
+        node.join()
+    elapsed = time.monotonic() - start
+    posts = sum(node.posts for node in nodes)
+    readings = sum(node.readings for node in nodes)
+    errors = sum(node.errors for node in nodes)
+    print(f"{len(nodes)} nodes: {posts / elapsed:.0f} posts/s, {readings / elapsed:.0f} readings/s, {errors} failed posts")
+    print(requests.get(f"{args.url}/ingest", timeout=10).json())
+
+
+if __name__ == "__main__":
+    main()
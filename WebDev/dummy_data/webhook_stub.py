@@ -0,0 +1,43 @@
+from flask import Flask, jsonify, request
+import argparse
+import random
+import time
+
+app = Flask(__name__)
+
+# Stand-in for a real alert receiver (chat webhook, paging service, ...): prints every batch it
+# receives and keeps the last ones for GET /alerts. --fail-rate answers that share of requests
+# with a 503 to exercise the notifier's retries.
+received = []
+options = argparse.Namespace(fail_rate=0.0, keep=1000)
+
+@app.route('/alerts', methods=['POST'])
+def receive():
+    if random.random() < options.fail_rate:
+        return jsonify({"error": "simulated outage"}), 503
+    batch = request.get_json(force=True)
+    alerts = batch.get("alerts", [])
+    delay = time.time() - batch.get("sent_at", time.time())
+    print(f"{len(alerts)} alerts (sent {delay:.2f}s ago)")
+    for alert in alerts:
+        detail = ""
+        if "metric" in alert:
+            # A reading that was NaN (no value) arrives as null
+            value = alert.get("value")
+            detail = f" {alert['metric']}={'n/a' if value is None else f'{value:.2f}'}"
+        print(f"  sensor {alert['sensor']}: {alert['previous']} -> {alert['severity']}{detail}")
+    received.extend(alerts)
+    del received[:-options.keep]
+    return jsonify({"received": len(alerts)})
+
+@app.route('/alerts')
+def recent():
+    return jsonify(received)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local alert webhook receiver")
+    parser.add_argument("--port", type=int, default=5002)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--keep", type=int, default=1000, help="alerts kept for GET /alerts")
+    options = parser.parse_args()
+    app.run(port=options.port, threaded=True)
@@ -1,13 +1,29 @@
 import streamlit as st
-import requests
 import pandas as pd
-import json
-import time
 import pydeck as pdk
+import requests
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.ingest import IngestWorker
+from common.render import DeckRenderer
 
 st.title("Real-time Temperature Heatmap")
 
-url = "http://127.0.0.1:5000/data"  # URL of the Flask server
+url = "http://127.0.0.1:5000/data?format=binary&mode=delta"  # URL of the Flask server
+sensors_url = "http://127.0.0.1:5000/sensors"
+tiles_url = "http://127.0.0.1:5001/tiles"  # heat_map/tile_server.py
+
+# Above this many sensors the heatmap is fed per-cell sums for the current zoom instead of
+# every sensor, so the payload is bounded by the screen
+MAX_RAW_POINTS = 5000
+
+@st.cache_resource
+def get_ingest():
+    worker = IngestWorker(url, sensors_url)
+    worker.start()
+    return worker
 
 # Initialize an empty DataFrame to store all location data
 map_data = pd.DataFrame(columns=['lat', 'lon', 'temperature'])
@@ -16,22 +32,37 @@ map_data = pd.DataFrame(columns=['lat', 'lon', 'temperature'])
 initial_view = pdk.ViewState(latitude=11.0, longitude=78.0, zoom=6)
 
 # HeatmapLayer
-def get_heatmap_layer(data):
+def get_heatmap_layer(data, weight='temperature'):
     return pdk.Layer(
         "HeatmapLayer",
+        id=f'heatmap-{weight}',
         data=data,
         get_position='[lon, lat]',  # Specify the latitude and longitude
-        get_weight='temperature',  # The weight is based on temperature
+        get_weight=weight,  # The weight is based on temperature
         aggregation=pdk.types.String("sum"),
         radius_pixels=50,  # Adjust the radius for heatmap visualization
         intensity=1,  # Adjust intensity based on data
     )
 
-# Continuously fetch data and update map
-response = requests.get(url, stream=True)
-
-# Initial heatmap layer
+# Server-rendered tiles: one BitmapLayer per tile, with the tile's version in its URL so the
+# browser only downloads the tiles whose part of the field changed
+def get_tile_layers(zoom):
+    index = requests.get(f"{tiles_url}/{zoom}", timeout=5).json()
+    return [
+        pdk.Layer(
+            "BitmapLayer",
+            id=f"tile-{zoom}-{tile['x']}-{tile['y']}",
+            image=f"{tiles_url}/{zoom}/{tile['x']}/{tile['y']}.png?v={tile['version']}",
+            bounds=tile['bounds'],
+        )
+        for tile in index
+    ]
+
+view_option = st.radio("Rendering", ("Heatmap Layer", "Server Tiles"))
+
+# Heatmap layers over every sensor and over per-cell sums; the renderer fills in the data
 heatmap_layer = get_heatmap_layer(map_data)
+binned_heatmap_layer = get_heatmap_layer(map_data, weight='temperature_sum')
 
 # Deck to display the heatmap
 deck = pdk.Deck(
@@ -43,39 +74,39 @@ deck = pdk.Deck(
 
 # Display the initial empty heatmap
 map_chart = st.pydeck_chart(deck)
-
-# Continuously fetch and update data
-for line in response.iter_lines():
-    if line:
+# Re-sends the map only when the heatmap data or the tile versions changed
+renderer = DeckRenderer(map_chart, initial_view, 'mapbox://styles/mapbox/dark-v10')
+tooltip = {"text": "{temperature}°F at [{lat}, {lon}]"}
+
+# Continuously render the latest snapshot published by the shared ingest worker
+ingest = get_ingest()
+tick = -1
+while True:
+    snapshot = ingest.wait_for_update(tick, timeout=5)
+    if snapshot is None:
+        if ingest.error is not None:
+            st.error(f"An unexpected error occurred: {ingest.error}")
+        continue
+    tick = snapshot.tick
+
+    # The tile server renders the field itself; only the tile URLs change here
+    if view_option == "Server Tiles":
         try:
-            # Decode the line and process it if it starts with "data:"
-            decoded_line = line.decode('utf-8').strip()
-            if decoded_line.startswith("data:"):
-                json_data = decoded_line[5:]  # Strip off "data:" prefix
-                data = json.loads(json_data)
-
-                # Check if data is correctly formatted
-                if isinstance(data, list) and all(isinstance(item, dict) for item in data):
-                    # Convert received data into a DataFrame
-                    new_data = pd.DataFrame(data)
-
-                    # Replace old data with new data in map_data
-                    map_data = new_data
-
-                    # Update the heatmap layer with the new data
-                    heatmap_layer.data = map_data
-
-                    # Recreate the deck to reflect the updated data
-                    deck.layers = [heatmap_layer]
-
-                    # Update the map in real-time
-                    map_chart.pydeck_chart(deck)
-                else:
-                    st.error("Data format is incorrect.")
-        except json.JSONDecodeError:
-            st.error("Failed to decode JSON. Skipping this data point.")
-        except Exception as e:
-            st.error(f"An unexpected error occurred: {e}")
-
-    # Optional: Add a small delay to control update rate
-    time.sleep(1)
+            tile_layers = get_tile_layers(int(initial_view.zoom))
+        except requests.exceptions.RequestException as e:
+            st.error(f"Tile server unavailable: {e}")
+            continue
+        renderer.render([(layer, None) for layer in tile_layers], tooltip)
+        continue
+
+    # Replace old data with new data in map_data. Summing the per-cell temperature sums gives
+    # the same heatmap as summing every sensor's temperature.
+    if len(snapshot.data) > MAX_RAW_POINTS:
+        map_data, _ = ingest.binned(initial_view.zoom, initial_view.latitude, initial_view.longitude)
+        layer = binned_heatmap_layer
+    else:
+        map_data = snapshot.data
+        layer = heatmap_layer
+
+    # Update the map in real-time
+    renderer.render([(layer, map_data)], tooltip)
@@ -1,6 +1,10 @@
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.interpolate import griddata
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.interpolate import get_interpolator, make_grid
 
 # Step 1: Generate random temperature data
 # Replace this with your real data
@@ -10,8 +14,8 @@ lons = np.random.uniform(low=76.9, high=80.3, size=num_points)  # Longitude rang
 temps = np.random.uniform(low=40, high=70, size=num_points)  # Temperature range in °F
 
 # Step 2: Create grid data
-grid_x, grid_y = np.mgrid[min(lons):max(lons):100j, min(lats):max(lats):100j]
-grid_z = griddata((lons, lats), temps, (grid_x, grid_y), method='cubic')
+grid_x, grid_y = make_grid(lons, lats, 100)
+grid_z = get_interpolator(np.column_stack((lons, lats)), grid_x, grid_y, method='cubic')(temps)
 
 # Step 3: Plot the heatmap with contour lines
 plt.figure(figsize=(8, 6))
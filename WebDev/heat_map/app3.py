@@ -1,40 +1,59 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import streamlit as st
-from scipy.interpolate import griddata
-import requests
-import pandas as pd
-import json
-
-# Step 1: Fetch the temperature data from the Flask server
-sse_url = "http://127.0.0.1:5000/data"  # Change this to your Flask server URL
-
-def get_temperature_data():
-    response = requests.get(sse_url, stream=True)
-    for line in response.iter_lines():
-        if line:
-            decoded_line = line.decode('utf-8')
-            if decoded_line.startswith('data:'):
-                # Parse the JSON data from SSE
-                data = json.loads(decoded_line[5:])
-                return pd.DataFrame(data)  # Convert JSON to pandas DataFrame
-
-# Step 2: Get the data from the Flask server
-data = get_temperature_data()
-
-# Check if data is fetched
-if data is not None and not data.empty:
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.geo import geojson_bounds, load_geojson
+from common.ingest import IngestWorker
+from common.interpolate import get_interpolator, make_grid
+
+# Step 1: Stream the temperature data from the Flask server
+url = "http://127.0.0.1:5000/data?format=binary&mode=delta"  # Change this to your Flask server URL
+sensors_url = "http://127.0.0.1:5000/sensors"
+
+@st.cache_resource
+def get_ingest():
+    worker = IngestWorker(url, sensors_url)
+    worker.start()
+    return worker
+
+# Sensors never move, so the triangulation and its weights are built once per layout and
+# grid; every tick after that is only a few sparse products
+resolution = st.sidebar.slider("Grid resolution", min_value=100, max_value=500, value=300, step=50)
+method = st.sidebar.radio("Interpolation", ["cubic", "linear", "idw"])
+# Triangulation only covers the convex hull of the sensors; IDW fills the whole state
+lon_min, lat_min, lon_max, lat_max = geojson_bounds(load_geojson())
+
+ingest = get_ingest()
+plot = st.empty()
+tick = -1
+while True:
+    # Step 2: Wait for the next tick
+    snapshot = ingest.wait_for_update(tick, timeout=5)
+    if snapshot is None:
+        if ingest.error is not None:
+            plot.error(f"No data available from the server: {ingest.error}")
+        continue
+    tick = snapshot.tick
+    data = snapshot.data
+
     # Extract latitude, longitude, and temperature from the data
     lats = data['lat'].values
     lons = data['lon'].values
     temps = data['temperature'].values
 
-    # Step 3: Create grid data for contour plot
-    grid_x, grid_y = np.mgrid[min(lons):max(lons):100j, min(lats):max(lats):100j]
-    grid_z = griddata((lons, lats), temps, (grid_x, grid_y), method='cubic')
+    # Step 3: Interpolate onto the grid with the cached weights
+    if method == "idw":
+        grid_x, grid_y = make_grid([lon_min, lon_max], [lat_min, lat_max], resolution)
+    else:
+        grid_x, grid_y = make_grid(lons, lats, resolution)
+    interpolator = get_interpolator(np.column_stack((lons, lats)), grid_x, grid_y, method)
+    grid_z = interpolator(temps)
 
     # Step 4: Plot the heatmap with contour lines
-    plt.figure(figsize=(8, 6))
+    fig = plt.figure(figsize=(8, 6))
 
     # Heatmap (with gradient)
     heatmap = plt.contourf(grid_x, grid_y, grid_z, levels=100, cmap='coolwarm')  # Adjust cmap as needed
@@ -53,8 +72,6 @@ if data is not None and not data.empty:
     plt.xlabel("Longitude")
     plt.ylabel("Latitude")
 
-    # Step 5: Display the plot in Streamlit
-    st.pyplot(plt)
-
-else:
-    st.error("No data available from the server.")
+    # Step 5: Display the plot in Streamlit, replacing the previous tick
+    plot.pyplot(fig)
+    plt.close(fig)
@@ -0,0 +1,58 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from scipy.interpolate import griddata
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.geo import geojson_bounds, load_geojson
+from common.interpolate import IDWInterpolator, TriangulationInterpolator, make_grid
+from common.loadgen import SyntheticField
+
+# Compares the uncached griddata path of the contour maps with the cached interpolators, on
+# synthetic sensors over the Tamil Nadu extent. Prints the one-off build time, the cost of one
+# tick, and how much of the grid gets a value (griddata leaves everything outside the convex
+# hull of the sensors as NaN).
+def timed(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the heat map interpolation paths")
+    parser.add_argument("--sensors", type=int, nargs="+", default=[50, 2000, 20000])
+    parser.add_argument("--resolution", type=int, nargs="+", default=[100, 500, 2000])
+    parser.add_argument("--repeat", type=int, default=3, help="ticks to average over")
+    args = parser.parse_args()
+
+    lon_min, lat_min, lon_max, lat_max = geojson_bounds(load_geojson())
+    print(f"{'sensors':>8} {'grid':>10} {'method':<14} {'build s':>9} {'tick s':>9} {'filled':>7}")
+    for n_sensors in args.sensors:
+        field = SyntheticField(n_sensors, seed=0)
+        lats, lons = field.locations[:, 0], field.locations[:, 1]
+        points = np.column_stack((lons, lats))
+        temps = field.next()[:, 0].astype(float)
+        for resolution in args.resolution:
+            grid_x, grid_y = make_grid([lon_min, lon_max], [lat_min, lat_max], resolution)
+            rows = []
+            for method in ["linear", "cubic"]:
+                tick, grid = timed(lambda: griddata((lons, lats), temps, (grid_x, grid_y), method=method), args.repeat)
+                rows.append((f"griddata {method}", 0.0, tick, grid))
+            for method in ["linear", "cubic"]:
+                build, interpolator = timed(lambda: TriangulationInterpolator(points, grid_x, grid_y, method), 1)
+                tick, grid = timed(lambda: interpolator(temps), args.repeat)
+                rows.append((f"cached {method}", build, tick, grid))
+            build, interpolator = timed(lambda: IDWInterpolator(points, grid_x, grid_y), 1)
+            tick, grid = timed(lambda: interpolator(temps), args.repeat)
+            rows.append(("idw k=8", build, tick, grid))
+            for name, build, tick, grid in rows:
+                filled = np.count_nonzero(~np.isnan(grid)) / grid.size
+                print(f"{n_sensors:>8} {f'{resolution}x{resolution}':>10} {name:<14} {build:>9.3f} {tick:>9.4f} {filled:>7.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+from flask import Flask, Response, jsonify, request
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.geo import geojson_bounds, load_geojson
+from common.ingest import IngestWorker
+from common.loadgen import BASELINE, SPREAD
+from common.frames import METRICS
+from common.tiles import HeatmapTiles
+
+app = Flask(__name__)
+
+# Filled in from the command line in __main__
+ingest = None
+tiles = None
+
+def current_tiles():
+    # The field is only re-interpolated when a new snapshot arrived since the last request
+    tiles.refresh(ingest.latest())
+    return tiles
+
+@app.route('/tiles/<int:z>/<int:x>/<int:y>.png')
+def tile(z, x, y):
+    png, version = current_tiles().tile(z, x, y)
+    response = Response(png, mimetype='image/png')
+    # URLs carrying ?v=<version> never change content; bare URLs are revalidated by ETag
+    if request.args.get('v') is not None:
+        response.headers['Cache-Control'] = 'public, max-age=86400, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    response.set_etag(str(version))
+    return response.make_conditional(request)
+
+@app.route('/tiles/<int:z>')
+def tile_index(z):
+    # Tiles covering the state at this zoom, with bounds and current version
+    return jsonify(current_tiles().tile_index(z))
+
+@app.route('/tiles/stats')
+def stats():
+    return jsonify(tiles.stats())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Heatmap tile server")
+    parser.add_argument("--upstream", default="http://127.0.0.1:5000", help="data server to subscribe to")
+    parser.add_argument("--metric", default="temperature", choices=METRICS)
+    parser.add_argument("--method", default="cubic", choices=["linear", "cubic", "idw"]
+                        , help="interpolation of the field (cubic/linear leave the area outside the sensors empty)")
+    parser.add_argument("--resolution", type=int, default=512, help="field grid size")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="change that invalidates a tile")
+    parser.add_argument("--cache-size", type=int, default=2048, help="rendered tiles kept in memory")
+    parser.add_argument("--port", type=int, default=5001)
+    options = parser.parse_args()
+
+    ingest = IngestWorker(f"{options.upstream}/data?format=binary&mode=delta", f"{options.upstream}/sensors")
+    ingest.start()
+    # Colour scale spans the usual range of the metric
+    metric = METRICS.index(options.metric)
+    value_range = (float(BASELINE[metric] - SPREAD[metric]), float(BASELINE[metric] + SPREAD[metric]))
+    tiles = HeatmapTiles(geojson_bounds(load_geojson()), options.metric, value_range, options.method
+                         , options.resolution, tolerance=options.tolerance, cache_size=options.cache_size)
+    app.run(port=options.port, threaded=True)
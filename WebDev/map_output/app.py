@@ -1,36 +1,51 @@
 import streamlit as st
-import requests
 import pandas as pd
-import json
-import time
 import pydeck as pdk
+import datetime
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.colors import PALETTES, BinnedPalette, add_color_columns
+from common.frames import METRICS
+from common.ingest import IngestWorker
+from common.render import DeckRenderer
+from common.store import SensorStore
 
 st.title("Real-time Temperature Map")
 
-url = "http://127.0.0.1:5000/data"  # URL of the Flask server
+url = "http://127.0.0.1:5000/data?format=binary&mode=delta"  # URL of the Flask server
+sensors_url = "http://127.0.0.1:5000/sensors"  # Static sensor metadata
+# History store written by `python -m common.store --path history` (from WebDev), for playback
+store_path = os.environ.get("SENSOR_STORE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "history"))
+
+# One ingest worker per process: it holds the only upstream connection, decodes each frame
+# once and survives reruns, so every session just reads the latest snapshot
+@st.cache_resource
+def get_ingest():
+    worker = IngestWorker(url, sensors_url)
+    worker.start()
+    return worker
 
 # Initialize an empty DataFrame to store all location data
-map_data = pd.DataFrame(columns=['lat', 'lon', 'temperature', 'color'])
+map_data = pd.DataFrame(columns=['lat', 'lon', 'temperature', 'r', 'g', 'b', 'a'])
 
-# Define color scale based on temperature
-def get_color(temperature):
-    if temperature < 50:
-        return [0, 0, 255]  # Blue for cooler temperatures
-    elif temperature < 60:
-        return [0, 255, 0]  # Green for moderate temperatures
-    else:
-        return [255, 0, 0]  # Red for warmer temperatures
+# Define color scale based on temperature (blue below 50, green below 60, red above), plus
+# the default palettes of common/colors.py for the other metrics
+palettes = dict(PALETTES, temperature=BinnedPalette([50, 60], [[0, 0, 255], [0, 255, 0], [255, 0, 0]]))
+color_metric = st.selectbox("Colour by", METRICS)
+source = st.radio("Source", ("Live", "Playback"))
 
 # Initialize the map configuration with a zoomed-out view
 initial_view = pdk.ViewState(latitude=11.0, longitude=78.0, zoom=6)  # Set initial zoom level
 
-# Continuously fetch data and update map
-response = requests.get(url, stream=True)
 scatterplot_layer = pdk.Layer(
     "ScatterplotLayer",
+    id='scatter',
     data=map_data,
     get_position='[lon, lat]',
-    get_fill_color='color',
+    get_fill_color='[r, g, b, a]',
     get_radius=5000,  # Adjusted radius for visibility
     pickable=True,  # Allows for tooltips
 )
@@ -41,40 +56,50 @@ deck = pdk.Deck(
     tooltip={"text": "{temperature}°F at [{lat}, {lon}]"},
 )
 map_chart=st.pydeck_chart(deck)
-for line in response.iter_lines():
-    if line:
-        try:
-            # Decode the line and process it if it starts with "data:"
-            decoded_line = line.decode('utf-8').strip()
-            if decoded_line.startswith("data:"):
-                json_data = decoded_line[5:]  # Strip off "data:" prefix
-                data = json.loads(json_data)
+# Re-sends the map only when the positions, colours or temperatures shown changed
+renderer = DeckRenderer(map_chart, initial_view, 'mapbox://styles/mapbox/dark-v10')
+tooltip = {"text": "{temperature}°F at [{lat}, {lon}]"}
 
-                # Check if data is correctly formatted
-                if isinstance(data, list) and all(isinstance(item, dict) for item in data):
-                    # Convert received data into a DataFrame
-                    new_data = pd.DataFrame(data)
-                    new_data['color'] = new_data['temperature'].apply(get_color)
+# Replay the stored history from a chosen time; each step only reads the rows recorded since
+# the previous one
+if source == "Playback":
+    store = SensorStore(store_path) if os.path.exists(os.path.join(store_path, "locations.npy")) else None
+    time_range = store.time_range() if store is not None else None
+    if time_range is None:
+        st.info(f"No recorded history in {os.path.normpath(store_path)} yet.")
+        st.stop()
+    first, last = (datetime.datetime.fromtimestamp(t) for t in time_range)
+    start = st.slider("Start", min_value=first, max_value=last, value=first, step=datetime.timedelta(seconds=1), format="YYYY-MM-DD HH:mm:ss")
+    speed = st.select_slider("Speed", options=[1, 2, 5, 10, 30, 60], value=1)
+    playback_time = st.empty()
+    for timestamp, frame in store.playback(start.timestamp(), time_range[1], step=1.0):
+        add_color_columns(frame, color_metric, palettes)
+        renderer.render([(scatterplot_layer, frame)], tooltip)
+        playback_time.caption(f"Playback at {datetime.datetime.fromtimestamp(timestamp):%Y-%m-%d %H:%M:%S}")
+        time.sleep(1.0 / speed)
+    st.stop()
 
-                    # Replace old data with new data in map_data
-                    map_data = new_data  # Overwrite map_data with new_data
+# Continuously fetch data and update map
+ingest = get_ingest()
+connection_status = st.empty()
+tick = -1
+while True:
+    snapshot = ingest.wait_for_update(tick, timeout=5)
+    if snapshot is None:
+        if ingest.error is not None:
+            connection_status.error(f"Failed to connect to the server: {ingest.error}")
+        continue
+    connection_status.empty()
+    tick = snapshot.tick
+    try:
+        # Snapshots are shared between sessions, so only add columns to a shallow copy
+        new_data = snapshot.data.copy(deep=False)
+        add_color_columns(new_data, color_metric, palettes)
 
-                    # Update the scatterplot layer with the new data
-                    scatterplot_layer.data=map_data
-                    # Update the map chart with the modified layer
-                    deck = pdk.Deck(
-                        initial_view_state=initial_view,
-                        layers=[scatterplot_layer],
-                        map_style='mapbox://styles/mapbox/dark-v10',
-                        tooltip={"text": "{temperature}°F at [{lat}, {lon}]"},
-                    )
-                    map_chart.pydeck_chart(deck)
-                else:
-                    st.error("Data format is incorrect.")
-        except json.JSONDecodeError:
-            st.error("Failed to decode JSON. Skipping this data point.")
-        except Exception as e:
-            st.error(f"An unexpected error occurred: {e}")
+        # Replace old data with new data in map_data
+        map_data = new_data  # Overwrite map_data with new_data
 
-    # Optional: Add a small delay to control update rate
-    time.sleep(1)
+        # Update the map chart with the new data
+        renderer.render([(scatterplot_layer, map_data)], tooltip)
+    except Exception as e:
+        st.error(f"An unexpected error occurred: {e}")
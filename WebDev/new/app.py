@@ -5,7 +5,7 @@ import requests
 import json
 
 # SSE URL
-sse_url ="http://127.0.0.1:5000/data"  # Replace with your Flask server's URL
+sse_url ="http://127.0.0.1:5000/data?coords=1"  # Replace with your Flask server's URL
 
 # Function to fetch data from the SSE stream
 def get_temperature_data():
@@ -1,22 +1,28 @@
 import streamlit as st
 import pydeck as pdk
-import json
-
-# Load the GeoJSON data for Tamil Nadu
-# Replace 'tamil_nadu.geojson' with the path to your actual GeoJSON file
-with open("D:\Downloads\TamilNadu.geojson") as f:
-    geojson_data = json.load(f)
-
-# Define the GeoJsonLayer to shade Tamil Nadu
-geojson_layer = pdk.Layer(
-    "GeoJsonLayer",
-    geojson_data,
-    stroked=False,  # Do not outline the region (if you prefer)
-    filled=True,  # Fill the state region
-    get_fill_color=[0, 128, 255, 180],  # Specify the color in RGBA (this will fill with blue)
-    get_line_color=[255, 255, 255],  # Line color (optional) to outline the border
-    line_width_min_pixels=1,
-)
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.choropleth import choropleth_geojson, district_summary
+from common.ingest import IngestWorker
+from common.rules import CRITICAL, ThresholdRules
+from common.simplify import geometry_for_zoom
+
+# Flask server URL
+url = "http://127.0.0.1:5000/data?format=binary&mode=delta"
+sensors_url = "http://127.0.0.1:5000/sensors"
+
+# A sensor counts as critical with the same rules as the main dashboard (Frontend/thresholds.json)
+@st.cache_resource
+def get_rules():
+    return ThresholdRules.load(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Frontend", "thresholds.json"))
+
+@st.cache_resource
+def get_ingest():
+    worker = IngestWorker(url, sensors_url)
+    worker.start()
+    return worker
 
 # Set the initial view state (centered around Tamil Nadu)
 view_state = pdk.ViewState(
@@ -26,9 +32,39 @@ view_state = pdk.ViewState(
     pitch=0  # Top-down view
 )
 
-# Render the map with the GeoJson layer to color Tamil Nadu
-st.pydeck_chart(pdk.Deck(
-    layers=[geojson_layer],
-    initial_view_state=view_state,
-    map_style='mapbox://styles/mapbox/light-v9',  # Choose a suitable Mapbox style
-))
+# District boundaries for Tamil Nadu, simplified for the zoom level of the view
+geojson_data = geometry_for_zoom(view_state.zoom)
+
+map_chart = st.empty()
+ingest = get_ingest()
+tick = -1
+while True:
+    snapshot = ingest.wait_for_update(tick, timeout=5)
+    if snapshot is None:
+        if ingest.error is not None:
+            map_chart.error(f"Failed to connect to the server: {ingest.error}")
+        continue
+    tick = snapshot.tick
+    data = snapshot.data
+
+    # Shade every district by the mean temperature of its sensors
+    severity, _ = get_rules().classify(data)
+    summary = district_summary(data, 'temperature', severity == CRITICAL)
+    geojson_layer = pdk.Layer(
+        "GeoJsonLayer",
+        choropleth_geojson(geojson_data, summary),
+        stroked=True,
+        filled=True,
+        get_fill_color='properties.fill',
+        get_line_color=[255, 255, 255],  # Line color to outline the districts
+        line_width_min_pixels=1,
+        pickable=True,
+    )
+
+    # Render the map with the GeoJson layer to color Tamil Nadu
+    map_chart.pydeck_chart(pdk.Deck(
+        layers=[geojson_layer],
+        initial_view_state=view_state,
+        map_style='mapbox://styles/mapbox/light-v9',  # Choose a suitable Mapbox style
+        tooltip={"text": "{NAME_2}\nMean Temp: {mean}°F\nMax Temp: {max}°F\nCritical: {critical}/{sensors}"},
+    ))
@@ -1,9 +1,19 @@
 import streamlit as st
-import requests
-import pandas as pd
-import json
 import pydeck as pdk
-import time
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.alerts import AlertTracker, WebhookNotifier
+from common.anomaly import describe_anomalies, flagged_rows
+from common.choropleth import choropleth_geojson, district_summary
+from common.colors import add_color_columns
+from common.frames import METRICS
+from common.ingest import IngestWorker
+from common.render import DeckRenderer
+from common.rules import CRITICAL, ThresholdRules
+from common.shm import SharedStateReader
+from common.simplify import geometry_for_zoom
 
 # Set page config
 st.set_page_config(page_title="Real-time Environmental Monitoring", layout="wide")
@@ -43,200 +53,229 @@ st.markdown("""
         background-color: #c6f6d5;
         color: #2f855a;
     }
+    .status-anomaly {
+        background-color: #e9d8fd;
+        color: #553c9a;
+    }
 </style>
 """, unsafe_allow_html=True)
 
-# Define thresholds for parameters
-TEMP_CRITICAL, TEMP_WARNING = 1000, 1000
-UV_CRITICAL, UV_WARNING = 600, 400
-HUMIDITY_CRITICAL, HUMIDITY_WARNING = 9000, 7000
-PRESSURE_CRITICAL, PRESSURE_WARNING = 120000, 110000
-AIR_QUALITY_CRITICAL, AIR_QUALITY_WARNING = 2000, 1500
-
-# Function to assign colors based on temperature
-def get_temperature_color(temp):
-    if temp < 50:
-        return [173, 216, 230]  # Light Blue for cool
-    elif temp < 60:
-        return [144, 238, 144]  # Light Green for moderate
-    return [255, 182, 193]  # Light Pink for hot
+# Define thresholds for parameters (warning/critical per metric, in thresholds.json next to this file)
+@st.cache_resource
+def get_rules():
+    return ThresholdRules.load(os.path.join(os.path.dirname(os.path.abspath(__file__)), "thresholds.json"))
+
+# The cards show how far each average moved over this many ticks (the ingest worker keeps
+# the last 300)
+TREND_WINDOW = 60
+
+# Every section below is a fragment that reruns on its own every REFRESH_SECONDS, or when one
+# of its own widgets changes, reading the latest snapshot of the shared ingest worker. The
+# script itself only runs once per page load, so switching views never re-injects the CSS,
+# reloads the geometry or restarts the stream.
+REFRESH_SECONDS = 1
 
 # Flask server URL
-url = "http://127.0.0.1:5000/data"  # Example Flask URL
+url = "http://127.0.0.1:5000/data?format=binary&mode=delta"  # Example Flask URL
+sensors_url = "http://127.0.0.1:5000/sensors"  # Static sensor metadata
+
+# One ingest worker per process: it holds the only upstream connection, decodes each frame
+# once and survives reruns, so every session just reads the latest snapshot. With SENSOR_SHM
+# set, decoding and classification run in a separate process instead (python -m common.shm)
+# and this one only maps the shared memory segment it publishes to.
+@st.cache_resource
+def get_ingest():
+    if os.environ.get("SENSOR_SHM"):
+        return SharedStateReader(os.environ["SENSOR_SHM"])
+    # With ALERT_WEBHOOK set, alert transitions are posted there in the background
+    alerts = None
+    if os.environ.get("ALERT_WEBHOOK"):
+        notifier = WebhookNotifier(os.environ["ALERT_WEBHOOK"])
+        notifier.start()
+        alerts = AlertTracker(get_rules(), notifier=notifier)
+    worker = IngestWorker(url, sensors_url, alerts=alerts)
+    worker.start()
+    return worker
+
+# Map initialization
+initial_view = pdk.ViewState(latitude=12.843125306462428, longitude=80.1545516362617, zoom=16)
+
+# Layers and renderer of this session's map, built on the session's first run. They hold the
+# data of the last frame drawn, so unlike the ingest worker they are not shared.
+def get_map():
+    if "map" not in st.session_state:
+        # Scatterplot layer
+        scatterplot_layer = pdk.Layer(
+            "ScatterplotLayer",
+            id='scatter',
+            data=None,
+            get_position='[lon, lat]',
+            get_fill_color='[r, g, b, a]',
+            get_radius=10,
+            pickable=True,
+        )
 
-# DataFrame to store monitoring point data
-map_data = pd.DataFrame(columns=['lat', 'lon', 'temperature', 'uv', 'humidity', 'pressure', 'airQuality', 'color'])
+        # Heatmap layer
+        heatmap_layer = pdk.Layer(
+            'HeatmapLayer',
+            id='heatmap',
+            data=None,
+            get_position=['lon', 'lat'],
+            get_weight='temperature',  # Assuming temperature is the heatmap metric
+            radius_pixels=50,
+            intensity=1,
+            threshold=0.1,
+            opacity = 0.4
+        )
+
+        # Choropleth layer, coloured every tick by each district's mean temperature
+        choropleth_layer = pdk.Layer(
+            "GeoJsonLayer",
+            None,
+            id='choropleth',
+            stroked=False,
+            filled=True,
+            get_fill_color='properties.fill',
+            get_line_color=[255, 255, 255],
+            line_width_min_pixels=1,
+            pickable=True,
+        )
+
+        # Rings around the sensors the anomaly detector flagged, drawn over the scatter view
+        anomaly_layer = pdk.Layer(
+            "ScatterplotLayer",
+            id='anomalies',
+            data=None,
+            get_position='[lon, lat]',
+            get_radius=20,
+            stroked=True,
+            filled=False,
+            get_line_color=[214, 63, 255],
+            line_width_min_pixels=2,
+        )
+
+        # Re-sends the map only when the columns the current layer shows changed
+        renderer = DeckRenderer(None, initial_view, 'mapbox://styles/mapbox/light-v9')
+        st.session_state.map = (scatterplot_layer, heatmap_layer, choropleth_layer, anomaly_layer, renderer)
+    return st.session_state.map
+
+# Severity and offending metric of every sensor in a snapshot, classified once per tick for
+# both the status cards and the map
+def classify(snapshot):
+    # Snapshots from the shared memory worker are classified already
+    if hasattr(snapshot, "severity"):
+        return snapshot.severity, snapshot.offending
+    cached = st.session_state.get("severity")
+    if cached is None or cached[0] != snapshot.tick:
+        cached = st.session_state.severity = (snapshot.tick, *get_rules().classify(snapshot.data))
+    return cached[1], cached[2]
+
+ingest = get_ingest()
 
 # Main Dashboard Layout
 st.title("Real-time Environmental Monitoring Dashboard")
 
 # Real-time data cards
-st.markdown("### Real-time Environmental Data (Averages)")
-col_temp, col_uv, col_hum, col_press, col_air = st.columns(5)
+@st.fragment(run_every=REFRESH_SECONDS)
+def metric_cards():
+    st.markdown("### Real-time Environmental Data (Averages)")
+    if ingest.error is not None:
+        st.error(f"Failed to connect to the server: {ingest.error}")
+    # Averages of the latest tick and how far they moved over the trend window
+    trend = ingest.trend(TREND_WINDOW)
+    if trend is None or trend.empty:
+        st.info("Waiting for data...")
+        return
+    avg, change = trend.iloc[-1], trend.iloc[-1] - trend.iloc[0]
+    col_temp, col_uv, col_hum, col_press, col_air = st.columns(5)
+    col_temp.metric("Avg Temperature", f"{avg['temperature']:.2f}°F", f"{change['temperature']:+.2f}°F")
+    col_uv.metric("Avg UV Index", f"{avg['uv']:.2f}", f"{change['uv']:+.2f}")
+    col_hum.metric("Avg Humidity", f"{avg['humidity']:.2f}%", f"{change['humidity']:+.2f}%")
+    col_press.metric("Avg Pressure", f"{avg['pressure']:.2f} hPa", f"{change['pressure']:+.2f} hPa")
+    col_air.metric("Avg Air Quality", f"{avg['airQuality']:.2f}", f"{change['airQuality']:+.2f}")
 
-# Initialize placeholder metrics
-temp_metric = col_temp.empty()
-uv_metric = col_uv.empty()
-hum_metric = col_hum.empty()
-press_metric = col_press.empty()
-air_metric = col_air.empty()
+# Map, with its own view and colour widgets so changing them only reruns the map
+@st.fragment(run_every=REFRESH_SECONDS)
+def map_view():
+    # View selection for map visualization
+    view_option = st.radio("Select map view", ("Scatter View", "Heatmap View", "Choropleth View"))
+    # Metric the scatter points are coloured by (palettes per metric in common/colors.py)
+    color_metric = st.selectbox("Colour by", METRICS)
+    snapshot = ingest.latest()
+    if snapshot is None:
+        return
+    scatterplot_layer, heatmap_layer, choropleth_layer, anomaly_layer, renderer = get_map()
+    severity, offending = classify(snapshot)
+    try:
+        if view_option == "Scatter View" or view_option == "Heatmap View":
+            # Snapshots are shared between sessions, so only add columns to a shallow copy
+            map_data = snapshot.data.copy(deep=False)
+            add_color_columns(map_data, color_metric)
+            map_data['status'] = get_rules().describe(severity, offending)
+            map_data['anomaly_status'] = describe_anomalies(map_data['anomaly'])
+            if view_option == "Scatter View":
+                layers = [(scatterplot_layer, map_data), (anomaly_layer, flagged_rows(snapshot.data))]
+            else:
+                layers = [(heatmap_layer, map_data)]
+            renderer.render(
+                layers,
+                tooltip={"text": "Temp:{temperature}°F\nUV Index:{uv}\nHumidity:{humidity}%\nAir Pressure:{pressure}hPa\nAir Quality:{airQuality}\nStatus:{status}\nAnomaly:{anomaly_status}\n at [{lat}, {lon}]"},
+                map_style='mapbox://styles/mapbox/light-v9' if view_option != "Scatter View" else 'mapbox://styles/mapbox/dark-v11',
+                chart=map_chart,
+            )
+        else:
+            # Per-district aggregates over the district each sensor was assigned to at startup
+            summary = district_summary(snapshot.data, 'temperature', severity == CRITICAL)
+            renderer.render(
+                [(choropleth_layer, choropleth_geojson(geometry_for_zoom(initial_view.zoom), summary))],
+                tooltip={"text": "{NAME_2}\nMean Temp:{mean}°F\nMax Temp:{max}°F\nCritical:{critical}/{sensors}"},
+                chart=map_chart,
+            )
+    except Exception as e:
+        st.error(f"Error: {e}")
 
-# View selection for map visualization
-view_option = st.radio("Select map view", ("Scatter View", "Heatmap View"))
+# Status section
+@st.fragment(run_every=REFRESH_SECONDS)
+def status_cards():
+    st.markdown("### Status of Monitoring Points")
+    snapshot = ingest.latest()
+    if snapshot is None:
+        return
+    # Classify points based on the thresholds
+    severity, _ = classify(snapshot)
+    critical_count, warning_count, ok_count = get_rules().counts(severity)
+    total_points = len(snapshot.data)
+    # Sensors drifting from their own baseline, whatever their threshold status
+    anomaly_count = int((snapshot.data["anomaly"].to_numpy() >= 0).sum())
+    col1, col2, col3, col4 = st.columns(4)
+    col1.markdown(f'<div class="status-card status-critical"><div class="metric-label">Critical</div><div class="metric-value">{critical_count}/{total_points}</div></div>', unsafe_allow_html=True)
+    col2.markdown(f'<div class="status-card status-warning"><div class="metric-label">Warning</div><div class="metric-value">{warning_count}/{total_points}</div></div>', unsafe_allow_html=True)
+    col3.markdown(f'<div class="status-card status-ok"><div class="metric-label">OK</div><div class="metric-value">{ok_count}/{total_points}</div></div>', unsafe_allow_html=True)
+    col4.markdown(f'<div class="status-card status-anomaly"><div class="metric-label">Anomalous</div><div class="metric-value">{anomaly_count}/{total_points}</div></div>', unsafe_allow_html=True)
 
-# Map initialization
-initial_view = pdk.ViewState(latitude=12.843125306462428, longitude=80.1545516362617, zoom=16)
-# Scatterplot layer
-scatterplot_layer = pdk.Layer(
-    "ScatterplotLayer",
-    data=map_data,
-    get_position='[lon, lat]',
-    get_fill_color='color',
-    get_radius=10,
-    pickable=True,
-)
-
-# Heatmap layer
-heatmap_layer = pdk.Layer(
-    'HeatmapLayer',
-    data=map_data,
-    get_position=['lon', 'lat'],
-    get_weight='temperature',  # Assuming temperature is the heatmap metric
-    radius_pixels=50,
-    intensity=1,
-    threshold=0.1,
-    opacity = 0.4
-)
-
-# Choropleth layer
-with open("../JSON/TamilNadu.geojson") as f:
-    geojson_data = json.load(f)
-
-choropleth_layer = pdk.Layer(
-    "GeoJsonLayer",
-    geojson_data,
-    stroked=False,
-    filled=True,
-    get_fill_color=[0, 128, 255, 180],  # Blueish color for Tamil Nadu
-    get_line_color=[255, 255, 255],
-    line_width_min_pixels=1,
-)
-
-# Create map chart (default to Scatterplot)
-deck = pdk.Deck(
-    initial_view_state=initial_view,
-    layers=[scatterplot_layer],
-    map_style='mapbox://styles/mapbox/light-v9',
-    tooltip={"text": "Temp: {temperature}°F, UV: {uv}, Humidity: {humidity}%, Air Quality: {airQuality}"}
-)
-deck_heatmap = pdk.Deck(
-    initial_view_state=initial_view,
-    layers=[heatmap_layer],
-    map_style='mapbox://styles/mapbox/light-v9',
-    tooltip={"text": "Temp: {temperature}°F, UV: {uv}, Humidity: {humidity}%, Air Quality: {airQuality}"}
-)
-deck_choro =  pdk.Deck(
-    initial_view_state=initial_view,
-    layers=[choropleth_layer],
-    map_style='mapbox://styles/mapbox/light-v9',
-    tooltip={"text": "Temp: {temperature}°F, UV: {uv}, Humidity: {humidity}%, Air Quality: {airQuality}"}
-)
-map_chart = st.pydeck_chart(deck)
-
-# Function to classify points based on thresholds
-def classify_points(data):
-    critical_count = sum((data['temperature'] >= TEMP_CRITICAL) | (data['uv'] >= UV_CRITICAL) | 
-                         (data['humidity'] >= HUMIDITY_CRITICAL) | (data['pressure'] >= PRESSURE_CRITICAL) | 
-                         (data['airQuality'] >= AIR_QUALITY_CRITICAL))
-    warning_count = sum((data['temperature'] >= TEMP_WARNING) | (data['uv'] >= UV_WARNING) | 
-                        (data['humidity'] >= HUMIDITY_WARNING) | (data['pressure'] >= PRESSURE_WARNING) | 
-                        (data['airQuality'] >= AIR_QUALITY_WARNING)) - critical_count
-    ok_count = len(data) - critical_count - warning_count
-    return critical_count, warning_count, ok_count
+# Drill-down into one sensor: its readings of one metric over a window of ticks
+@st.fragment(run_every=REFRESH_SECONDS)
+def drill_down():
+    st.markdown("### Sensor Drill-down")
+    col_sensor, col_metric, col_window = st.columns(3)
+    drill_sensor = col_sensor.number_input("Sensor id", min_value=0, value=0, step=1)
+    drill_metric = col_metric.selectbox("Metric", METRICS)
+    drill_window = col_window.slider("Window (ticks)", min_value=10, max_value=300, value=TREND_WINDOW)
+    # Recent readings and rolling statistics of the drill-down sensor
+    readings, stats = ingest.sensor_history(int(drill_sensor), drill_window)
+    if readings is None:
+        return
+    st.line_chart(readings[drill_metric])
+    st.caption(f"{drill_metric} over the last {len(readings)} ticks: mean {stats[f'{drill_metric}_mean']:.2f}, "
+               f"min {stats[f'{drill_metric}_min']:.2f}, max {stats[f'{drill_metric}_max']:.2f}, "
+               f"change {stats[f'{drill_metric}_rate']:+.3f}/s")
 
-# Status section
-st.markdown("### Status of Monitoring Points")
-col1, col2, col3 = st.columns(3)
-critical_metric = col1.empty()
-warning_metric = col2.empty()
-ok_metric = col3.empty()
-
-# Continuously fetch and update data
-try:
-    response = requests.get(url, stream=True)
-    for line in response.iter_lines():
-        if line:
-            try:
-                decoded_line = line.decode('utf-8').strip()
-                if decoded_line.startswith("data:"):
-                    json_data = decoded_line[5:]
-                    data = json.loads(json_data)
-                    
-                    if isinstance(data, list) and all(isinstance(item, dict) for item in data):
-                        # Process new data
-                        new_data = pd.DataFrame(data)
-                        new_data['color'] = new_data['temperature'].apply(get_temperature_color)
-                        
-                        # Replace old map data
-                        map_data = new_data
-                        
-                        # Compute average values for each metric
-                        avg_temp = new_data['temperature'].mean()
-                        avg_uv = new_data['uv'].mean()
-                        avg_humidity = new_data['humidity'].mean()
-                        avg_pressure = new_data['pressure'].mean()
-                        avg_air_quality = new_data['airQuality'].mean()
-                        
-                        # Update real-time metrics on cards
-                        temp_metric.metric("Avg Temperature", f"{avg_temp:.2f}°F")
-                        uv_metric.metric("Avg UV Index", f"{avg_uv:.2f}")
-                        hum_metric.metric("Avg Humidity", f"{avg_humidity:.2f}%")
-                        press_metric.metric("Avg Pressure", f"{avg_pressure:.2f} hPa")
-                        air_metric.metric("Avg Air Quality", f"{avg_air_quality:.2f}")
-                        
-                        # Classify points based on the thresholds
-                        critical_count, warning_count, ok_count = classify_points(new_data)
-                        
-                        # Update status metrics
-                        total_points = len(new_data)
-                        critical_metric.markdown(f'<div class="status-card status-critical"><div class="metric-label">Critical</div><div class="metric-value">{critical_count}/{total_points}</div></div>', unsafe_allow_html=True)
-                        warning_metric.markdown(f'<div class="status-card status-warning"><div class="metric-label">Warning</div><div class="metric-value">{warning_count}/{total_points}</div></div>', unsafe_allow_html=True)
-                        ok_metric.markdown(f'<div class="status-card status-ok"><div class="metric-label">OK</div><div class="metric-value">{ok_count}/{total_points}</div></div>', unsafe_allow_html=True)
-                        
-                        # Update the map layer based on view option
-                        if view_option == "Scatter View":
-                            layer = scatterplot_layer
-                        elif view_option == "Heatmap View":
-                            layer = heatmap_layer
-                        elif view_option == "Choropleth View":
-                            layer = choropleth_layer
-                        
-                        # Render the updated map
-                        if view_option == "Scatter View" or view_option=="Heatmap View":
-                            layer.data = map_data
-                            deck = pdk.Deck(
-                                initial_view_state=initial_view,
-                                layers=[layer],
-                                map_style='mapbox://styles/mapbox/light-v9' if view_option != "Scatter View" else 'mapbox://styles/mapbox/dark-v11',
-                                tooltip={"text": "Temp:{temperature}°F\nUV Index:{uv}\nHumidity:{humidity}%\nAir Pressure:{pressure}hPa\nAir Quality:{airQuality}\n at [{lat}, {lon}]"},
-                            )
-                            map_chart.pydeck_chart(deck)
-                        else:
-                            layer.data = map_data
-                            map_chart.pydeck_chart(pdk.Deck(
-                                layers=[choropleth_layer],
-                                initial_view_state=initial_view,
-                                map_style='mapbox://styles/mapbox/light-v9',  # Choose a suitable Mapbox style
-                                tooltip={"text": "Temp:{temperature}°F\nUV Index:{uv}\nHumidity:{humidity}%\nAir Pressure:{pressure}hPa\nAir Quality:{airQuality}\n at [{lat}, {lon}]"},
-                            ))
-
-                    else:
-                        st.error("Data format is incorrect.")
-            except json.JSONDecodeError:
-                st.error("Failed to decode JSON.")
-            except Exception as e:
-                st.error(f"Error: {e}")
-        
-        time.sleep(1)  # Optional delay for smoother updates
-except requests.exceptions.RequestException as e:
-    st.error(f"Failed to connect to the server: {e}")
+metric_cards()
+# The map fragment draws into a placeholder created outside it, below its widgets, so its
+# reruns leave an unchanged map on the page instead of sending it again
+map_controls = st.container()
+map_chart = st.empty()
+with map_controls:
+    map_view()
+status_cards()
+drill_down()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Tests import the shared package the same way the scripts do (run `python -m pytest` from WebDev)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
@@ -0,0 +1,56 @@
+import numpy as np
+
+from common.alerts import AlertTracker, deduplicate
+from common.frames import METRICS
+from common.rules import ThresholdRules
+
+THRESHOLDS = {"temperature": {"warning": 60, "critical": 80}}
+
+
+def readings(temperature):
+    values = np.full((len(METRICS), 1), np.nan)
+    values[0, 0] = temperature
+    return values
+
+
+def run(tracker, temperatures):
+    transitions = []
+    for tick, temperature in enumerate(temperatures):
+        transitions += [(tick, alert["previous"], alert["severity"]) for alert in tracker.update(readings(temperature))]
+    return transitions
+
+
+def test_raise_and_clear_after_minimum_duration():
+    tracker = AlertTracker(ThresholdRules(THRESHOLDS), raise_ticks=3, clear_ticks=5)
+    temperatures = [70] * 2 + [85] * 5 + [65] * 10 + [50] * 10
+    assert run(tracker, temperatures) == [(2, "ok", "warning"), (4, "warning", "critical")
+                                          , (11, "critical", "warning"), (21, "warning", "ok")]
+
+
+def test_single_tick_spike_does_not_alert():
+    tracker = AlertTracker(ThresholdRules(THRESHOLDS), raise_ticks=3)
+    assert run(tracker, [50, 50, 95, 50, 50, 95, 50]) == []
+
+
+def test_flapping_around_critical_raises_warning_once():
+    tracker = AlertTracker(ThresholdRules(THRESHOLDS), raise_ticks=3, clear_ticks=5)
+    # Always at or above warning, above critical every other tick
+    assert run(tracker, [79.8, 80.2] * 100) == [(2, "ok", "warning")]
+
+
+def test_hysteresis_holds_alert_just_below_threshold():
+    # The temperature margin is 1.5 °F: 79 stays critical, 78 clears
+    tracker = AlertTracker(ThresholdRules(THRESHOLDS), raise_ticks=1, clear_ticks=1)
+    assert run(tracker, [81, 79, 79.5, 79, 78]) == [(0, "ok", "critical"), (4, "critical", "warning")]
+
+
+def test_alert_carries_offending_metric_and_value():
+    tracker = AlertTracker(ThresholdRules(THRESHOLDS), raise_ticks=1)
+    alert, = tracker.update(readings(85.0))
+    assert alert["metric"] == "temperature" and alert["value"] == 85.0
+
+
+def test_deduplicate_merges_and_drops_round_trips():
+    alerts = [{"sensor": 1, "previous": "ok", "severity": "warning"}, {"sensor": 1, "previous": "warning", "severity": "critical"}
+              , {"sensor": 2, "previous": "ok", "severity": "warning"}, {"sensor": 2, "previous": "warning", "severity": "ok"}]
+    assert deduplicate(alerts) == [{"sensor": 1, "previous": "ok", "severity": "critical"}]
@@ -0,0 +1,116 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from common.broadcast import Broadcaster, FrameEncoder
+from common.delta import SensorState
+from common.frames import DELTA, FULL, decode_payload
+from common.registry import SensorRegistry
+
+REGISTRY = SensorRegistry([[11.0, 78.0], [12.0, 79.0], [10.5, 77.5], [13.0, 80.0]])
+DELTA_KEY = ("binary", False, 100)
+FULL_KEY = ("json", False, None)
+
+
+# Broadcaster driven one tick at a time by the test instead of by its producer thread
+class SteppedBroadcaster(Broadcaster):
+    def __init__(self, **kwargs):
+        super().__init__(None, lambda key: FrameEncoder(REGISTRY, *key), **kwargs)
+
+    def _start(self):
+        pass
+
+    def step(self, readings):
+        tick = self._encode_tick(readings)
+        with self.lock:
+            self._push(*tick)
+
+
+def readings(temperature):
+    values = np.tile([50.0, 5.0, 60.0, 1000.0, 100.0], (len(REGISTRY), 1))
+    values[:, 0] = temperature
+    return values
+
+
+def new_state():
+    return SensorState(pd.DataFrame({"lat": REGISTRY.lat, "lon": REGISTRY.lon}))
+
+
+def received(subscription):
+    frames = []
+    while subscription.queue.qsize():
+        message = subscription.queue.get_nowait()
+        subscription.taken()
+        frames.append(decode_payload(message.decode("utf-8")[len("data:"):]))
+    return frames
+
+
+def test_drop_oldest_keeps_the_newest_frames():
+    broadcaster = SteppedBroadcaster(queue_size=3)
+    subscription = broadcaster.subscribe(FULL_KEY)
+    for temperature in range(5):
+        broadcaster.step(readings(temperature))
+    assert [frame["temperature"][0] for frame in received(subscription)] == [2, 3, 4]
+    assert subscription.dropped == 2
+
+
+def test_latest_policy_keeps_one_frame():
+    broadcaster = SteppedBroadcaster(queue_size=3, policy="latest")
+    subscription = broadcaster.subscribe(FULL_KEY)
+    for temperature in range(5):
+        broadcaster.step(readings(temperature))
+    assert [frame["temperature"][0] for frame in received(subscription)] == [4]
+    assert subscription.dropped == 4
+
+
+def test_slow_delta_client_gets_a_catch_up_frame():
+    broadcaster = SteppedBroadcaster(queue_size=2)
+    fast = broadcaster.subscribe(DELTA_KEY)
+    slow = broadcaster.subscribe(DELTA_KEY)
+    fast_state, slow_state = new_state(), new_state()
+    for temperature in range(6):
+        broadcaster.step(readings(temperature))
+        for frame in received(fast):
+            fast_state.apply(frame)
+    frames = received(slow)
+    # Every time its queue filled up, the backlog of deltas was replaced by one full frame,
+    # so the client ends up with the same state as one that kept up
+    assert frames[0].attrs["kind"] == FULL
+    assert [frame.attrs["kind"] for frame in frames[1:]] == [DELTA] * (len(frames) - 1)
+    assert len(frames) <= 2 and slow.dropped > 0
+    for frame in frames:
+        slow_state.apply(frame)
+    np.testing.assert_allclose(slow_state.values, fast_state.values)
+
+
+def test_late_delta_subscriber_starts_from_a_full_frame():
+    broadcaster = SteppedBroadcaster(queue_size=4)
+    first = broadcaster.subscribe(DELTA_KEY)
+    broadcaster.step(readings(50))
+    broadcaster.step(readings(55))
+    received(first)
+    # No catch-up frame for the last tick was built, so the new client waits for the next one
+    late = broadcaster.subscribe(DELTA_KEY)
+    assert late.needs_catch_up and late.queue.qsize() == 0
+    broadcaster.step(readings(60))
+    frames = received(late)
+    assert [frame.attrs["kind"] for frame in frames] == [FULL]
+    assert frames[0]["temperature"].tolist() == [60.0] * len(REGISTRY)
+    # That frame is cached, so the next client to join before the next tick starts from it
+    later = broadcaster.subscribe(DELTA_KEY)
+    assert [frame.attrs["kind"] for frame in received(later)] == [FULL]
+    assert [frame.attrs["kind"] for frame in received(first)] == [DELTA]
+
+
+def test_clients_behind_for_too_long_are_disconnected():
+    broadcaster = SteppedBroadcaster(queue_size=4, max_lag=0.01)
+    stalled = broadcaster.subscribe(FULL_KEY)
+    reading = broadcaster.subscribe(FULL_KEY)
+    for temperature in range(3):
+        broadcaster.step(readings(temperature))
+        received(reading)
+        time.sleep(0.02)
+    assert broadcaster.evicted == 1
+    assert broadcaster.subscribers == {reading}
+    assert stalled.queue.get_nowait() is None
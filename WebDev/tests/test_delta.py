@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+
+from common.delta import DeltaEncoder, SensorState
+from common.frames import DELTA, FULL, METRICS, decode_payload, encode_frame
+
+
+def readings(sensors=5, temperature=50.0):
+    values = np.tile([50.0, 5.0, 60.0, 1000.0, 100.0], (sensors, 1))
+    values[:, 0] = temperature
+    return values
+
+
+def test_keyframe_then_only_moved_sensors():
+    encoder = DeltaEncoder(keyframe_interval=10)
+    values = readings()
+    kind, rows = encoder.update(values, now=0)
+    assert kind == FULL and rows.tolist() == [0, 1, 2, 3, 4]
+    # Below the 0.5 °F tolerance
+    values[1, 0] += 0.4
+    kind, rows = encoder.update(values, now=1)
+    assert kind == DELTA and rows.tolist() == []
+    values[1, 0] += 0.4
+    values[3, 1] += 1.0
+    kind, rows = encoder.update(values, now=2)
+    assert kind == DELTA and rows.tolist() == [1, 3]
+    kind, rows = encoder.update(values, now=10)
+    assert kind == FULL and len(rows) == 5
+
+
+def test_small_changes_are_measured_from_the_last_sent_value():
+    encoder = DeltaEncoder(keyframe_interval=100)
+    values = readings()
+    encoder.update(values, now=0)
+    sent = []
+    for tick in range(1, 6):
+        values[0, 0] += 0.2
+        sent.append(encoder.update(values, now=tick)[1].tolist())
+    # 0.2, 0.4, 0.6 (sent), then 0.2 and 0.4 since the sent value
+    assert sent == [[], [], [0], [], []]
+
+
+def test_missing_reading_is_a_change():
+    encoder = DeltaEncoder(keyframe_interval=100)
+    values = readings()
+    encoder.update(values, now=0)
+    values[2, 0] = np.nan
+    assert encoder.update(values, now=1)[1].tolist() == [2]
+    assert encoder.update(values, now=2)[1].tolist() == []
+    values[2, 0] = 50.0
+    assert encoder.update(values, now=3)[1].tolist() == [2]
+
+
+def test_new_sensor_count_starts_with_a_keyframe():
+    encoder = DeltaEncoder(keyframe_interval=100)
+    encoder.update(readings(5), now=0)
+    assert encoder.update(readings(6), now=1)[0] == FULL
+
+
+def test_state_follows_keyframes_and_deltas():
+    registry = pd.DataFrame({"lat": [10.0, 11.0, 12.0], "lon": [78.0, 79.0, 80.0]}, index=[0, 1, 2])
+    state = SensorState(registry)
+    encoder = DeltaEncoder(keyframe_interval=100)
+    values = readings(3)
+    for tick, temperature in enumerate([50.0, 51.0, 53.0]):
+        values[1, 0] = temperature
+        kind, rows = encoder.update(values, now=tick)
+        frame = {"id": rows.astype(float)}
+        for i, metric in enumerate(METRICS):
+            frame[metric] = values[rows, i]
+        state.apply(decode_payload(encode_frame(frame, "binary", kind)))
+    np.testing.assert_allclose(state.values, values.T)
+    assert state.to_frame()["lat"].tolist() == [10.0, 11.0, 12.0]
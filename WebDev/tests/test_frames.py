@@ -0,0 +1,72 @@
+import base64
+import json
+
+import numpy as np
+import pytest
+
+from common.frames import (DELTA, FULL, METRICS, decode_payload, encode_binary, encode_frame, iter_sse_data
+                           , payload_kind, sse_message)
+
+
+def columns(rows=4):
+    values = {"id": np.arange(rows, dtype=float)}
+    for i, metric in enumerate(METRICS):
+        values[metric] = np.linspace(i, i + 1, rows)
+    return values
+
+
+@pytest.mark.parametrize("fmt", ["json", "binary"])
+@pytest.mark.parametrize("kind", [FULL, DELTA])
+def test_round_trip(fmt, kind):
+    sent = columns()
+    frame = decode_payload(encode_frame(sent, fmt, kind))
+    assert frame.attrs["kind"] == kind
+    assert list(frame.columns) == ["id"] + METRICS
+    for name, values in sent.items():
+        np.testing.assert_allclose(frame[name].to_numpy(), values, rtol=1e-6)
+
+
+def test_json_sends_nan_as_null():
+    sent = columns()
+    sent["temperature"][1] = np.nan
+    sent["uv"][2] = np.inf
+    payload = encode_frame(sent, "json")
+    readings = json.loads(payload)
+    assert readings[1]["temperature"] is None and readings[2]["uv"] is None
+    frame = decode_payload(payload)
+    assert np.isnan(frame["temperature"][1]) and np.isnan(frame["uv"][2])
+    assert frame["temperature"].drop(1).notna().all()
+
+
+def test_binary_keeps_nan():
+    sent = columns()
+    sent["humidity"][0] = np.nan
+    frame = decode_payload(encode_frame(sent, "binary"))
+    assert np.isnan(frame["humidity"][0]) and frame["humidity"][1:].notna().all()
+
+
+def test_empty_delta_keeps_columns():
+    frame = decode_payload(encode_frame({"id": np.array([])} | {m: np.array([]) for m in METRICS}, "json", DELTA))
+    assert frame.empty and frame.attrs["kind"] == DELTA
+    assert list(frame.columns) == ["id"] + METRICS
+
+
+@pytest.mark.parametrize("fmt", ["json", "binary"])
+def test_payload_kind_without_decoding(fmt):
+    assert payload_kind(encode_frame(columns(), fmt, FULL)) == FULL
+    assert payload_kind(encode_frame(columns(), fmt, DELTA)) == DELTA
+
+
+def test_binary_rejects_other_data():
+    raw = bytearray(encode_binary(columns()))
+    raw[:4] = b"XXXX"
+    with pytest.raises(ValueError):
+        decode_payload(base64.b64encode(bytes(raw)).decode("ascii"))
+
+
+def test_sse_lines_split_across_chunks():
+    payloads = [encode_frame(columns(), "binary"), encode_frame(columns(), "json")]
+    stream = "".join(sse_message(payload) for payload in payloads).encode()
+    chunks = [stream[i:i + 7] for i in range(0, len(stream), 7)]
+    # The space after "data:" is left for decode_payload to strip
+    assert [line.decode().strip() for line in iter_sse_data(chunks)] == payloads
@@ -0,0 +1,75 @@
+import time
+
+import numpy as np
+import pytest
+
+from common.frames import METRICS
+from common.intake import IntakeBuffer, decode_batch, encode_batch, encode_json_batch
+
+ENCODERS = [encode_batch, encode_json_batch]
+
+
+def batch(encode, node, sequence, temperatures, ids=None):
+    ids = np.arange(len(temperatures)) if ids is None else np.asarray(ids)
+    return encode(node, sequence, {"id": ids.astype(np.float32), "temperature": np.asarray(temperatures, dtype=np.float32)})
+
+
+@pytest.mark.parametrize("encode", ENCODERS)
+def test_batch_round_trip(encode):
+    node, sequence, ids, values = decode_batch(batch(encode, "gate-1", 42, [71.5, 72.0]))
+    assert (node, sequence, ids.tolist()) == ("gate-1", 42, [0, 1])
+    assert values[METRICS.index("temperature")].tolist() == [71.5, 72.0]
+    # Metrics the node did not send are NaN
+    assert np.isnan(values[METRICS.index("uv")]).all()
+
+
+@pytest.mark.parametrize("encode", ENCODERS)
+def test_retries_are_acknowledged_but_not_applied(encode):
+    intake = IntakeBuffer(3)
+    assert not intake.submit(batch(encode, "a", 1, [50, 51]))["duplicate"]
+    # A retry of batch 1 carrying different values must not overwrite it
+    ack = intake.submit(batch(encode, "a", 1, [90, 91]))
+    assert ack["duplicate"] and ack["accepted"] == 0
+    assert intake.submit(batch(encode, "a", 0, [60, 61]))["duplicate"] is False
+    readings = intake.next()
+    assert readings[:2, METRICS.index("temperature")].tolist() == [60, 61]
+    assert intake.stats()["duplicates"] == 1
+
+
+def test_sequences_are_per_node_and_gaps_are_counted_as_lost():
+    intake = IntakeBuffer(4)
+    intake.submit(batch(encode_batch, "a", 1, [50], ids=[0]))
+    intake.submit(batch(encode_batch, "b", 1, [52], ids=[1]))
+    intake.submit(batch(encode_batch, "a", 4, [51], ids=[0]))
+    # Older than the last applied batch of "a": a late retry
+    assert intake.submit(batch(encode_batch, "a", 3, [99], ids=[0]))["duplicate"]
+    stats = intake.stats()
+    assert (stats["nodes"], stats["batches"], stats["lost"], stats["duplicates"]) == (2, 3, 2, 1)
+    assert intake.next()[:2, METRICS.index("temperature")].tolist() == [51, 52]
+
+
+def test_latest_reading_per_sensor_wins_and_unsent_metrics_are_kept():
+    intake = IntakeBuffer(2)
+    intake.submit(encode_batch("a", 1, {"id": np.array([0.0, 1.0]), "temperature": np.array([50.0, 51.0])
+                                        , "uv": np.array([3.0, 4.0])}))
+    intake.submit(batch(encode_batch, "a", 2, [55, 56, 57], ids=[0, 0, 1]))
+    readings = intake.next()
+    assert readings[:, METRICS.index("temperature")].tolist() == [56, 57]
+    assert readings[:, METRICS.index("uv")].tolist() == [3, 4]
+
+
+def test_unknown_sensors_and_infinite_readings_are_rejected():
+    intake = IntakeBuffer(2)
+    ack = intake.submit(batch(encode_batch, "a", 1, [50, np.inf, 52], ids=[0, 1, 7]))
+    assert (ack["accepted"], ack["rejected"]) == (1, 2)
+    with pytest.raises(ValueError):
+        intake.submit(b'{"node": "a"}')
+
+
+def test_silent_sensors_go_stale():
+    intake = IntakeBuffer(2, stale_after=0.05)
+    intake.submit(batch(encode_batch, "a", 1, [50, 51]))
+    assert np.isfinite(intake.next()[:, 0]).all()
+    time.sleep(0.1)
+    intake.submit(batch(encode_batch, "a", 2, [52], ids=[1]))
+    assert np.isnan(intake.next()[0, 0]) and intake.next()[1, 0] == 52
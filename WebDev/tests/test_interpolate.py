@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from scipy.interpolate import griddata
+
+from common.interpolate import IDWInterpolator, TriangulationInterpolator, get_interpolator, make_grid
+
+
+def sensors(count=300, seed=0):
+    rng = np.random.default_rng(seed)
+    points = rng.uniform([76.0, 8.0], [80.0, 13.0], (count, 2))
+    return points, rng.normal(55, 8, count)
+
+
+@pytest.mark.parametrize("method", ["linear", "cubic"])
+def test_matches_griddata(method):
+    points, values = sensors()
+    grid_x, grid_y = make_grid(points[:, 0], points[:, 1], 60)
+    interpolator = TriangulationInterpolator(points, grid_x, grid_y, method)
+    expected = griddata(points, values, (grid_x, grid_y), method=method)
+    result = interpolator(values)
+    np.testing.assert_array_equal(np.isnan(result), np.isnan(expected))
+    np.testing.assert_allclose(result, expected, atol=1e-9, equal_nan=True)
+    # The weights are reused for the next tick
+    np.testing.assert_allclose(interpolator(values + 1), expected + 1, atol=1e-9, equal_nan=True)
+
+
+@pytest.mark.parametrize("method", ["linear", "cubic"])
+def test_sensors_without_a_reading_are_left_out(method):
+    points, values = sensors()
+    values[::9] = np.nan
+    valid = np.isfinite(values)
+    grid_x, grid_y = make_grid(points[:, 0], points[:, 1], 60)
+    interpolator = TriangulationInterpolator(points, grid_x, grid_y, method)
+    expected = griddata(points[valid], values[valid], (grid_x, grid_y), method=method)
+    np.testing.assert_allclose(interpolator(values), expected, atol=1e-9, equal_nan=True)
+    assert np.isnan(interpolator(np.full(len(points), np.nan))).all()
+
+
+def test_idw_at_a_sensor_takes_its_value():
+    points = np.array([[0.0, 0.0], [1.0, 0.0], [0.0, 1.0], [1.0, 1.0]])
+    grid_x, grid_y = np.mgrid[0:1:2j, 0:1:2j]
+    interpolator = IDWInterpolator(points, grid_x, grid_y, k=3)
+    values = np.array([10.0, 20.0, 30.0, 40.0])
+    np.testing.assert_allclose(interpolator(values), [[10.0, 30.0], [20.0, 40.0]], rtol=1e-5)
+
+
+def test_idw_renormalises_over_sensors_with_a_reading():
+    points, values = sensors()
+    grid_x, grid_y = make_grid([76.0, 80.0], [8.0, 13.0], 50)
+    interpolator = IDWInterpolator(points, grid_x, grid_y)
+    values[::5] = np.nan
+    result = interpolator(values)
+    assert np.isfinite(result).all()
+    assert np.nanmin(values) - 1e-3 <= result.min() and result.max() <= np.nanmax(values) + 1e-3
+
+
+def test_get_interpolator_reuses_one_per_layout():
+    points, _ = sensors()
+    grid_x, grid_y = make_grid(points[:, 0], points[:, 1], 20)
+    first = get_interpolator(points, grid_x, grid_y, "linear")
+    assert get_interpolator(points.copy(), grid_x, grid_y, "linear") is first
+    assert get_interpolator(points[1:], grid_x, grid_y, "linear") is not first
@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from common.frames import METRICS
+from common.rules import CRITICAL, OK, WARNING, ThresholdRules
+
+FRONTEND_THRESHOLDS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Frontend", "thresholds.json")
+
+
+# The status counts of the original Frontend/app.py, before the thresholds moved to thresholds.json
+def classify_points(data):
+    TEMP_CRITICAL, TEMP_WARNING = 80, 60
+    UV_CRITICAL, UV_WARNING = 8, 5
+    HUMIDITY_CRITICAL, HUMIDITY_WARNING = 90, 70
+    PRESSURE_CRITICAL, PRESSURE_WARNING = 1020, 1000
+    AIR_QUALITY_CRITICAL, AIR_QUALITY_WARNING = 150, 100
+    critical_count = sum((data['temperature'] >= TEMP_CRITICAL) | (data['uv'] >= UV_CRITICAL) |
+                         (data['humidity'] >= HUMIDITY_CRITICAL) | (data['pressure'] >= PRESSURE_CRITICAL) |
+                         (data['airQuality'] >= AIR_QUALITY_CRITICAL))
+    warning_count = sum((data['temperature'] >= TEMP_WARNING) | (data['uv'] >= UV_WARNING) |
+                        (data['humidity'] >= HUMIDITY_WARNING) | (data['pressure'] >= PRESSURE_WARNING) |
+                        (data['airQuality'] >= AIR_QUALITY_WARNING)) - critical_count
+    ok_count = len(data) - critical_count - warning_count
+    return critical_count, warning_count, ok_count
+
+
+# Readings spread across every band, with some exactly on a threshold and some missing
+def sample(sensors=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({"temperature": rng.uniform(40, 90, sensors), "uv": rng.uniform(0, 10, sensors)
+                         , "humidity": rng.uniform(40, 100, sensors), "pressure": rng.uniform(980, 1030, sensors)
+                         , "airQuality": rng.uniform(0, 200, sensors)})
+    data.loc[::97, "temperature"] = 80.0
+    data.loc[::89, "uv"] = 5.0
+    data.loc[::53, "humidity"] = np.nan
+    return data
+
+
+def test_counts_match_the_original_classification():
+    rules = ThresholdRules.load(FRONTEND_THRESHOLDS)
+    for seed in range(3):
+        data = sample(seed=seed)
+        severity, _ = rules.classify(data)
+        assert rules.counts(severity) == classify_points(data)
+
+
+def test_array_input_matches_frame_input():
+    rules = ThresholdRules.load(FRONTEND_THRESHOLDS)
+    data = sample()
+    from_frame = rules.classify(data)
+    from_array = rules.classify(data[METRICS].to_numpy().T)
+    np.testing.assert_array_equal(from_frame[0], from_array[0])
+    np.testing.assert_array_equal(from_frame[1], from_array[1])
+
+
+def test_offending_metric_is_the_first_at_the_worst_level():
+    rules = ThresholdRules.load(FRONTEND_THRESHOLDS)
+    data = pd.DataFrame({"temperature": [50, 65, 65, 85, np.nan], "uv": [1, 9, 6, 9, 1]
+                         , "humidity": [50, 50, 50, 50, 50], "pressure": [990, 990, 990, 990, 990]
+                         , "airQuality": [10, 10, 10, 10, 10]})
+    severity, offending = rules.classify(data)
+    assert severity.tolist() == [OK, CRITICAL, WARNING, CRITICAL, OK]
+    assert [rules.metrics[i] if i >= 0 else None for i in offending] == [None, "uv", "temperature", "temperature", None]
+    assert list(rules.describe(severity, offending)) == ["ok", "critical (uv)", "warning (temperature)"
+                                                         , "critical (temperature)", "ok"]
+
+
+def test_metrics_without_thresholds_are_not_checked():
+    rules = ThresholdRules({"uv": {"warning": 5, "critical": 8}})
+    data = pd.DataFrame({"temperature": [500.0, 500.0], "uv": [1.0, 6.0]})
+    assert rules.classify(data)[0].tolist() == [OK, WARNING]
+
+
+def test_relaxed_lowers_every_threshold_by_its_margin():
+    rules = ThresholdRules.load(FRONTEND_THRESHOLDS).relaxed({"temperature": 1.5})
+    assert rules.matrix[:, rules.metrics.index("temperature")].tolist() == [58.5, 78.5]
+    assert rules.matrix[:, rules.metrics.index("uv")].tolist() == [5, 8]